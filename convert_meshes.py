@@ -0,0 +1,26 @@
+import argparse
+
+from datasets.front_future_3d import FrontFuture3D
+from datasets.object_net_3d import ObjectNet3D
+from datasets.scenes_3d import Scenes3D
+from input_handler import InputHandler
+
+parser = argparse.ArgumentParser(description='Convert OBJ models into the binary mesh store')
+parser.add_argument('-d', '--dataset', choices=['scenes_3d', 'front_future', 'shape_net'], default='scenes_3d')
+parser.add_argument('-p', '--data_path', default='./data')
+parser.add_argument('-w', '--workers', default=1, type=InputHandler.validate_positive_integer)
+parser.add_argument('-f', '--force', default=False, type=InputHandler.str2bool,
+                    help='Convert every model again, even if its source did not change')
+args = parser.parse_args()
+
+InputHandler.print_params(args)
+
+dataset = None
+if args.dataset == 'scenes_3d':
+    dataset = Scenes3D(args.data_path)
+elif args.dataset == 'front_future':
+    dataset = FrontFuture3D(args.data_path)
+elif args.dataset == 'shape_net':
+    dataset = ObjectNet3D(args.data_path)
+
+dataset.mesh_store.convert(dataset.get_model_sources(), workers=args.workers, force=args.force)
@@ -1,9 +1,14 @@
-import csv
+import json
 import os
 import random
 from abc import ABC, abstractmethod
 
+from utils.image_encoder import ImageEncoder
 from utils.images_utils import ImagesUtils
+from utils.metadata_splitter import MetadataSplitter
+from utils.metadata_writer import MetadataWriter
+from utils.shard_writer import ShardWriter
+from utils.work_manifest import WorkManifest
 
 
 class BaseGenerator(ABC):
@@ -13,6 +18,26 @@ class BaseGenerator(ABC):
         self._compare_metadata = None
         self._output_dir = None
         self._compare_dir = None
+        self._metadata_writer = None
+        self._compare_metadata_writer = None
+        self._shard_writer = None
+        self._shard_format = None
+        self._shard_size = None
+        self._pending_images = {}
+        self._image_encoder = ImageEncoder()
+        self._manifest = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        # Writes the remaining outputs, then releases the dataset resources like image prefetch threads
+        self._close_metadata()
+        if hasattr(self._dataset, 'close'):
+            self._dataset.close()
 
     @abstractmethod
     def generate(self, count):
@@ -26,54 +51,143 @@ class BaseGenerator(ABC):
             images = [random_image, correct_image]
 
         couple = ImagesUtils.concat_images(images)
-        path = ImagesUtils.save_image(couple, self._compare_dir, file_name)
+        path = self._save_image(couple, self._compare_dir, file_name, comparison=True)
         if path is not None:
             self._log_comparison(image_id, image_id, path, correct_image_index)
 
-    def _log(self, image_id, path, is_correct=1):
-        if not os.path.exists(self._metadata):
-            with open(self._metadata, 'w', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow(['image_id', 'path', 'is_correct'])
+    def set_output_shards(self, shard_format='tar', shard_size=1000, prefix='shard'):
+        # Images are packed into shards under <output dir>/shards instead of single files. Metadata rows hold the
+        # sample keys in their path column and are written only when the shard holding their sample is complete
+        self._close_metadata()
+        self._shard_format = shard_format
+        self._shard_size = shard_size
+        self._shard_writer = ShardWriter(os.path.join(self._output_dir, 'shards'), shard_format, shard_size,
+                                         prefix=prefix, on_shard_closed=self._flush_metadata)
 
-        with open(self._metadata, 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([image_id, path, str(is_correct)])
+    def set_image_encoder(self, image_format='png', compress_level=6, quality=95, workers=4, max_pending=None):
+        # Images are encoded by a thread pool while the next images are generated, see ImageEncoder
+        self._close_metadata()
+        self._image_encoder = ImageEncoder(image_format, compress_level, quality, workers, max_pending)
 
-    def _log_comparison(self, image_id_1, image_id_2, path, correct_image_index):
-        if not os.path.exists(self._compare_metadata):
-            with open(self._compare_metadata, 'w', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow(['image_id_1', 'image_id_2', 'path', 'correct_image_index'])
+    def _get_metadata_writer(self):
+        if self._metadata_writer is None:
+            self._metadata_writer = self._create_metadata_writer(self._metadata, ['image_id', 'path', 'is_correct'])
+
+        return self._metadata_writer
+
+    def _get_compare_metadata_writer(self):
+        if self._compare_metadata_writer is None:
+            self._compare_metadata_writer = self._create_metadata_writer(
+                self._compare_metadata, ['image_id_1', 'image_id_2', 'path', 'correct_image_index'])
+
+        return self._compare_metadata_writer
+
+    def _create_metadata_writer(self, path, header):
+        if self._shard_writer is not None:
+            return MetadataWriter(path, header, flush_rows=None, flush_seconds=None)
+
+        # Rows are written only once the images they point to are on disk
+        return MetadataWriter(path, header, before_flush=self._image_encoder.wait)
+
+    def _get_manifest(self):
+        if self._manifest is None:
+            # Completed units are written after the metadata rows of their images, with the shard in shard mode
+            if self._shard_writer is not None:
+                self._manifest = WorkManifest(os.path.join(self._output_dir, 'manifest'), flush_units=None,
+                                              flush_seconds=None)
+            else:
+                self._manifest = WorkManifest(os.path.join(self._output_dir, 'manifest'),
+                                              before_flush=self._flush_outputs)
+
+        return self._manifest
+
+    def _is_done(self, unit_id):
+        return self._get_manifest().is_done(unit_id)
+
+    def _mark_done(self, unit_id):
+        # Called once all images of the unit are saved and logged, an interrupted unit is generated again
+        self._get_manifest().mark_done(unit_id)
+
+    def _flush_outputs(self):
+        # Images first, then the metadata rows pointing to them
+        self._image_encoder.wait()
+        if self._metadata_writer is not None:
+            self._metadata_writer.flush()
+
+        if self._compare_metadata_writer is not None:
+            self._compare_metadata_writer.flush()
+
+    def _flush_metadata(self, shard_path=None):
+        self._flush_outputs()
+        if self._manifest is not None:
+            self._manifest.flush()
 
-        with open(self._compare_metadata, 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([image_id_1, image_id_2, path, correct_image_index])
+    def _close_metadata(self):
+        # Pending images and the shard go first, the rows are written after their images
+        self._image_encoder.close()
+        if self._shard_writer is not None:
+            self._shard_writer.close()
+
+        if self._metadata_writer is not None:
+            self._metadata_writer.close()
+            self._metadata_writer = None
+
+        if self._compare_metadata_writer is not None:
+            self._compare_metadata_writer.close()
+            self._compare_metadata_writer = None
+
+        if self._manifest is not None:
+            self._manifest.close()
+            self._manifest = None
+
+    def _get_output_key(self, path):
+        # Sharded samples are keyed by their path relative to the output directory, without the extension
+        if self._shard_writer is None:
+            return path
+
+        return os.path.splitext(os.path.relpath(path, self._output_dir))[0].replace(os.sep, '/')
+
+    def _is_logged(self, path, comparison=False):
+        if comparison:
+            return self._get_compare_metadata_writer().contains(self._get_output_key(path))
+
+        return self._get_metadata_writer().contains(self._get_output_key(path))
+
+    def _get_image_path(self, dirpath, filename):
+        return os.path.join(dirpath, '{}.{}'.format(filename, self._image_encoder.extension))
+
+    def _save_image(self, img, dirpath, filename, comparison=False):
+        # An image without a metadata row is left from an interrupted run and is written again with its row
+        path = self._get_image_path(dirpath, filename)
+        if self._is_logged(path, comparison):
+            return None
+
+        if self._shard_writer is None:
+            return self._image_encoder.submit(img, path)
+
+        # The encoded image waits for its metadata row, both are written into the shard as one sample
+        key = self._get_output_key(path)
+        self._pending_images[key] = self._image_encoder.encode(img)
+        return key
+
+    def _write_sample(self, key, metadata):
+        data = self._pending_images.pop(key, None)
+        if self._shard_writer is not None and data is not None:
+            metadata = json.dumps(metadata, default=str).encode('utf-8')
+            self._shard_writer.write(key, {self._image_encoder.extension: data, 'json': metadata})
+
+    def _log(self, image_id, path, is_correct=1):
+        if self._get_metadata_writer().write_row([image_id, path, str(is_correct)]):
+            self._write_sample(path, {'image_id': image_id, 'path': path, 'is_correct': is_correct})
+
+    def _log_comparison(self, image_id_1, image_id_2, path, correct_image_index):
+        if self._get_compare_metadata_writer().write_row([image_id_1, image_id_2, path, correct_image_index]):
+            self._write_sample(path, {'image_id_1': image_id_1, 'image_id_2': image_id_2, 'path': path,
+                                      'correct_image_index': correct_image_index})
 
-    def _split_data(self, train=0.7, eval=0.25, test=0.05):
+    def _split_data(self, train=0.7, eval=0.25, test=0.05, salt=''):
         assert train + eval + test == 1.0, 'Splits does not sum to 1'
-        with open(self._metadata, 'r') as metadata_file:
-            content = metadata_file.readlines()
-            headers = content[0]
-            content = content[1:]
-            random.shuffle(content)
-            total_size = len(content)
-            index = 0
-            curr_path = os.path.join(self._output_dir, 'metadata_train.csv')
-            with open(curr_path, 'w') as file:
-                size = int(total_size * train)
-                file.write(headers)
-                file.writelines(content[:size])
-                index += size
-
-            curr_path = os.path.join(self._output_dir, 'metadata_eval.csv')
-            with open(curr_path, 'w') as file:
-                size = int(total_size * eval)
-                file.write(headers)
-                file.writelines(content[index:index+size])
-                index += size
-
-            curr_path = os.path.join(self._output_dir, 'metadata_test.csv')
-            with open(curr_path, 'w') as file:
-                file.write(headers)
-                file.writelines(content[index:])
+        self._close_metadata()
+        # Rows of an image id share a split, so variants of an image never leak from train into eval or test
+        splits = [('train', train), ('eval', eval), ('test', test)]
+        MetadataSplitter(self._metadata, self._output_dir, group_key='image_id', splits=splits, salt=salt).split()
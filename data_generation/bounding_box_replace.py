@@ -1,6 +1,8 @@
 import math
 import os
 import random
+import shutil
+import zlib
 
 import numpy as np
 from PIL import Image
@@ -9,6 +11,8 @@ from data_generation.base_generator import BaseGenerator
 from datasets.mscoco import Mscoco
 from utils.images_utils import ImagesUtils
 from utils.bbox_utils import BboxUtils
+from utils.metadata_writer import MetadataWriter
+from utils.parallel_utils import ParallelUtils
 
 
 class BoundingBoxReplace(BaseGenerator):
@@ -16,6 +20,8 @@ class BoundingBoxReplace(BaseGenerator):
         super().__init__(dataset)
         assert isinstance(dataset, Mscoco), "Generator support only " + Mscoco.__name__ + " dataset"
 
+        self._root_path = root_path
+        self._output_dir_name = output_dir_name
         self._output_dir = os.path.join(root_path, output_dir_name)
         os.makedirs(self._output_dir, exist_ok=True)
         print('Setting {} output directory as {}'.format(self.__class__.__name__, self._output_dir))
@@ -33,53 +39,208 @@ class BoundingBoxReplace(BaseGenerator):
         self._categories = self._get_dataset_categories()
         print('Generating data for categories={}'.format(self._categories))
 
-    def generate(self, count):
+    def generate(self, count, workers=1):
+        if workers > 1:
+            self._generate_parallel(count, workers)
+            return
+
         for category_id in self._categories:
             print('Generating data for category {}'.format(category_id))
-            images_count = 0
-            index = 0
-            used_images = {}
-
             category_dir = os.path.join(self._output_dir, self._categories[category_id])
+            images_count = self.execute_pair_plan(category_dir, category_id, self.get_pair_plan(category_id), count)
+            print('Generated {} images in category {}'.format(images_count, category_id))
 
-            while images_count < count:
-                print('Current images in category: {}'.format(images_count))
-
-                image_ids = self._dataset.get_image_ids([category_id])[images_count:self._batch_size + index]
-                index += self._batch_size
-                if image_ids is None or len(image_ids) == 0:
-                    break
-
-                images_categorization = self._categorize_images(image_ids, category_id)
-
-                for ratio_category in images_categorization:
-                    if len(images_categorization[ratio_category]) <= 1:
-                        continue
-
-                    sorted_resolutions = sorted(images_categorization[ratio_category],
-                                                key=images_categorization[ratio_category].get)
-                    for i in range(0, len(sorted_resolutions) - 1, 2):
-                        if images_count >= count:
-                            break
-
-                        image_id_1 = sorted_resolutions[i]
-                        image_id_2 = sorted_resolutions[i + 1]
-                        if image_id_1 in used_images or image_id_2 in used_images:
-                            continue
+        self._split_data()
 
-                        try:
-                            self._generate_images(category_dir, category_id, image_id_1, image_id_2)
-                            used_images[image_id_1] = 1
-                            used_images[image_id_2] = 1
-                            images_count += 2
-                        except:
-                            print('Failed to generate images for ids: {}, {}'.format(image_id_1, image_id_2))
+    def _generate_parallel(self, count, workers):
+        # Every category plan is split into interleaved chunks, so all workers are busy even with few categories
+        chunk_count = max(1, math.ceil(workers / len(self._categories)))
+        pairs_count = math.ceil(count / 2)
+        tasks = []
+        for category_id in self._categories:
+            # Plans are written once here, workers only read them
+            self.get_pair_plan(category_id)
+            for chunk_index in range(chunk_count):
+                chunk_pairs = pairs_count // chunk_count + (1 if chunk_index < pairs_count % chunk_count else 0)
+                tasks.append((category_id, chunk_index, chunk_count, 2 * chunk_pairs))
+
+        # Shards left by an interrupted run are kept, they are merged together with the new ones
+        shards_dir = os.path.join(self._output_dir, 'metadata_shards')
+        self._close_metadata()
+        worker_params = {'dataset_params': self._dataset.get_params(), 'params': self.get_params(),
+                         'shard_params': None, 'encoder_params': self._image_encoder.get_params()}
+        if self._shard_writer is not None:
+            worker_params['shard_params'] = {'shard_format': self._shard_format, 'shard_size': self._shard_size}
+
+        results = ParallelUtils.run(self.__class__.create, worker_params, tasks, workers, method='generate_chunk')
 
+        for category_id in self._categories:
+            images_count = sum(result[1] for result in results if result[0] == category_id)
             print('Generated {} images in category {}'.format(images_count, category_id))
 
+        self._merge_metadata_shards(shards_dir)
         self._split_data()
 
+    def generate_chunk(self, task):
+        # Runs in a worker process, rows are logged into a metadata shard of the task
+        category_id, chunk_index, chunk_count, count = task
+        shards_dir = os.path.join(self._output_dir, 'metadata_shards')
+        shard_name = '{}_{}.csv'.format(category_id, chunk_index)
+        main_metadata, main_compare_metadata = self._metadata, self._compare_metadata
+        self._metadata = os.path.join(shards_dir, shard_name)
+        if self._compare_random:
+            self._compare_metadata = os.path.join(shards_dir, 'compare_' + shard_name)
+
+        # Rows of the merged metadata and of every other shard count as logged, so images are not written twice
+        logged_paths = MetadataWriter.read_keys(main_metadata)
+        compare_logged_paths = MetadataWriter.read_keys(main_compare_metadata) if self._compare_random else set()
+        if os.path.exists(shards_dir):
+            for name in os.listdir(shards_dir):
+                if name.startswith('compare_'):
+                    compare_logged_paths.update(MetadataWriter.read_keys(os.path.join(shards_dir, name)))
+                else:
+                    logged_paths.update(MetadataWriter.read_keys(os.path.join(shards_dir, name)))
+
+        # Every task packs its samples into shards of its own, their rows reach the metadata shard with them
+        if self._shard_writer is not None:
+            shard_prefix = 'shard_{}_{}'.format(category_id, chunk_index)
+            self.set_output_shards(self._shard_format, self._shard_size, prefix=shard_prefix)
+
+        self._get_metadata_writer().add_keys(logged_paths)
+        if self._compare_random:
+            self._get_compare_metadata_writer().add_keys(compare_logged_paths)
+
+        # Forked workers share the parent random state, every task gets its own reproducible seed
+        seed = '{}_{}_{}'.format(self.__class__.__name__, category_id, chunk_index)
+        random.seed(seed)
+        np.random.seed(zlib.crc32(seed.encode('utf-8')))
+        try:
+            pairs = self.get_pair_plan(category_id)[chunk_index::chunk_count]
+            category_dir = os.path.join(self._output_dir, self._categories[category_id])
+            return category_id, self.execute_pair_plan(category_dir, category_id, pairs, count)
+        finally:
+            self._close_metadata()
+            self._metadata, self._compare_metadata = main_metadata, main_compare_metadata
+
+    def _merge_metadata_shards(self, shards_dir):
+        if not os.path.exists(shards_dir):
+            return
+
+        # Rows go through the metadata writers, so rows merged by an interrupted merge are not added twice
+        for shard_name in sorted(os.listdir(shards_dir)):
+            if shard_name.startswith('compare_'):
+                writer = self._get_compare_metadata_writer()
+            else:
+                writer = self._get_metadata_writer()
+
+            _, rows = MetadataWriter.read_rows(os.path.join(shards_dir, shard_name))
+            for row in rows:
+                writer.write_row(row)
+
+        self._close_metadata()
+        shutil.rmtree(shards_dir)
+
+    def get_params(self):
+        return {'root_path': self._root_path, 'output_dir_name': self._output_dir_name,
+                'compare_random': self._compare_random}
+
+    @classmethod
+    def create(cls, dataset_params, params, shard_params=None, encoder_params=None):
+        # Worker processes open their own dataset from its parameters
+        dataset = Mscoco(**dataset_params)
+        dataset.initialize()
+        generator = cls(dataset=dataset, **params)
+        if encoder_params is not None:
+            generator.set_image_encoder(**encoder_params)
+
+        if shard_params is not None:
+            generator.set_output_shards(**shard_params)
+
+        return generator
+
+    def execute_pair_plan(self, category_dir, category_id, pairs, count):
+        # pairs is a (N, 2) slice of a pair plan, pairs are independent so a plan can be split between workers
+        images_count = 0
+        for index in range(0, len(pairs), self._batch_size):
+            if images_count >= count:
+                break
+
+            if index == 0:
+                self._dataset.prefetch_images(pairs[:self._batch_size].flatten().tolist())
+
+            # Images of the next batch are read in the background while this batch is composited
+            next_pairs = pairs[index + self._batch_size:index + 2 * self._batch_size]
+            self._dataset.prefetch_images(next_pairs.flatten().tolist())
+            print('Current images in category: {}'.format(images_count))
+
+            for image_id_1, image_id_2 in pairs[index:index + self._batch_size].tolist():
+                if images_count >= count:
+                    break
+
+                try:
+                    self._generate_images(category_dir, category_id, image_id_1, image_id_2)
+                    images_count += 2
+                except:
+                    print('Failed to generate images for ids: {}, {}'.format(image_id_1, image_id_2))
+
+        return images_count
+
+    def get_pair_plan(self, category_id):
+        # The plan is saved next to the output, so later runs and workers reuse the same pairing
+        plan_path = os.path.join(self._output_dir, 'pair_plans', '{}.npz'.format(category_id))
+        image_ids = np.array(self._dataset.get_image_ids([category_id]), dtype=np.int64)
+        if os.path.exists(plan_path):
+            with np.load(plan_path) as plan:
+                if int(plan['ratio_groups']) == self._ratio_groups and np.array_equal(plan['image_ids'], image_ids):
+                    return plan['pairs']
+
+        pairs = self.plan_pairs(image_ids, category_id)
+        os.makedirs(os.path.dirname(plan_path), exist_ok=True)
+        temp_path = '{}.{}.tmp'.format(plan_path, os.getpid())
+        with open(temp_path, 'wb') as f:
+            np.savez(f, pairs=pairs, image_ids=image_ids, ratio_groups=self._ratio_groups)
+
+        os.replace(temp_path, plan_path)
+        return pairs
+
+    def plan_pairs(self, image_ids, category_id):
+        # Images are bucketed by the aspect ratio of their first box of the category, neighbours by box area
+        # inside a bucket are paired, and the closest pairs come first
+        metadata = self._dataset.get_annotations_metadata(image_ids, [category_id])
+        has_annotation = metadata['first_annotation'] >= 0
+        image_ids = np.asarray(image_ids, dtype=np.int64)[has_annotation]
+        bboxes = metadata['bboxes'][metadata['first_annotation'][has_annotation]].astype(int)
+        w, h = bboxes[:, 2], bboxes[:, 3]
+        valid = h > 0
+        image_ids, w, h = image_ids[valid], w[valid], h[valid]
+        if len(image_ids) < 2:
+            return np.zeros((0, 2), dtype=np.int64)
+
+        ratio_categories = self._get_ratio_categories(w / h)
+        resolutions = w * h
+
+        order = np.lexsort((image_ids, resolutions, ratio_categories))
+        image_ids, resolutions, ratio_categories = image_ids[order], resolutions[order], ratio_categories[order]
+
+        # Pair every even position of a bucket with the next one, odd sized buckets leave their largest image out
+        bucket_starts = np.searchsorted(ratio_categories, ratio_categories, side='left')
+        first = np.flatnonzero(((np.arange(len(image_ids)) - bucket_starts) % 2 == 0)[:-1] &
+                               (ratio_categories[:-1] == ratio_categories[1:]))
+        second = first + 1
+
+        area_difference = np.abs(resolutions[first] - resolutions[second]) / \
+            np.maximum(np.maximum(resolutions[first], resolutions[second]), 1)
+        pair_order = np.lexsort((image_ids[first], area_difference))
+        return np.stack([image_ids[first[pair_order]], image_ids[second[pair_order]]], axis=1)
+
+    def _get_ratio_categories(self, ratios):
+        # Equal width buckets over [min, max], the maximum ratio gets a bucket of its own
+        ratio_range = np.max(ratios) - np.min(ratios)
+        if ratio_range == 0:
+            return np.zeros(len(ratios), dtype=np.int64)
 
+        range_size = ratio_range / (self._ratio_groups - 1)
+        return np.floor((ratios - np.min(ratios)) / range_size).astype(np.int64)
 
     def _generate_images(self, category_dir, category_id, image_id_1, image_id_2):
         image_1, _, bboxes_1 = self._dataset.get_image(image_id_1, [category_id])
@@ -87,11 +248,11 @@ class BoundingBoxReplace(BaseGenerator):
         edited_image_1, edited_image_2 = \
             self.replace_content_bbox(image_1, bboxes_1[0], image_2, bboxes_2[0])
 
-        path = ImagesUtils.save_image(edited_image_1, category_dir, '{}_edited'.format(str(image_id_1)))
+        path = self._save_image(edited_image_1, category_dir, '{}_edited'.format(str(image_id_1)))
         if path is not None:
             self._log(image_id_1, path, is_correct=1)
 
-        path = ImagesUtils.save_image(edited_image_2, category_dir, '{}_edited'.format(str(image_id_2)))
+        path = self._save_image(edited_image_2, category_dir, '{}_edited'.format(str(image_id_2)))
         if path is not None:
             self._log(image_id_2, path, is_correct=1)
 
@@ -105,7 +266,7 @@ class BoundingBoxReplace(BaseGenerator):
     def _generate_comparison(self, image_id_1, image_id_2, image_1, edited_image_1, image_2, bbox_2, category_dir):
         random_edit_1 = BboxUtils.random_place_bbox(image_1, image_2, bbox_2)
 
-        path = ImagesUtils.save_image(random_edit_1, category_dir, '{}_random'.format(str(image_id_1)))
+        path = self._save_image(random_edit_1, category_dir, '{}_random'.format(str(image_id_1)))
         if path is not None:
             self._log(image_id_1, path, is_correct=0)
 
@@ -116,37 +277,11 @@ class BoundingBoxReplace(BaseGenerator):
             images = [random_edit_1, edited_image_1]
 
         couple = ImagesUtils.concat_images(images)
-        path = ImagesUtils.save_image(couple, category_dir, '{}_{}'.format(str(image_id_1), str(image_id_2)))
+        path = self._save_image(couple, category_dir, '{}_{}'.format(str(image_id_1), str(image_id_2)),
+                                comparison=True)
         if path is not None:
             self._log_comparison(image_id_1, image_id_2, path, correct_image_index)
 
-    def _categorize_images(self, image_ids, category_id):
-        images_metadata = {}
-        ratios = []
-        for image_id in image_ids:
-            _, _, bboxes = self._dataset.get_image(image_id, [category_id])
-            bbox = bboxes[0]
-            w, h = bbox[2], bbox[3]
-            images_metadata[image_id] = (w / h, w * h)
-            ratios.append(w / h)
-
-        min_ratio = np.min(ratios)
-        max_ratio = np.max(ratios)
-
-        result = {i: {} for i in range(self._ratio_groups)}
-        for image_id in images_metadata:
-            current_ratio = images_metadata[image_id][0]
-            current_res = images_metadata[image_id][1]
-            ratio_category = self._get_ratio_category(min_ratio, max_ratio, current_ratio)
-            result[ratio_category][image_id] = current_res
-
-        return result
-
-    def _get_ratio_category(self, min_ratio, max_ratio, ratio):
-        ratio_range = max_ratio - min_ratio
-        range_size = ratio_range / (self._ratio_groups - 1)
-        return math.floor((ratio - min_ratio) / range_size)
-
     def _get_dataset_categories(self):
         categories = {}
         category_ids = self._dataset.category_ids
@@ -4,7 +4,6 @@ import traceback
 
 from data_generation.base_generator import BaseGenerator
 from datasets.front_future_3d import FrontFuture3D
-from utils.images_utils import ImagesUtils
 
 
 class FrontFuture3DRender(BaseGenerator):
@@ -33,9 +32,7 @@ class FrontFuture3DRender(BaseGenerator):
 
         while images_count < count:
             scene_id = scene_ids[i]
-            path1 = os.path.join(self._output_dir, '{}_0_edited.png'.format(scene_id))
-            path2 = os.path.join(self._output_dir, '{}_0_random.png'.format(scene_id))
-            if os.path.exists(path1) or os.path.exists(path2):
+            if self._is_done(scene_id):
                 i += 1
                 continue
 
@@ -51,6 +48,7 @@ class FrontFuture3DRender(BaseGenerator):
                 i += 1
                 continue
 
+            completed = True
             generated_image_index = 0
             for correct_render, incorrect_render in zip(correct_renders, incorrect_renders):
                 try:
@@ -62,19 +60,23 @@ class FrontFuture3DRender(BaseGenerator):
                         print(images_count)
 
                 except Exception as e:
+                    completed = False
                     traceback.print_exc()
 
+            if completed:
+                self._mark_done(scene_id)
+
             i += 1
 
     def generate_renders(self, scene_id, generated_image_index, correct_render, incorrect_render):
-        path = ImagesUtils.save_image(correct_render, self._output_dir,
-                                      '{}_{}_edited'.format(scene_id, str(generated_image_index)))
+        path = self._save_image(correct_render, self._output_dir,
+                                '{}_{}_edited'.format(scene_id, str(generated_image_index)))
 
         if path is not None:
             self._log(scene_id, path, is_correct=1)
 
-        path = ImagesUtils.save_image(incorrect_render, self._output_dir,
-                                      '{}_{}_random'.format(scene_id, str(generated_image_index)))
+        path = self._save_image(incorrect_render, self._output_dir,
+                                '{}_{}_random'.format(scene_id, str(generated_image_index)))
 
         if path is not None:
             self._log(scene_id, path, is_correct=0)
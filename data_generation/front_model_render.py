@@ -4,7 +4,6 @@ import traceback
 
 from data_generation.base_generator import BaseGenerator
 from datasets.front_future_3d import FrontFuture3D
-from utils.images_utils import ImagesUtils
 
 
 class FrontModelRender(BaseGenerator):
@@ -27,44 +26,49 @@ class FrontModelRender(BaseGenerator):
         while i < len(models_paths):
             model_path = models_paths[i]
             model_id = os.path.basename(model_path).split(".")[0]
-            path = os.path.join(self._output_dir, '{}_0.png'.format(model_id))
-            if os.path.exists(path):
+            if self._is_done(model_id):
                 i += 1
                 continue
 
-            renders = None
-            category = None
-            try:
-                renders, category = self._dataset.render_model(model_path)
-            except Exception as e:
-                traceback.print_exc()
-
-            if not category or not renders:
+            category = self._dataset.get_obj_category(model_path)
+            if not category:
                 i += 1
                 continue
 
+            # Renders are saved as they are produced instead of keeping all orientations in memory
+            completed = True
             generated_image_index = 0
-            for render in renders:
-                try:
-                    self.save_render(render, category, model_id, generated_image_index)
-                    generated_image_index += 1
-                    images_count += 1
+            try:
+                for render in self._dataset.iter_model_renders(model_path):
+                    try:
+                        self.save_render(render, category, model_id, generated_image_index)
+                        generated_image_index += 1
+                        images_count += 1
+
+                        if images_count % 5 == 0:
+                            print(images_count)
 
-                    if images_count % 5 == 0:
-                        print(images_count)
+                    except Exception as e:
+                        completed = False
+                        traceback.print_exc()
+            except Exception as e:
+                completed = False
+                traceback.print_exc()
 
-                except Exception as e:
-                    traceback.print_exc()
+            if completed:
+                self._mark_done(model_id)
 
             i += 1
 
     def save_render(self, render, category, model_id, generated_image_index):
         path = None
         try:
-            path = ImagesUtils.save_image(render, self._output_dir,
-                                          '{}_{}'.format(model_id, str(generated_image_index)))
+            path = self._save_image(render, self._output_dir,
+                                    '{}_{}'.format(model_id, str(generated_image_index)))
         except Exception as e:
+            # The model is left out of the manifest, so it is rendered again on the next run
             print('Error saving file, skipping')
+            raise
 
         if path is not None:
             self._log(model_id, path, is_correct=category)
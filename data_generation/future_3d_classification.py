@@ -1,7 +1,8 @@
-import csv
 import json
 import os
 
+from utils.metadata_writer import MetadataWriter
+
 
 class Future3DClassification:
     def __init__(self, data_path):
@@ -18,24 +19,26 @@ class Future3DClassification:
             image_file_name = self.get_image_file_names(train_data)
             annotations = self.group_annotations(train_data)
             metadata_path = os.path.join(train_output_path, 'metadata.csv')
-            for image_id in annotations:
-                image_path = os.path.join(self.future_3d_dir, 'train', 'image', image_file_name[image_id] + '.jpg')
-                if os.path.exists(image_path):
-                    self.log(image_id, image_path, annotations[image_id], metadata_path)
-                else:
-                    print('Cant find image {}'.format(image_path))
+            with MetadataWriter(metadata_path, ['image_id', 'path', 'categories']) as writer:
+                for image_id in annotations:
+                    image_path = os.path.join(self.future_3d_dir, 'train', 'image', image_file_name[image_id] + '.jpg')
+                    if os.path.exists(image_path):
+                        self.log(image_id, image_path, annotations[image_id], writer)
+                    else:
+                        print('Cant find image {}'.format(image_path))
 
         with open(self.test_json_path) as f:
             test_data = json.load(f)
             image_file_name = self.get_image_file_names(test_data)
             annotations = self.group_annotations(test_data)
             metadata_path = os.path.join(test_output_path, 'metadata.csv')
-            for image_id in annotations:
-                image_path = os.path.join(self.future_3d_dir, 'test', 'image', image_file_name[image_id] + '.jpg')
-                if os.path.exists(image_path):
-                    self.log(image_id, image_path, annotations[image_id], metadata_path)
-                else:
-                    print('Cant find image {}'.format(image_path))
+            with MetadataWriter(metadata_path, ['image_id', 'path', 'categories']) as writer:
+                for image_id in annotations:
+                    image_path = os.path.join(self.future_3d_dir, 'test', 'image', image_file_name[image_id] + '.jpg')
+                    if os.path.exists(image_path):
+                        self.log(image_id, image_path, annotations[image_id], writer)
+                    else:
+                        print('Cant find image {}'.format(image_path))
 
     def get_output_paths(self):
         output_dir = os.path.join(self.base_future_3d_dir, 'generated_classification')
@@ -73,18 +76,10 @@ class Future3DClassification:
 
         return result
 
-    def log(self, image_id, path, categories, metadata_path):
-        if not os.path.exists(metadata_path):
-            with open(metadata_path, 'w', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow(['image_id', 'path', 'categories'])
-
-        with open(metadata_path, 'a', newline='') as f:
-            writer = csv.writer(f)
-            categories_string = ""
-            for category in categories:
-                categories_string += str(category) + ";"
-
-            categories_string = categories_string.strip(";")
-            writer.writerow([image_id, path, categories_string])
+    def log(self, image_id, path, categories, writer):
+        categories_string = ""
+        for category in categories:
+            categories_string += str(category) + ";"
 
+        categories_string = categories_string.strip(";")
+        writer.write_row([image_id, path, categories_string])
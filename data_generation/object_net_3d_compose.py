@@ -41,9 +41,7 @@ class ObjectNet3DCompose(BaseGenerator):
         while images_count < count:
             image_id = train_ids[i]
 
-            path1 = os.path.join(self._output_dir, '{}_0_edited.png'.format(image_id))
-            path2 = os.path.join(self._output_dir, '{}_0_random.png'.format(image_id))
-            if os.path.exists(path1) or os.path.exists(path2):
+            if self._is_done(image_id):
                 i += 1
                 continue
 
@@ -57,6 +55,7 @@ class ObjectNet3DCompose(BaseGenerator):
                 i += 1
                 continue
 
+            completed = True
             generated_image_index = 0
             for record, render in renders:
                 try:
@@ -66,16 +65,16 @@ class ObjectNet3DCompose(BaseGenerator):
                     background_image = self._dataset.get_background_image(image_id)
                     background_image = self.color_background(background_image, (x1, y1, x2, y2))
                     correct_image = self.construct_image(background_image, render, x1, y1, x2, y2)
-                    path = ImagesUtils.save_image(correct_image, self._output_dir,
-                                                  '{}_{}_edited'.format(image_id, str(generated_image_index)))
+                    path = self._save_image(correct_image, self._output_dir,
+                                            '{}_{}_edited'.format(image_id, str(generated_image_index)))
                     if path is not None:
                         self._log(image_id, path, is_correct=1)
 
                     background_image = self._dataset.get_background_image(image_id)
                     background_image = self.color_background(background_image, (x1, y1, x2, y2))
                     random_image = self.random_place(background_image, render, (x1, y1, x2, y2))
-                    path = ImagesUtils.save_image(random_image, self._output_dir,
-                                                  '{}_{}_random'.format(image_id, str(generated_image_index)))
+                    path = self._save_image(random_image, self._output_dir,
+                                            '{}_{}_random'.format(image_id, str(generated_image_index)))
                     if path is not None:
                         self._log(image_id, path, is_correct=0)
 
@@ -89,8 +88,12 @@ class ObjectNet3DCompose(BaseGenerator):
                         print(images_count)
 
                 except Exception as e:
+                    completed = False
                     traceback.print_exc()
 
+            if completed:
+                self._mark_done(image_id)
+
             i += 1
 
     def color_background(self, img, bbox):
@@ -1,7 +1,6 @@
 import os
 
 from data_generation.base_generator import BaseGenerator
-from utils.images_utils import ImagesUtils
 from utils.segmentation_utils import SegmentationUtils
 
 
@@ -9,19 +8,24 @@ class ObjectOutline(BaseGenerator):
     def __init__(self, root_path, dataset):
         super().__init__(dataset)
 
-        self._outlines_dir = os.path.join(root_path, 'outlines')
+        self._output_dir = os.path.join(root_path, 'outlines')
+        self._outlines_dir = self._output_dir
         os.makedirs(self._outlines_dir, exist_ok=True)
 
-    def process_image(self, img_id, mask):
+    def process_image(self, img_id, masks):
         color_map = SegmentationUtils.segmentation_map_to_color_map(
-            SegmentationUtils.segmentation_mask_to_map(mask))
-        ImagesUtils.save_image(color_map, self._outlines_dir, str(img_id))
+            SegmentationUtils.segmentation_masks_to_map(masks))
+        self._image_encoder.submit(color_map, self._get_image_path(self._outlines_dir, str(img_id)))
 
     def generate(self, count):
         image_ids = self._dataset.get_image_ids()[:count]
         for image_id in image_ids:
-            img, mask, _ = self._dataset.get_image(image_id)
-            self.process_image(image_id, mask)
+            if self._is_done(image_id):
+                continue
+
+            img, masks, _ = self._dataset.get_image(image_id)
+            self.process_image(image_id, masks)
+            self._mark_done(image_id)
 
 
 
@@ -0,0 +1,371 @@
+import json
+import os
+import pickle
+from abc import ABC, abstractmethod
+
+import numpy as np
+from trimesh import Scene
+from tqdm import tqdm
+from PIL import Image, ImageDraw
+from trimesh.visual.material import SimpleMaterial
+
+from datasets.scenes_3d import Scenes3D
+from utils.files_utils import FilesUtils
+from utils.image_encoder import ImageEncoder
+from utils.images_utils import ImagesUtils
+from utils.mesh_utils import MeshUtils
+from utils.parallel_utils import ParallelUtils
+from utils.projection_utils import ProjectionUtils
+from utils.rasterizer import Rasterizer
+from utils.render_backends import RenderBackend
+from utils.shard_writer import ShardWriter
+from utils.work_manifest import WorkManifest
+
+
+class Scenes3DBboxRenderBase(ABC):
+    # Shared by the scenes_3d_bbox_render generators, they differ only in how the implausible scenes are built
+    def __init__(self, data_dir, output_name, bbox_mode='projection', bbox_tolerance=2, render_backend='trimesh',
+                 output_format='files', shard_size=1000, image_format='png', compress_level=6, quality=95,
+                 encode_workers=4, skip_hidden_scenes=False):
+        self.data_dir = data_dir
+        self.output_dir = os.path.join(data_dir, 'generated', output_name)
+        self.metadata_output_dir = os.path.join(self.output_dir, 'metadata')
+        self.images_output_dir = os.path.join(self.output_dir, 'images')
+        self.render_backend_name = render_backend
+        self.render_backend = RenderBackend.create(render_backend)
+        self.dataset = Scenes3D(data_dir, self.render_backend)
+        self.transform_categories = ['chair']
+        self.output_resolution = (640, 480)
+        # 'render' detects boxes on a per-object render, 'projection' projects the mesh vertices,
+        # 'validate' does both and reports boxes that differ by more than bbox_tolerance pixels and
+        # 'instance' rasterizes all objects into a single instance id buffer with occlusion aware boxes
+        self.bbox_mode = bbox_mode
+        self.bbox_tolerance = bbox_tolerance
+        # 'files' saves every render as a png, 'tar' and 'tfrecord' pack renders and their view metadata into
+        # shards, the scene metadata is written only once the shard holding its renders is complete
+        self.output_format = output_format
+        self.shard_size = shard_size
+        self.shard_writer = None
+        self.pending_render = None
+        self.pending_metadata = []
+        # Renders are encoded by a thread pool while the next views are rendered
+        self.image_encoder = ImageEncoder(image_format, compress_level, quality, encode_workers)
+        self.manifest = None
+        # Scenes whose transformed objects are outside every camera view are skipped before any model is loaded,
+        # the number of skipped scenes is printed when the generator is closed
+        self.skip_hidden_scenes = skip_hidden_scenes
+        self.hidden_scenes = 0
+
+    @abstractmethod
+    def generate_scene(self, scene_id):
+        pass
+
+    def get_bounding_boxes(self, scene_id, scene_objects, camera, camera_transform):
+        bounding_boxes = {}
+
+        for model_id, model_path, model_transform in scene_objects:
+            if 'room' in model_path:
+                continue
+
+            if self.bbox_mode == 'render':
+                bbox = self.render_bounding_box(model_id, camera_transform, model_transform)
+            elif self.bbox_mode == 'projection':
+                bbox = self.project_bounding_box(model_id, camera, camera_transform, model_transform)
+            else:
+                bbox = self.render_bounding_box(model_id, camera_transform, model_transform)
+                projected_bbox = self.project_bounding_box(model_id, camera, camera_transform, model_transform)
+                if not ProjectionUtils.compare_bounding_boxes(bbox, projected_bbox, self.bbox_tolerance):
+                    print('Bounding box mismatch for model {} in scene {}: rendered={}, projected={}'
+                          .format(model_id, scene_id, bbox, projected_bbox))
+
+            bounding_boxes[model_id] = bbox
+
+        return bounding_boxes
+
+    def render_bounding_box(self, model_id, camera_transform, model_transform):
+        scene = Scene()
+        scene.camera_transform = camera_transform
+        self.get_render_camera(scene)
+
+        model = self.dataset.load_model(model_id)
+        if isinstance(model, Scene):
+            for g in model.geometry:
+                model.geometry[g] = self.color_model(model.geometry[g], (0, 0, 0))
+        else:
+            model = self.color_model(model, (0, 0, 0))
+
+        model.apply_transform(model_transform)
+        scene.add_geometry(model)
+
+        img = Image.fromarray(self.render_backend.render(scene, background=[255, 255, 255, 255], cull=False))
+        return self.detect_bounding_box(img, [0, 0, 0, 255])
+
+    def project_bounding_box(self, model_id, camera, camera_transform, model_transform):
+        model = self.dataset.load_model(model_id, copy=False)
+        vertices, faces = MeshUtils.get_vertices_and_faces(model, model_transform)
+        return ProjectionUtils.project_bounding_box(vertices, faces, camera, camera_transform)
+
+    def color_model(self, trimesh_object, color):
+        trimesh_object.visual.material = SimpleMaterial(ambient=color, diffuse=color, specular=color)
+        return trimesh_object
+
+    def detect_bounding_box(self, img, foreground_color):
+        img_matrix = ImagesUtils.convert_to_numpy(img)
+        m = np.all(img_matrix == foreground_color, axis=-1)
+        if len(np.unique(m)) == 1:
+            return None
+
+        indices = np.where(m)
+        x1 = int(np.min(indices[1]))
+        x2 = int(np.max(indices[1]))
+        y1 = int(np.min(indices[0]))
+        y2 = int(np.max(indices[0]))
+        return (x1, y1), (x2, y2)
+
+    def get_instance_bounding_boxes(self, scene_objects, camera, camera_transform):
+        # Rasterize every object into one instance id buffer, so boxes only cover the visible pixels
+        instances = [MeshUtils.get_vertices_and_faces(self.dataset.load_model(model_id, copy=False), model_transform)
+                     for model_id, _, model_transform in scene_objects]
+        instance_ids, _ = Rasterizer.render_instance_ids(instances, camera, camera_transform)
+        bboxes, pixel_counts, _ = Rasterizer.decode_instance_ids(instance_ids, len(instances))
+
+        bounding_boxes = {}
+        visible_pixels = {}
+        for (model_id, model_path, _), bbox, pixel_count in zip(scene_objects, bboxes, pixel_counts):
+            if 'room' in model_path:
+                continue
+
+            bounding_boxes[model_id] = bbox
+            visible_pixels[model_id] = int(pixel_count)
+
+        return bounding_boxes, visible_pixels
+
+    def initialize(self):
+        self.dataset.initialize()
+        os.makedirs(self.output_dir, exist_ok=True)
+        os.makedirs(self.metadata_output_dir, exist_ok=True)
+        os.makedirs(self.images_output_dir, exist_ok=True)
+        # Completed scenes, every worker process appends to a log of its own. A scene is marked once its
+        # renders and metadata are written, in shard mode once the shard holding its renders is complete
+        manifest_dir = os.path.join(self.output_dir, 'manifest')
+        os.makedirs(manifest_dir, exist_ok=True)
+        self.manifest = WorkManifest(manifest_dir, name='manifest_{}'.format(os.getpid()),
+                                     flush_units=1 if self.output_format == 'files' else None, flush_seconds=None)
+        if self.output_format != 'files':
+            # Every worker process writes shards of its own
+            self.shard_writer = ShardWriter(os.path.join(self.output_dir, 'shards'), self.output_format,
+                                            self.shard_size, prefix='shard_{}'.format(os.getpid()),
+                                            on_shard_closed=self.write_pending_metadata)
+
+    def close(self):
+        self.image_encoder.close()
+        if self.shard_writer is not None:
+            self.shard_writer.close()
+
+        self.write_pending_metadata()
+        self.manifest.close()
+        if self.hidden_scenes > 0:
+            print('Skipped {} scenes without visible {} objects'.format(self.hidden_scenes,
+                                                                        ', '.join(self.transform_categories)))
+
+    def write_pending_metadata(self, shard_path=None):
+        for output_metadata_path, output_metadata in self.pending_metadata:
+            with open(output_metadata_path, 'w') as fp:
+                json.dump(output_metadata, fp)
+
+            self.manifest.mark_done(output_metadata['scene_id'])
+
+        self.pending_metadata = []
+        self.manifest.flush()
+
+    def generate(self, scene_ids=None, workers=1):
+        camera_transforms = self.get_camera_transforms()
+        camera_transforms_path = os.path.join(self.metadata_output_dir, 'camera_transforms.pkl')
+        pickle.dump(camera_transforms, open(camera_transforms_path, 'wb'))
+
+        if scene_ids is None:
+            scene_ids = self.dataset.get_scene_ids()
+
+        if workers > 1:
+            # Most expensive scenes first, so the last scenes of the run do not keep a single worker busy
+            scene_ids = sorted(scene_ids, key=self.dataset.get_scene_cost, reverse=True)
+            ParallelUtils.run(self.__class__, self.get_params(), scene_ids, workers)
+            # The workers write through generators of their own, the parent only closes what initialize opened
+            self.close()
+        else:
+            for scene_id in tqdm(scene_ids):
+                self.generate_scene(scene_id)
+
+            self.close()
+
+            print('Mesh cache stats: {}'.format(Scenes3D.mesh_cache.get_stats()))
+
+        self.merge_metadata()
+
+    def get_params(self):
+        return {'data_dir': self.data_dir, 'bbox_mode': self.bbox_mode, 'bbox_tolerance': self.bbox_tolerance,
+                'render_backend': self.render_backend_name, 'output_format': self.output_format,
+                'shard_size': self.shard_size, 'image_format': self.image_encoder.image_format,
+                'compress_level': self.image_encoder.compress_level, 'quality': self.image_encoder.quality,
+                'encode_workers': self.image_encoder.workers, 'skip_hidden_scenes': self.skip_hidden_scenes}
+
+    def merge_metadata(self):
+        merged_metadata_path = os.path.join(self.output_dir, 'metadata.json')
+        FilesUtils.merge_json_files(self.metadata_output_dir, merged_metadata_path)
+        print('Merged scenes metadata into {}'.format(merged_metadata_path))
+
+    def has_visible_targets(self, scene_objects, camera_transforms):
+        # Uses the precomputed model bounds, scenes with models missing from the index are always kept. The camera
+        # of an empty scene has the intrinsics of the rendered scenes, only its transform depends on the geometry
+        camera = self.get_render_camera(Scene())
+        for model_id, _, model_transform in scene_objects:
+            if self.dataset.get_object_category(model_id) not in self.transform_categories:
+                continue
+
+            corners = self.dataset.bounds_index.get_transformed_corners(model_id, model_transform)
+            if corners is None:
+                return True
+
+            for camera_transform in camera_transforms:
+                if ProjectionUtils.project_corners(corners, camera, camera_transform) is not None:
+                    return True
+
+        return False
+
+    def get_render_camera(self, scene):
+        scene.camera.resolution = self.output_resolution
+        return scene.camera
+
+    def generate_single_view_scene(self, scene_id, scene, scene_objects, camera_transform, camera_transform_index,
+                                   apply_transform):
+        scene_metadata = {
+            'objects': [],
+            'render_path': None
+        }
+
+        scene.camera_transform = camera_transform
+        camera = self.get_render_camera(scene)
+        visible_pixels = None
+        if self.bbox_mode == 'instance':
+            bboxes, visible_pixels = self.get_instance_bounding_boxes(scene_objects, camera, camera_transform)
+        else:
+            bboxes = self.get_bounding_boxes(scene_id, scene_objects, camera, camera_transform)
+
+        for model_id, _, _ in scene_objects:
+            if 'room' in model_id:
+                continue
+
+            category = self.dataset.get_object_category(model_id)
+            bbox = bboxes[model_id]
+
+            model_metadata = {
+                'model_id': model_id,
+                'bbox': bbox,
+                'category': category
+            }
+
+            if visible_pixels is not None:
+                model_metadata['visible_pixels'] = visible_pixels[model_id]
+
+            scene_metadata['objects'].append(model_metadata)
+
+        scene_metadata['render_path'] = self.save_render(scene, scene_id, apply_transform, camera_transform_index)
+        if self.shard_writer is not None:
+            key, data = self.pending_render
+            self.shard_writer.write(key, {self.image_encoder.extension: data,
+                                          'json': json.dumps(scene_metadata).encode('utf-8')})
+
+        return scene_metadata
+
+    def save_render(self, scene, scene_id, apply_transform, camera_transform_index):
+        img = Image.fromarray(self.render_backend.render(scene, background=[255, 255, 255, 0], cull=False))
+
+        filename = scene_id + '_' + str(camera_transform_index).zfill(3)
+        if apply_transform:
+            filename += '_implausible'
+        else:
+            filename += '_plausible'
+
+        if self.shard_writer is not None:
+            # The shard sample key, the render is written together with its view metadata
+            key = os.path.basename(self.images_output_dir) + '/' + filename
+            self.pending_render = (key, self.image_encoder.encode(img))
+            return key
+
+        filename += '.' + self.image_encoder.extension
+        image_path = os.path.join(self.images_output_dir, filename)
+        self.image_encoder.submit(img, image_path)
+        return os.path.basename(self.images_output_dir) + '/' + filename
+
+    def get_scene_model_ids(self, scene_id):
+        objects_metadata = self.dataset.get_scene_metadata(scene_id)['objects']
+        model_ids = []
+
+        for object_metadata in objects_metadata:
+            model_id = object_metadata['modelID']
+            if model_id is None or model_id == '':
+                continue
+
+            model_path = self.dataset.get_model_path(model_id)
+            if not os.path.exists(model_path):
+                continue
+
+            model_ids.append(model_id)
+
+        return model_ids
+
+    def is_scene_valid(self, model_ids):
+        is_valid = False
+        for model_id in model_ids:
+            if self.dataset.get_object_category(model_id) in self.transform_categories:
+                is_valid = True
+                break
+
+        return is_valid
+
+    def draw_bounding_box(self, img, bbox):
+        draw = ImageDraw.Draw(img)
+        draw.rectangle(tuple(map(tuple, bbox)), outline='#ff8888')
+        return img
+
+    def get_camera_transforms(self):
+        return [np.array([[1., 0., 0., 123.09577675],
+                          [0., 0.46565674, -0.88496542, -121.93568384],
+                          [0., 0.88496542, 0.46565674, 134.79709113],
+                          [0., 0., 0., 1.]]),
+                np.array([[1., 0., 0., 123.09577675],
+                          [0., 0.16266292, -0.9866817, -130.73452539],
+                          [0., 0.9866817, 0.16266292, 54.55492985],
+                          [0., 0., 0., 1.]]),
+                np.array([[7.54404832e-01, -2.61137239e-18, 6.56409435e-01, 2.27399143e+02],
+                          [6.47667179e-01, 1.62662921e-01, -7.44357439e-01, -4.91768017e+00],
+                          [-1.06773477e-01, 9.86681696e-01, 1.22713694e-01, 3.38129463e+01],
+                          [0.00000000e+00, 0.00000000e+00, 0.00000000e+00, 1.00000000e+00]]),
+                np.array([[9.32193350e-01, -2.59279804e-18, -3.61960713e-01, 7.68570236e+01],
+                          [-3.57140012e-01, 1.62662921e-01, -9.19778115e-01, -5.05534274e+00],
+                          [5.88775871e-02, 9.86681696e-01, 1.51633293e-01, 3.38356411e+01],
+                          [0.00000000e+00, 0.00000000e+00, 0.00000000e+00, 1.00000000e+00]]),
+                np.array([[9.24967757e-01, 1.20992630e-01, -3.60271329e-01, 3.64320925e+01],
+                          [-3.69435302e-01, 5.08689110e-01, -7.77658628e-01, -7.92278879e+01],
+                          [8.91751397e-02, 8.52406104e-01, 5.15219974e-01, 1.36236310e+02],
+                          [0.00000000e+00, 0.00000000e+00, 0.00000000e+00, 1.00000000e+00]]),
+                np.array([[9.34644506e-01, 6.94584791e-02, 3.48733661e-01, 2.10643890e+02],
+                          [1.93729161e-01, 7.22931082e-01, -6.63204085e-01, -6.29575772e+01],
+                          [-2.98175551e-01, 6.87419934e-01, 6.62227431e-01, 1.79234636e+02],
+                          [0.00000000e+00, 0.00000000e+00, 0.00000000e+00, 1.00000000e+00]]),
+                np.array([[9.38109647e-01, -9.10961088e-03, 3.46218578e-01, 2.14951660e+02],
+                          [1.88904348e-01, 8.51322952e-01, -4.89453137e-01, -2.00656108e+00],
+                          [-2.90285096e-01, 5.24562905e-01, 8.00355119e-01, 2.36814343e+02],
+                          [0.00000000e+00, 0.00000000e+00, 0.00000000e+00, 1.00000000e+00]]),
+                np.array([[9.93263427e-01, 4.74376262e-02, -1.05723397e-01, 8.03862230e+01],
+                          [-1.04402391e-01, 7.62213889e-01, -6.38850626e-01, -1.00964112e+02],
+                          [5.02782846e-02, 6.45584738e-01, 7.62031781e-01, 2.10377818e+02],
+                          [0.00000000e+00, 0.00000000e+00, 0.00000000e+00, 1.00000000e+00]]),
+                np.array([[9.99850636e-01, -2.01283961e-19, -1.72830900e-02, 1.18830589e+02],
+                          [-1.36415702e-03, 9.96880145e-01, -7.89183677e-02, 4.83890764e+01],
+                          [1.72291694e-02, 7.89301570e-02, 9.96731248e-01, 3.09244860e+02],
+                          [0.00000000e+00, 0.00000000e+00, 0.00000000e+00, 1.00000000e+00]]),
+                np.array([[9.76281662e-01, -3.05604492e-03, -2.16482739e-01, 6.63181894e+01],
+                          [-1.12491254e-01, 8.47176711e-01, -5.19266148e-01, -6.66881498e+01],
+                          [1.84986036e-01, 5.31302433e-01, 8.26739309e-01, 2.35591590e+02],
+                          [0.00000000e+00, 0.00000000e+00, 0.00000000e+00, 1.00000000e+00]])]
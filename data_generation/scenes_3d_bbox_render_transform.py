@@ -1,127 +1,77 @@
 import json
 import os
-import pickle
 
 import numpy as np
 import trimesh
 from trimesh import Scene
-from tqdm import tqdm
 import trimesh.visual
-from PIL import Image, ImageDraw
-from trimesh.visual.material import SimpleMaterial
 
-from datasets.scenes_3d import Scenes3D
-from utils.images_utils import ImagesUtils
+from data_generation.scenes_3d_bbox_render_base import Scenes3DBboxRenderBase
+from utils.mesh_utils import MeshUtils
 
 
-class Scenes3DBboxRenderTransform:
-    def __init__(self, data_dir):
-        self.output_dir = os.path.join(data_dir, 'generated', 'scenes_3d_bbox_render_transform')
-        self.metadata_output_dir = os.path.join(self.output_dir, 'metadata')
-        self.images_output_dir = os.path.join(self.output_dir, 'images')
-        self.dataset = Scenes3D(data_dir)
-        self.transform_categories = ['chair']
+class Scenes3DBboxRenderTransform(Scenes3DBboxRenderBase):
+    def __init__(self, data_dir, bbox_mode='projection', bbox_tolerance=2, render_backend='trimesh',
+                 output_format='files', shard_size=1000, image_format='png', compress_level=6, quality=95,
+                 encode_workers=4, skip_hidden_scenes=False):
+        super().__init__(data_dir, 'scenes_3d_bbox_render_transform', bbox_mode, bbox_tolerance, render_backend,
+                         output_format, shard_size, image_format, compress_level, quality, encode_workers,
+                         skip_hidden_scenes)
         self.transform_matrix = np.eye(4)
         self.transform_matrix[2, 3] = 50
-        self.output_resolution = (640, 480)
 
-    def initialize(self):
-        self.dataset.initialize()
-        os.makedirs(self.output_dir, exist_ok=True)
-        os.makedirs(self.metadata_output_dir, exist_ok=True)
-        os.makedirs(self.images_output_dir, exist_ok=True)
-
-    def generate(self):
+    def generate_scene(self, scene_id):
         camera_transforms = self.get_camera_transforms()
-        camera_transforms_path = os.path.join(self.metadata_output_dir, 'camera_transforms.pkl')
-        pickle.dump(camera_transforms, open(camera_transforms_path, 'wb'))
-
-        scene_ids = self.dataset.get_scene_ids()
-        for scene_id in tqdm(scene_ids):
-            output_metadata_path = os.path.join(self.metadata_output_dir, scene_id + '.json')
-            if os.path.exists(output_metadata_path):
-                continue
-
-            model_ids = self.get_scene_model_ids(scene_id)
-            output_metadata = {
-                'scene_id': scene_id,
-                'model_ids': model_ids,
-                'generated_scenes': []
-            }
-
-            if not self.is_scene_valid(model_ids):
-                continue
-
-            for camera_transform_index, camera_transform in enumerate(camera_transforms):
-                scene_metadata = {
-                    'camera_transform_index': camera_transform_index,
-                    'plausible':
-                        self.generate_single_view_scene(scene_id, camera_transform, camera_transform_index, False),
-                    'implausible':
-                        self.generate_single_view_scene(scene_id, camera_transform, camera_transform_index, True)
-                }
-
-                output_metadata['generated_scenes'].append(scene_metadata)
-
-            with open(output_metadata_path, 'w') as fp:
-                json.dump(output_metadata, fp)
-
-    def is_scene_valid(self, model_ids):
-        is_valid = False
-        for model_id in model_ids:
-            if self.dataset.get_object_category(model_id) in self.transform_categories:
-                is_valid = True
-                break
-
-        return is_valid
-
-    def generate_single_view_scene(self, scene_id, camera_transform, camera_transform_index, apply_transform):
-        scene_metadata = {
-            'objects': [],
-            'render_path': None
+        output_metadata_path = os.path.join(self.metadata_output_dir, scene_id + '.json')
+        if self.manifest.is_done(scene_id):
+            return
+
+        model_ids = self.get_scene_model_ids(scene_id)
+        output_metadata = {
+            'scene_id': scene_id,
+            'model_ids': model_ids,
+            'generated_scenes': []
         }
 
-        scene, model_ids = self.build_scene(scene_id, apply_transform)
-        scene.camera_transform = camera_transform
-        scene.camera.resolution = self.output_resolution
-        bboxes = self.get_bounding_boxes(scene_id, camera_transform, apply_transform)
-
-        for model_id in model_ids:
-            if 'room' in model_id:
-                continue
-
-            category = self.dataset.get_object_category(model_id)
-            bbox = bboxes[model_id]
-
-            model_metadata = {
-                'model_id': model_id,
-                'bbox': bbox,
-                'category': category
+        if not self.is_scene_valid(model_ids):
+            return
+
+        # Both scenes are built once, every view only moves the camera
+        plausible_objects = self.get_scene_objects(scene_id, False)
+        if self.skip_hidden_scenes and not self.has_visible_targets(plausible_objects, camera_transforms):
+            self.hidden_scenes += 1
+            return
+
+        implausible_objects = self.get_scene_objects(scene_id, True)
+        plausible_scene = self.build_scene(plausible_objects)
+        implausible_scene = self.build_scene(implausible_objects)
+
+        for camera_transform_index, camera_transform in enumerate(camera_transforms):
+            scene_metadata = {
+                'camera_transform_index': camera_transform_index,
+                'plausible':
+                    self.generate_single_view_scene(scene_id, plausible_scene, plausible_objects,
+                                                    camera_transform, camera_transform_index, False),
+                'implausible':
+                    self.generate_single_view_scene(scene_id, implausible_scene, implausible_objects,
+                                                    camera_transform, camera_transform_index, True)
             }
 
-            scene_metadata['objects'].append(model_metadata)
-
-        scene_metadata['render_path'] = self.save_render(scene, scene_id, apply_transform, camera_transform_index)
-        return scene_metadata
-
-    def save_render(self, scene, scene_id, apply_transform, camera_transform_index):
-        img = Image.open(trimesh.util.wrap_as_stream(
-            scene.save_image(background=[255, 255, 255, 0], flags={'cull': False}, resolution=None)))
+            output_metadata['generated_scenes'].append(scene_metadata)
 
-        filename = scene_id + '_' + str(camera_transform_index).zfill(3)
-        if apply_transform:
-            filename += '_implausible'
+        if self.shard_writer is not None:
+            self.pending_metadata.append((output_metadata_path, output_metadata))
         else:
-            filename += '_plausible'
+            # The scene metadata marks the scene as done, it is written once its renders are on disk
+            self.image_encoder.wait()
+            with open(output_metadata_path, 'w') as fp:
+                json.dump(output_metadata, fp)
 
-        filename += '.png'
-        image_path = os.path.join(self.images_output_dir, filename)
-        img.save(image_path)
-        return os.path.basename(self.images_output_dir) + '/' + filename
+            self.manifest.mark_done(scene_id)
 
-    def get_scene_model_ids(self, scene_id):
+    def get_scene_objects(self, scene_id, apply_transformation=False):
         objects_metadata = self.dataset.get_scene_metadata(scene_id)['objects']
-        model_ids = []
+        scene_objects = []
 
         for object_metadata in objects_metadata:
             model_id = object_metadata['modelID']
@@ -132,133 +82,25 @@ class Scenes3DBboxRenderTransform:
             if not os.path.exists(model_path):
                 continue
 
-            model_ids.append(model_id)
+            apply_model_transformation = \
+                apply_transformation and self.dataset.get_object_category(model_id) in self.transform_categories
+            scene_objects.append((model_id, model_path,
+                                  self.get_model_transform(object_metadata, apply_model_transformation)))
 
-        return model_ids
+        return scene_objects
 
-    def get_bounding_boxes(self, scene_id, camera_transform, apply_transformation=False):
-        objects_metadata = self.dataset.get_scene_metadata(scene_id)['objects']
-        bounding_boxes = {}
+    def get_model_transform(self, object_metadata, apply_transformation=False):
+        transformation_matrix = np.reshape(object_metadata['transform'], (4, 4)).T
+        if apply_transformation:
+            return np.dot(self.transform_matrix, transformation_matrix)
 
-        for object_metadata in objects_metadata:
-            scene = Scene()
-            scene.camera_transform = camera_transform
-            scene.camera.resolution = self.output_resolution
+        return transformation_matrix
 
-            model_id = object_metadata['modelID']
-            if model_id is None or model_id == '':
-                continue
-
-            model_path = self.dataset.get_model_path(model_id)
-            if not os.path.exists(model_path) or 'room' in model_path:
-                continue
-
-            model = trimesh.load(model_path)
-            if isinstance(model, Scene):
-                for g in model.geometry:
-                    model.geometry[g] = self.color_model(model.geometry[g], (0, 0, 0))
-            else:
-                model = self.color_model(model, (0, 0, 0))
-
-            transformation_matrix = np.reshape(object_metadata['transform'], (4, 4)).T
-            model.apply_transform(transformation_matrix)
-            if apply_transformation and self.dataset.get_object_category(model_id) in self.transform_categories:
-                model.apply_transform(self.transform_matrix)
-
-            scene.add_geometry(model)
-
-            img = Image.open(trimesh.util.wrap_as_stream(
-                scene.save_image(background=[255, 255, 255, 255], flags={'cull': False}, resolution=None)))
-            bbox = self.detect_bounding_box(img, [0, 0, 0, 255])
-            bounding_boxes[model_id] = bbox
-
-        return bounding_boxes
-
-    def color_model(self, trimesh_object, color):
-        trimesh_object.visual.material = SimpleMaterial(ambient=color, diffuse=color, specular=color)
-        return trimesh_object
-
-    def detect_bounding_box(self, img, foreground_color):
-        img_matrix = ImagesUtils.convert_to_numpy(img)
-        m = np.all(img_matrix == foreground_color, axis=-1)
-        if len(np.unique(m)) == 1:
-            return None
-
-        indices = np.where(m)
-        x1 = int(np.min(indices[1]))
-        x2 = int(np.max(indices[1]))
-        y1 = int(np.min(indices[0]))
-        y2 = int(np.max(indices[0]))
-        return (x1, y1), (x2, y2)
-
-    def build_scene(self, scene_id, apply_transformation=False):
-        objects_metadata = self.dataset.get_scene_metadata(scene_id)['objects']
-        model_ids = []
+    def build_scene(self, scene_objects):
         scene = Scene()
 
-        for object_metadata in objects_metadata:
-            model_id = object_metadata['modelID']
-            if model_id is None or model_id == '':
-                continue
-
-            model_path = self.dataset.get_model_path(model_id)
-            if not os.path.exists(model_path):
-                continue
-
-            model_ids.append(model_id)
-            model = trimesh.load(model_path)
-            transformation_matrix = np.reshape(object_metadata['transform'], (4, 4)).T
-            model.apply_transform(transformation_matrix)
-            if apply_transformation and self.dataset.get_object_category(model_id) in self.transform_categories:
-                model.apply_transform(self.transform_matrix)
-
-            scene.add_geometry(model)
-
-        return scene, model_ids
-
-    def draw_bounding_box(self, img, bbox):
-        draw = ImageDraw.Draw(img)
-        draw.rectangle(tuple(map(tuple, bbox)), outline='#ff8888')
-        return img
+        for index, (model_id, _, model_transform) in enumerate(scene_objects):
+            model = self.dataset.load_model(model_id, copy=False)
+            MeshUtils.add_model(scene, model, '{}_{}'.format(model_id, index), model_transform)
 
-    def get_camera_transforms(self):
-        return [np.array([[1., 0., 0., 123.09577675],
-                          [0., 0.46565674, -0.88496542, -121.93568384],
-                          [0., 0.88496542, 0.46565674, 134.79709113],
-                          [0., 0., 0., 1.]]),
-                np.array([[1., 0., 0., 123.09577675],
-                          [0., 0.16266292, -0.9866817, -130.73452539],
-                          [0., 0.9866817, 0.16266292, 54.55492985],
-                          [0., 0., 0., 1.]]),
-                np.array([[7.54404832e-01, -2.61137239e-18, 6.56409435e-01, 2.27399143e+02],
-                          [6.47667179e-01, 1.62662921e-01, -7.44357439e-01, -4.91768017e+00],
-                          [-1.06773477e-01, 9.86681696e-01, 1.22713694e-01, 3.38129463e+01],
-                          [0.00000000e+00, 0.00000000e+00, 0.00000000e+00, 1.00000000e+00]]),
-                np.array([[9.32193350e-01, -2.59279804e-18, -3.61960713e-01, 7.68570236e+01],
-                          [-3.57140012e-01, 1.62662921e-01, -9.19778115e-01, -5.05534274e+00],
-                          [5.88775871e-02, 9.86681696e-01, 1.51633293e-01, 3.38356411e+01],
-                          [0.00000000e+00, 0.00000000e+00, 0.00000000e+00, 1.00000000e+00]]),
-                np.array([[9.24967757e-01, 1.20992630e-01, -3.60271329e-01, 3.64320925e+01],
-                          [-3.69435302e-01, 5.08689110e-01, -7.77658628e-01, -7.92278879e+01],
-                          [8.91751397e-02, 8.52406104e-01, 5.15219974e-01, 1.36236310e+02],
-                          [0.00000000e+00, 0.00000000e+00, 0.00000000e+00, 1.00000000e+00]]),
-                np.array([[9.34644506e-01, 6.94584791e-02, 3.48733661e-01, 2.10643890e+02],
-                          [1.93729161e-01, 7.22931082e-01, -6.63204085e-01, -6.29575772e+01],
-                          [-2.98175551e-01, 6.87419934e-01, 6.62227431e-01, 1.79234636e+02],
-                          [0.00000000e+00, 0.00000000e+00, 0.00000000e+00, 1.00000000e+00]]),
-                np.array([[9.38109647e-01, -9.10961088e-03, 3.46218578e-01, 2.14951660e+02],
-                          [1.88904348e-01, 8.51322952e-01, -4.89453137e-01, -2.00656108e+00],
-                          [-2.90285096e-01, 5.24562905e-01, 8.00355119e-01, 2.36814343e+02],
-                          [0.00000000e+00, 0.00000000e+00, 0.00000000e+00, 1.00000000e+00]]),
-                np.array([[9.93263427e-01, 4.74376262e-02, -1.05723397e-01, 8.03862230e+01],
-                          [-1.04402391e-01, 7.62213889e-01, -6.38850626e-01, -1.00964112e+02],
-                          [5.02782846e-02, 6.45584738e-01, 7.62031781e-01, 2.10377818e+02],
-                          [0.00000000e+00, 0.00000000e+00, 0.00000000e+00, 1.00000000e+00]]),
-                np.array([[9.99850636e-01, -2.01283961e-19, -1.72830900e-02, 1.18830589e+02],
-                          [-1.36415702e-03, 9.96880145e-01, -7.89183677e-02, 4.83890764e+01],
-                          [1.72291694e-02, 7.89301570e-02, 9.96731248e-01, 3.09244860e+02],
-                          [0.00000000e+00, 0.00000000e+00, 0.00000000e+00, 1.00000000e+00]]),
-                np.array([[9.76281662e-01, -3.05604492e-03, -2.16482739e-01, 6.63181894e+01],
-                          [-1.12491254e-01, 8.47176711e-01, -5.19266148e-01, -6.66881498e+01],
-                          [1.84986036e-01, 5.31302433e-01, 8.26739309e-01, 2.35591590e+02],
-                          [0.00000000e+00, 0.00000000e+00, 0.00000000e+00, 1.00000000e+00]])]
+        return scene
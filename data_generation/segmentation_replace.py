@@ -18,30 +18,34 @@ class SegmentationReplace(BoundingBoxReplace):
         if inpaint_cut:
             self._inpaint_api = GenerativeInpaintingApi(root_path)
 
+    def get_params(self):
+        return {'root_path': self._root_path, 'compare_random': self._compare_random,
+                'cut_background': self._cut_background, 'inpaint_cut': self._inpaint_cut}
+
     def _generate_images(self, category_dir, category_id, image_id_1, image_id_2):
         image_1, seg_1, _ = self._dataset.get_image(image_id_1, [category_id])
         image_2, seg_2, _ = self._dataset.get_image(image_id_2, [category_id])
         edited_image_1, edited_image_2 = \
-            self.replace_content_segmentation(image_1, seg_1[:, :, 0], image_2, seg_2[:, :, 0])
+            self.replace_content_segmentation(image_1, seg_1[0], image_2, seg_2[0])
 
-        path = ImagesUtils.save_image(edited_image_1, category_dir, '{}_edited'.format(str(image_id_1)))
+        path = self._save_image(edited_image_1, category_dir, '{}_edited'.format(str(image_id_1)))
         if path is not None:
             self._log(image_id_1, path, is_correct=1)
-        path = ImagesUtils.save_image(edited_image_2, category_dir, '{}_edited'.format(str(image_id_2)))
+        path = self._save_image(edited_image_2, category_dir, '{}_edited'.format(str(image_id_2)))
         if path is not None:
             self._log(image_id_2, path, is_correct=1)
 
         if self._compare_random:
             compare_output_dir = os.path.join(self._compare_dir, self._categories[category_id])
             self._generate_comparison(image_id_1, image_id_2, image_1, edited_image_1,
-                                      image_2, seg_2[:, :, 0], compare_output_dir)
+                                      image_2, seg_2[0].decode(), compare_output_dir)
             self._generate_comparison(image_id_2, image_id_1, image_2, edited_image_2,
-                                      image_1, seg_1[:, :, 0], compare_output_dir)
+                                      image_1, seg_1[0].decode(), compare_output_dir)
 
     def _generate_comparison(self, image_id_1, image_id_2, image_1, edited_image_1, image_2, seg_2, category_dir):
         random_edit_1 = SegmentationUtils.random_place_segmentation(image_1, image_2, seg_2)
 
-        path = ImagesUtils.save_image(random_edit_1, category_dir, '{}_random'.format(str(image_id_1)))
+        path = self._save_image(random_edit_1, category_dir, '{}_random'.format(str(image_id_1)))
         if path is not None:
             self._log(image_id_1, path, is_correct=0)
 
@@ -52,29 +56,30 @@ class SegmentationReplace(BoundingBoxReplace):
             images = [random_edit_1, edited_image_1]
 
         couple = ImagesUtils.concat_images(images)
-        path = ImagesUtils.save_image(couple, category_dir, '{}_{}'.format(str(image_id_1), str(image_id_2)))
+        path = self._save_image(couple, category_dir, '{}_{}'.format(str(image_id_1), str(image_id_2)),
+                                comparison=True)
         if path is not None:
             self._log_comparison(image_id_1, image_id_2, path, correct_image_index)
 
     def replace_content_segmentation(self, img1, seg1, img2, seg2):
+        # seg1 and seg2 are RleMask objects, only the bbox crops are decoded unless the background is cut
         img1 = Image.fromarray(img1)
         img2 = Image.fromarray(img2)
 
-        bbox1 = SegmentationUtils.get_bbox(seg1)
-        bbox2 = SegmentationUtils.get_bbox(seg2)
-
-        seg1 = Image.fromarray(seg1 * 255)
-        seg2 = Image.fromarray(seg2 * 255)
+        bbox1 = seg1.get_bbox()
+        bbox2 = seg2.get_bbox()
 
         region_image_1 = img1.crop(bbox1)
         region_size_1 = region_image_1.size
-        region_seg_1 = seg1.crop(bbox1)
+        region_seg_1 = Image.fromarray(seg1.decode_crop(bbox1) * 255)
 
         region_image_2 = img2.crop(bbox2)
         region_size_2 = region_image_2.size
-        region_seg_2 = seg2.crop(bbox2)
+        region_seg_2 = Image.fromarray(seg2.decode_crop(bbox2) * 255)
 
         if self._cut_background or self._inpaint_cut:
+            seg1 = Image.fromarray(seg1.decode() * 255)
+            seg2 = Image.fromarray(seg2.decode() * 255)
             img1.paste((0, 0, 0), mask=seg1)
             img2.paste((0, 0, 0), mask=seg2)
 
@@ -4,13 +4,24 @@ import os
 import numpy as np
 import trimesh
 from trimesh import Scene
-from PIL import Image
 
 from utils.files_utils import FilesUtils
+from utils.mesh_cache import MeshCache
+from utils.mesh_store import MeshStore
+from utils.mesh_utils import MeshUtils
+from utils.obj_manifest import ObjManifest
+from utils.model_bounds_index import ModelBoundsIndex
+from utils.render_backends import TrimeshRenderBackend
 
 
 class FrontFuture3D:
-    def __init__(self, data_path):
+    # Shared by every FrontFuture3D instance in the process, keyed by model file content so the same furniture
+    # exported into many layouts is parsed once
+    mesh_cache = MeshCache(max_size=None, max_bytes=2 * 1024 ** 3)
+    # Content hashes by (path, size, mtime), a cache hit only stats the file instead of reading it again
+    _content_hashes = {}
+
+    def __init__(self, data_path, render_backend=None, disk_mesh_cache=False):
         self._3d_future_model_url = \
             'https://tianchi-media.oss-accelerate.aliyuncs.com/65347_3D-future/3D-FUTURE-model.zip'
         self._3d_front_url = 'https://tianchi-media.oss-accelerate.aliyuncs.com/65347_3D-future/3D-FRONT.zip'
@@ -20,6 +31,13 @@ class FrontFuture3D:
         self._3d_future_model_dir = os.path.join(self.front_future_dir, '3D-FUTURE-model')
         self.obj_custom_dir = os.path.join(self.front_future_dir, 'obj_output')
         self._camera_json = os.path.join(self.front_future_dir, 'camera_json')
+        self.mesh_store = MeshStore(os.path.join(self.front_future_dir, 'mesh_store'))
+        self.content_mesh_store = None
+        if disk_mesh_cache:
+            self.content_mesh_store = MeshStore(os.path.join(self.front_future_dir, 'content_mesh_cache'))
+        self.bounds_index = ModelBoundsIndex(os.path.join(self.front_future_dir, 'model_bounds.npz'))
+        self.manifest = ObjManifest(self.obj_custom_dir, os.path.join(self.front_future_dir, 'obj_manifest.json'))
+        self.render_backend = render_backend if render_backend is not None else TrimeshRenderBackend()
 
     def initialize(self, force_init=False):
         os.makedirs(self.front_future_dir, exist_ok=True)
@@ -37,59 +55,92 @@ class FrontFuture3D:
                             format(self._camera_json))
 
     def get_scene_ids(self):
-        return os.listdir(self.obj_custom_dir)
+        return self.manifest.get_scene_ids()
 
     def get_model_paths(self):
-        model_ids = {}
-        scene_paths = [os.path.join(self.obj_custom_dir, d) for d in os.listdir(self.obj_custom_dir)
-                       if os.path.isdir(os.path.join(self.obj_custom_dir, d))]
+        return self.manifest.get_model_paths()
 
-        for scene_path in scene_paths:
-            room_dirs = [os.path.join(scene_path, d) for d in os.listdir(scene_path)
-                         if os.path.isdir(os.path.join(scene_path, d))]
+    def get_model_sources(self):
+        # Every obj under obj_output, including the room meshes used by compose_layout
+        return [(self.get_model_id(model_path), model_path)
+                for model_path in self.manifest.get_model_paths(include_room_meshes=True)]
 
-            for room_dir in room_dirs:
-                model_paths = [os.path.join(room_dir, f) for f in os.listdir(room_dir)
-                               if f != 'mesh.obj' and f.endswith('.obj')]
+    def get_model_id(self, model_path):
+        return os.path.splitext(os.path.relpath(model_path, self.obj_custom_dir))[0].replace(os.sep, '/')
 
-                for model_path in model_paths:
-                    model_ids[model_path] = 1
+    def get_model_bounds(self, model_path):
+        return self.bounds_index.get(self.get_model_id(model_path))
 
-        return list(model_ids.keys())
+    def load_model(self, model_path):
+        # The returned model is shared, callers place it with scene graph node transforms
+        model_id = self.get_model_id(model_path)
+        if model_id in self.mesh_store:
+            return FrontFuture3D.mesh_cache.get('store:' + model_id, lambda: self.mesh_store.load(model_id),
+                                                copy=False)
 
-    def count_categories(self):
-        categories = {}
-        model_paths = self.get_model_paths()
-        for model_path in model_paths:
-            categories[self.get_obj_category(model_path)] = 1
+        content_hash = FrontFuture3D._get_content_hash(model_path)
+        return FrontFuture3D.mesh_cache.get(content_hash, lambda: self._load_content(content_hash, model_path),
+                                            copy=False)
+
+    @staticmethod
+    def _get_content_hash(model_path):
+        stat = os.stat(model_path)
+        key = (model_path, stat.st_size, stat.st_mtime_ns)
+        content_hash = FrontFuture3D._content_hashes.get(key)
+        if content_hash is None:
+            content_hash = FilesUtils.get_file_hash(model_path)
+            FrontFuture3D._content_hashes[key] = content_hash
+
+        return content_hash
+
+    def _load_content(self, content_hash, model_path):
+        if self.content_mesh_store is None:
+            return trimesh.load(model_path)
+
+        # Files are named by content, so they never go stale and need no index
+        cached_path = os.path.join(self.content_mesh_store.store_dir, content_hash + '.mesh')
+        if os.path.exists(cached_path):
+            return self.content_mesh_store.load_file(cached_path, model_path)
+
+        model = trimesh.load(model_path)
+        os.makedirs(self.content_mesh_store.store_dir, exist_ok=True)
+        self.content_mesh_store.write(cached_path, model)
+        return model
 
-        return len(categories)
+    def count_categories(self):
+        return len(self.manifest.get_categories())
 
     def get_obj_category(self, model_path):
-        with open(model_path) as f:
-            first_line = f.readline()
-            if first_line.startswith('# category='):
-                category = first_line.replace('# category=', '').strip()
-
-            return category
+        return self.manifest.get_category(model_path)
 
     def render_model(self, model_path):
         category = self.get_obj_category(model_path)
-
-        result = []
-        for x in range(0, 360, 120):
-            for y in range(0, 360, 120):
-                for z in range(0, 360, 120):
-                    scene = Scene()
-                    obj = trimesh.load(model_path)
-                    obj.apply_transform((self.x_rotation(np.deg2rad(x))))
-                    obj.apply_transform((self.y_rotation(np.deg2rad(y))))
-                    obj.apply_transform((self.z_rotation(np.deg2rad(z))))
-                    scene.add_geometry(obj)
-                    result.append(np.array(Image.open(trimesh.util.wrap_as_stream(
-                        scene.save_image(background=[255, 255, 255, 0], flags={'cull': True})))))
-
-        return result, category
+        return list(self.iter_model_renders(model_path)), category
+
+    def iter_model_renders(self, model_path, step=120):
+        # The model is loaded once, every orientation only changes its node pose and re-frames the camera
+        scene = Scene()
+        nodes = MeshUtils.add_model(scene, self.load_model(model_path), 'model', np.eye(4))
+        for rotation in self.get_rotation_matrices(step):
+            MeshUtils.set_model_transform(scene, nodes, rotation)
+            scene.set_camera()
+            yield self.render_backend.render(scene, background=[255, 255, 255, 0], cull=True)
+
+    def get_rotation_matrices(self, step=120):
+        # All x, y, z combinations in x, y, z loop order, each one rotating around x first, then y and then z
+        angles = np.deg2rad(np.arange(0, 360, step))
+        cos = np.cos(angles)
+        sin = np.sin(angles)
+        count = len(angles)
+
+        x = np.tile(np.eye(4), (count, 1, 1))
+        x[:, 1, 1], x[:, 1, 2], x[:, 2, 1], x[:, 2, 2] = cos, -sin, sin, cos
+        y = np.tile(np.eye(4), (count, 1, 1))
+        y[:, 0, 0], y[:, 0, 2], y[:, 2, 0], y[:, 2, 2] = cos, sin, -sin, cos
+        z = np.tile(np.eye(4), (count, 1, 1))
+        z[:, 0, 0], z[:, 0, 1], z[:, 1, 0], z[:, 1, 1] = cos, -sin, sin, cos
+
+        return np.einsum('cij,bjk,akl->abcil', z, y, x).reshape((-1, 4, 4))
 
     def z_rotation(self, angle):
         rot = np.eye(4)
@@ -127,42 +178,49 @@ class FrontFuture3D:
     def compose_layout(self, layout_id, transform_categories, transform_matrix):
         correct_imgs = []
         incorrect_imgs = []
-        layout_dir = os.path.join(self.obj_custom_dir, layout_id)
-        rooms_ids = os.listdir(layout_dir)
         camera_json_path = os.path.join(self._camera_json, layout_id + '.camera.json')
 
-        layout_files = []
-        for rooms_id in rooms_ids:
-            room_dir = os.path.join(self.obj_custom_dir, layout_id, rooms_id)
-            room_files = [os.path.join(room_dir, f) for f in os.listdir(room_dir) if f.endswith('.obj')]
+        layout_files = {}
+        for room_id in self.manifest.get_room_ids(layout_id):
+            room_files = self.manifest.get_room_models(layout_id, room_id)
             if len(room_files) > 1:
-                layout_files.extend(room_files)
+                layout_files.update(room_files)
 
         scene_trimesh = Scene()
-        categories = {}
-        for obj_file in layout_files:
-            with open(obj_file) as f:
-                first_line = f.readline()
-                if first_line.startswith('# category='):
-                    category = first_line.replace('# category=', '')
-                    k = os.path.basename(obj_file)
-                    categories[k] = category.lower()
-
-            obj_trimesh = trimesh.load(obj_file)
-            scene_trimesh.add_geometry(obj_trimesh, node_name=obj_file)
+        category_nodes = {}
+        for obj_file, category in layout_files.items():
+            if category is not None:
+                category = category.lower()
+
+            obj_trimesh = self.load_model(obj_file)
+            nodes = MeshUtils.add_model(scene_trimesh, obj_trimesh, obj_file, np.eye(4))
+            if category is not None:
+                category_nodes.setdefault(category, []).append(nodes)
+
+        transformed_nodes = self.get_transformed_nodes(category_nodes, transform_categories)
 
         with open(camera_json_path) as camera_json_file:
             camera_json = json.load(camera_json_file)
             for camera_params in camera_json:
-                correct_img, incorrect_img = self.render_view(scene_trimesh, transform_categories, transform_matrix,
-                                                              camera_params, categories)
+                correct_img, incorrect_img = self.render_view(scene_trimesh, transform_matrix, camera_params,
+                                                              transformed_nodes)
                 correct_imgs.append(correct_img)
                 incorrect_imgs.append(incorrect_img)
 
         return correct_imgs, incorrect_imgs
 
-    def render_view(self, scene_trimesh, transform_categories, transform_matrix, camera_params, categories):
-        temp_scene = scene_trimesh.copy()
+    def get_transformed_nodes(self, category_nodes, transform_categories):
+        # Resolved once per layout, a category matches when it contains one of the transform categories
+        transformed_nodes = []
+        for category, nodes in category_nodes.items():
+            if any(transform_category in category for transform_category in transform_categories):
+                transformed_nodes.extend(nodes)
+
+        return transformed_nodes
+
+    def render_view(self, scene_trimesh, transform_matrix, camera_params, transformed_nodes):
+        # The scene is shared between views, the implausible variant only moves scene graph nodes and is undone
+        temp_scene = scene_trimesh
         pos = np.array(camera_params['pos'])
         target = np.array(camera_params['target'])
         fov = camera_params['fov']
@@ -171,20 +229,21 @@ class FrontFuture3D:
         dist = np.sqrt(squared_dist)
         trans = temp_scene.camera.look_at(points=[target], center=pos, distance=dist * 1.2)
         temp_scene.camera_transform = trans
-        correct_img = Image.open(trimesh.util.wrap_as_stream(
-            temp_scene.save_image(resolution=(1000, 1000), background=[255, 255, 255, 0], flags={'cull': True})))
+        correct_img = self.render_backend.render(temp_scene, resolution=(1000, 1000), background=[255, 255, 255, 0],
+                                                 cull=True)
 
-        for name in categories:
-            for geo_identifier in temp_scene.geometry:
-                category = categories[name].lower()
-                for transform_category in transform_categories:
-                    if transform_category in category and name in geo_identifier:
-                        temp_scene.geometry[geo_identifier].apply_transform(transform_matrix)
+        # Undone even if the render fails, the next views of the shared scene must start from the plausible layout
+        try:
+            for nodes in transformed_nodes:
+                MeshUtils.set_model_transform(temp_scene, nodes, transform_matrix)
 
-        incorrect_image = Image.open(trimesh.util.wrap_as_stream(
-            temp_scene.save_image(resolution=(1000, 1000), background=[255, 255, 255, 0], flags={'cull': True})))
+            incorrect_image = self.render_backend.render(temp_scene, resolution=(1000, 1000),
+                                                         background=[255, 255, 255, 0], cull=True)
+        finally:
+            for nodes in transformed_nodes:
+                MeshUtils.set_model_transform(temp_scene, nodes, np.eye(4))
 
-        return np.array(correct_img), np.array(incorrect_image)
+        return correct_img, incorrect_image
 
     def look_at(self, center, target):
         up = np.array([0.0, 1.0, 0.0])
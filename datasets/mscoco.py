@@ -1,25 +1,38 @@
 import os
-import pickle
 
 from pycocotools.coco import COCO
 import matplotlib.pyplot as plt
-import skimage.io as io
 import numpy as np
 import matplotlib
 
+from utils.coco_index import CocoIndex
 from utils.files_utils import FilesUtils
+from utils.image_store import ImageStore
+from utils.rle_mask import RleMask
 
 
 class Mscoco:
-    def __init__(self, data_path, category_ids=[]):
+    def __init__(self, data_path, category_ids=[], images_root=None, images_layout='folder', allow_download=True):
         self._mscoco_file = 'annotations_trainval2017.zip'
         self._download_url = 'http://images.cocodataset.org/annotations/annotations_trainval2017.zip'
         self._mscoco_dir = os.path.join(data_path, 'mscoco')
         self._annotation_dir = os.path.join(self._mscoco_dir, 'annotations')
         self._annotation_file = os.path.join(self._annotation_dir, 'instances_train2017.json')
-        self._mscoco_api_path = os.path.join(self._mscoco_dir, 'mscoco_api.pkl')
-        self._mscoco_api = None
+        self._index = CocoIndex(os.path.join(self._mscoco_dir, 'coco_index'))
         self.category_ids = category_ids
+        self._params = {'data_path': data_path, 'category_ids': category_ids, 'images_root': images_root,
+                        'images_layout': images_layout, 'allow_download': allow_download}
+        if images_root is None:
+            images_root = os.path.join(self._mscoco_dir, 'train2017')
+        self._image_store = ImageStore(images_root, images_layout, allow_download=allow_download)
+
+    def close(self):
+        # Stops the image prefetch threads
+        self._image_store.close()
+
+    def get_params(self):
+        # Constructor arguments, used to open the same dataset in worker processes
+        return dict(self._params)
 
     def initialize(self, force_init=False):
         os.makedirs(self._mscoco_dir, exist_ok=True)
@@ -34,68 +47,98 @@ class Mscoco:
 
         FilesUtils.validate_path(self._annotation_dir)
         FilesUtils.validate_path(self._annotation_file)
-        self._mscoco_api = self.__load_mscoco_api()
+        self._index.load_or_build(self._annotation_file)
 
     def get_image(self, image_id, category_ids=None):
-        img_object = self._mscoco_api.loadImgs(image_id)[0]
-        img = io.imread(img_object['coco_url'])
+        img_object = self._index.get_image_info(image_id)
+        img = self._image_store.get(img_object['file_name'], img_object['coco_url'])
 
         selected_categories = category_ids
         if selected_categories is None:
             selected_categories = self.category_ids
 
-        annotation_ids = self._mscoco_api.getAnnIds(imgIds=img_object['id'], catIds=selected_categories, iscrowd=None)
-        annotations = self._mscoco_api.loadAnns(annotation_ids)
+        # Masks are returned as RLE, callers decode the ones they use, or only their bbox crop
+        annotation_indices = self._index.get_annotation_indices(image_id, selected_categories)
         segmentation_masks = []
         bbox_masks = []
-        for annotation in annotations:
-            segmentation_masks.append(self._mscoco_api.annToMask(annotation))
-            bbox_masks.append((int(annotation['bbox'][0]),
-                               int(annotation['bbox'][1]),
-                               int(annotation['bbox'][2]),
-                               int(annotation['bbox'][3])))
+        for annotation_index in annotation_indices:
+            segmentation_masks.append(RleMask(self._index.get_rle(annotation_index)))
+            bbox = self._index.get_column('bboxes')[annotation_index]
+            bbox_masks.append((int(bbox[0]), int(bbox[1]), int(bbox[2]), int(bbox[3])))
+
+        return img, segmentation_masks, bbox_masks
+
+    def get_annotations_metadata(self, image_ids, category_ids=None):
+        # Annotation geometry only, no pixels or masks are loaded. Per annotation arrays are aligned with
+        # 'image_ids', 'first_annotation' holds the first matching annotation of every requested image or -1
+        selected_categories = category_ids
+        if selected_categories is None:
+            selected_categories = self.category_ids
 
-        return img, np.dstack(segmentation_masks), bbox_masks
+        image_ids = np.asarray(image_ids, dtype=np.int64)
+        rows = np.array([self._index.get_image_row(image_id) for image_id in image_ids.tolist()], dtype=np.int64)
+        offsets = self._index.get_column('image_ann_offsets')
+        starts = offsets[rows] if len(rows) else np.zeros(0, dtype=np.int64)
+        counts = offsets[rows + 1] - starts if len(rows) else np.zeros(0, dtype=np.int64)
+
+        # Expand the per image offset ranges into annotation rows without a python loop over annotations
+        owners = np.repeat(np.arange(len(rows)), counts)
+        annotation_indices = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(np.sum(counts))
+        if selected_categories:
+            selected = np.isin(self._index.get_column('ann_category_ids')[annotation_indices], selected_categories)
+            owners = owners[selected]
+            annotation_indices = annotation_indices[selected]
+
+        first_annotation = np.full(len(rows), -1, dtype=np.int64)
+        owner_ids, first_positions = np.unique(owners, return_index=True)
+        first_annotation[owner_ids] = first_positions
+
+        image_sizes = np.zeros((len(rows), 2), dtype=np.int64)
+        if len(rows):
+            image_sizes[:, 0] = self._index.get_column('widths')[rows]
+            image_sizes[:, 1] = self._index.get_column('heights')[rows]
+
+        return {'image_ids': image_ids[owners],
+                'bboxes': np.array(self._index.get_column('bboxes')[annotation_indices], dtype=np.float64),
+                'areas': np.array(self._index.get_column('areas')[annotation_indices], dtype=np.float64),
+                'image_sizes': image_sizes,
+                'first_annotation': first_annotation}
+
+    def prefetch_images(self, image_ids):
+        img_objects = [self._index.get_image_info(image_id) for image_id in image_ids]
+        self._image_store.prefetch([(img_object['file_name'], img_object['coco_url']) for img_object in img_objects])
 
     def get_categories(self):
-        categories = self._mscoco_api.loadCats(self._mscoco_api.getCatIds())
-        return [(c['id'], c['name']) for c in categories]
+        return [(c[0], c[1]) for c in self._index.categories]
 
     def count_categories(self):
         print(len(self.get_categories()))
 
     def get_random_image_id(self):
-        img_ids = self._mscoco_api.getImgIds()
-        return img_ids[np.random.randint(0, len(img_ids))]
+        img_ids = self._index.get_column('image_ids')
+        return int(img_ids[np.random.randint(0, len(img_ids))])
 
     def get_image_ids(self, category_ids=None):
         selected_categories = category_ids
         if selected_categories is None:
             selected_categories = self.category_ids
 
-        img_ids = self._mscoco_api.getImgIds(catIds=selected_categories)
-        return img_ids
+        img_ids = self._index.get_image_ids(selected_categories)
+        return img_ids.tolist()
 
     def display_image(self, image_id, show_annotation=False):
         # Allow interactive mode
         matplotlib.use('TkAgg')
 
-        img = self._mscoco_api.loadImgs(image_id)[0]
-        i = io.imread(img['coco_url'])
+        img = self._index.get_image_info(image_id)
+        i = self._image_store.get(img['file_name'], img['coco_url'])
         plt.axis('off')
         plt.imshow(i)
 
         if show_annotation:
-            annotation_id = self._mscoco_api.getAnnIds(imgIds=img['id'], iscrowd=None)
-            annotation = self._mscoco_api.loadAnns(annotation_id)
-            self._mscoco_api.showAnns(annotation)
+            # showAnns only needs the segmentations, the RLE ones are drawn from the index blob
+            annotation = [{'segmentation': self._index.get_rle(annotation_index), 'iscrowd': 1}
+                          for annotation_index in self._index.get_annotation_indices(image_id)]
+            COCO().showAnns(annotation)
 
         plt.show()
-
-    def __load_mscoco_api(self):
-        if os.path.exists(self._mscoco_api_path):
-            return pickle.load(open(self._mscoco_api_path, 'rb'))
-        else:
-            coco = COCO(self._annotation_file)
-            pickle.dump(coco, open(self._mscoco_api_path, 'wb'))
-            return coco
@@ -4,11 +4,12 @@ from PIL import Image
 import scipy.io as sio
 
 from utils.files_utils import FilesUtils
+from utils.mesh_store import MeshStore
 from utils.obj_render import ObjRender
 
 
 class ObjectNet3D:
-    def __init__(self, data_path):
+    def __init__(self, data_path, render_backend=None):
         self._annotation_url = 'ftp://cs.stanford.edu/cs/cvgl/ObjectNet3D/ObjectNet3D_annotations.zip'
         self._images_url = 'ftp://cs.stanford.edu/cs/cvgl/ObjectNet3D/ObjectNet3D_images.zip'
         self._cad_url = 'ftp://cs.stanford.edu/cs/cvgl/ObjectNet3D/ObjectNet3D_cads.zip'
@@ -19,6 +20,8 @@ class ObjectNet3D:
         self._images_dir = os.path.join(self._object_3d_net_dir, 'ObjectNet3D', 'Images')
         self._metadata_dir = os.path.join(self._object_3d_net_dir, 'ObjectNet3D', 'Image_sets')
         self._shapenet_dir = os.path.join(data_path, 'shape_net', 'ShapeNetCore.v1')
+        self.mesh_store = MeshStore(os.path.join(data_path, 'shape_net', 'mesh_store'))
+        self.render_backend = render_backend
 
     def initialize(self, force_init=False):
         os.makedirs(self._object_3d_net_dir, exist_ok=True)
@@ -70,6 +73,26 @@ class ObjectNet3D:
         image_path = os.path.join(self._images_dir, img_file_name)
         return Image.open(image_path)
 
+    def get_model_sources(self):
+        sources = []
+        for synset in sorted(os.listdir(self._shapenet_dir)):
+            synset_dir = os.path.join(self._shapenet_dir, synset)
+            if not os.path.isdir(synset_dir):
+                continue
+
+            for model_dir in sorted(os.listdir(synset_dir)):
+                path = os.path.join(synset_dir, model_dir, 'model.obj')
+                if os.path.exists(path):
+                    sources.append(('{}/{}'.format(synset, model_dir), path))
+
+        return sources
+
+    def load_shapenet_model(self, record, path):
+        if not os.path.exists(path):
+            raise Exception('Path {} does not exists'.format(path))
+
+        return self.mesh_store.load('{}/{}'.format(record['shapenet_dir'], record['shapenet_sub_dir']), path)
+
     def get_renders(self, image_id):
         result = []
         _, records, _ = self.get_image(image_id)
@@ -79,7 +102,7 @@ class ObjectNet3D:
             else:
                 path = os.path.join(self._shapenet_dir, record['shapenet_dir'], record['shapenet_sub_dir'], 'model.obj')
 
-            obj_render = ObjRender(path, record)
+            obj_render = ObjRender(path, record, self.render_backend, self.load_shapenet_model(record, path))
             rendered = obj_render.render()
             result.append((record, rendered))
 
@@ -93,7 +116,7 @@ class ObjectNet3D:
             else:
                 path = os.path.join(self._shapenet_dir, record['shapenet_dir'], record['shapenet_sub_dir'], 'model.obj')
 
-            obj_render = ObjRender(path, record)
+            obj_render = ObjRender(path, record, self.render_backend, self.load_shapenet_model(record, path))
             rendered = obj_render.render()
             self.construct_image(img, rendered, record)
 
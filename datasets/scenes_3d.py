@@ -1,16 +1,27 @@
 import os
 import json
-import trimesh
+import pickle
+import struct
+
 import numpy as np
-from PIL import Image
 
 from trimesh import Scene
 
 from utils.files_utils import FilesUtils
+from utils.mesh_cache import MeshCache
+from utils.mesh_utils import MeshUtils
+from utils.mesh_store import MeshStore
+from utils.model_bounds_index import ModelBoundsIndex
+from utils.render_backends import TrimeshRenderBackend
 
 
 class Scenes3D:
-    def __init__(self, data_dir):
+    # Shared by every Scenes3D instance in the process, keyed by model path
+    mesh_cache = MeshCache(max_size=512)
+    # Bump whenever the layout or the parsing of the scenes cache changes
+    scenes_cache_version = 1
+
+    def __init__(self, data_dir, render_backend=None):
         self.scenes_3d_dir = os.path.join(data_dir, 'scenes_3d')
 
         self._models_url = 'http://graphics.stanford.edu/projects/actsynth/datasets/wss.models.zip'
@@ -24,13 +35,32 @@ class Scenes3D:
         self._model_scale_path = os.path.join(self.scenes_3d_dir, 'model_scales.csv')
         self._scenes_path = os.path.join(self.scenes_3d_dir, 'scenes.csv')
         self._categories_path = os.path.join(self.scenes_3d_dir, 'model_categories.tsv')
+        self._scenes_cache_path = os.path.join(self.scenes_3d_dir, 'scenes_cache.bin')
+        self.mesh_store = MeshStore(os.path.join(self.scenes_3d_dir, 'mesh_store'))
+        self.bounds_index = ModelBoundsIndex(os.path.join(self.scenes_3d_dir, 'model_bounds.npz'))
         self._scenes = {}
+        self._scene_offsets = {}
         self._categories = {}
+        self.render_backend = render_backend if render_backend is not None else TrimeshRenderBackend()
 
     def initialize(self):
         os.makedirs(self.scenes_3d_dir, exist_ok=True)
         self.download_and_extract(force_init=False)
 
+        self._scenes = {}
+        if not self._load_scenes_cache():
+            self._parse_sources()
+            try:
+                self._save_scenes_cache()
+            except OSError as e:
+                # Read only dataset mounts, the parsed scenes are kept in memory instead
+                print('Could not write scenes cache {}: {}'.format(self._scenes_cache_path, e))
+
+    def _get_sources_signature(self):
+        return [(os.path.getmtime(path), os.path.getsize(path)) for path in (self._scenes_path, self._categories_path)]
+
+    def _parse_sources(self):
+        scenes = {}
         with open(self._scenes_path) as f:
             scenes_lines = f.readlines()
 
@@ -38,8 +68,9 @@ class Scenes3D:
             separator_index = line.find(',')
             scene_name = line[:separator_index]
             scene_data = line[separator_index + 1:]
-            self._scenes[scene_name] = json.loads(scene_data[1:-2])
+            scenes[scene_name] = json.loads(scene_data[1:-2])
 
+        categories = {}
         with open(self._categories_path) as f:
             categories_lines = f.readlines()
 
@@ -47,7 +78,62 @@ class Scenes3D:
             split_line = line.split()
             model_id = split_line[0].replace('wss.', '')
             category = split_line[1].lower()
-            self._categories[model_id] = category
+            categories[model_id] = category
+
+        self._scenes = scenes
+        self._categories = categories
+
+    def _save_scenes_cache(self):
+        # Scenes are pickled one by one after the header, so every process only unpickles the scenes it uses
+        blobs = [(scene_id, pickle.dumps(scene, protocol=pickle.HIGHEST_PROTOCOL))
+                 for scene_id, scene in self._scenes.items()]
+        offsets = {}
+        offset = 0
+        for scene_id, blob in blobs:
+            offsets[scene_id] = (offset, len(blob))
+            offset += len(blob)
+
+        header = pickle.dumps({'version': Scenes3D.scenes_cache_version, 'sources': self._get_sources_signature(),
+                               'categories': self._categories, 'offsets': offsets},
+                              protocol=pickle.HIGHEST_PROTOCOL)
+
+        temp_path = '{}.{}.tmp'.format(self._scenes_cache_path, os.getpid())
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(struct.pack('<Q', len(header)))
+                f.write(header)
+                for _, blob in blobs:
+                    f.write(blob)
+
+            os.replace(temp_path, self._scenes_cache_path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        self._scene_offsets = {scene_id: (8 + len(header) + start, length)
+                               for scene_id, (start, length) in offsets.items()}
+
+    def _load_scenes_cache(self):
+        if not os.path.exists(self._scenes_cache_path):
+            return False
+
+        try:
+            with open(self._scenes_cache_path, 'rb') as f:
+                header_length = struct.unpack('<Q', f.read(8))[0]
+                header = pickle.loads(f.read(header_length))
+        except Exception as e:
+            print('Ignoring unreadable scenes cache {}: {}'.format(self._scenes_cache_path, e))
+            return False
+
+        if header.get('version') != Scenes3D.scenes_cache_version or \
+                header.get('sources') != self._get_sources_signature():
+            return False
+
+        self._categories = header['categories']
+        self._scene_offsets = {scene_id: (8 + header_length + start, length)
+                               for scene_id, (start, length) in header['offsets'].items()}
+        return True
 
     def download_and_extract(self, force_init):
         if not os.path.exists(self._models_zip_path) or force_init:
@@ -71,9 +157,19 @@ class Scenes3D:
             FilesUtils.download(self._scenes_url, self._scenes_path)
 
     def get_scene_ids(self):
-        return list(self._scenes.keys())
+        # Without a scenes cache all scenes were parsed into memory
+        if not self._scene_offsets:
+            return list(self._scenes.keys())
+
+        return list(self._scene_offsets.keys())
 
     def get_scene_metadata(self, scene_id):
+        if scene_id not in self._scenes:
+            offset, length = self._scene_offsets[scene_id]
+            with open(self._scenes_cache_path, 'rb') as f:
+                f.seek(offset)
+                self._scenes[scene_id] = pickle.loads(f.read(length))
+
         return self._scenes[scene_id]
 
     def get_model_path(self, model_id):
@@ -82,52 +178,58 @@ class Scenes3D:
     def get_object_category(self, model_id):
         return self._categories[model_id]
 
-    def compose_layout(self, scene_id, transform_categories, transform_matrix):
-        correct_scenes, incorrect_scenes = self.compose_scene(scene_id, transform_categories, transform_matrix)
-        correct_images = []
-        incorrect_images = []
-        for correct_scene in correct_scenes:
-            correct_image = Image.open(trimesh.util.wrap_as_stream(
-                correct_scene.save_image(background=[255, 255, 255, 0], flags={'cull': True})))
-            correct_images.append(np.array(correct_image))
-
-        for incorrect_scene in incorrect_scenes:
-            incorrect_image = Image.open(trimesh.util.wrap_as_stream(
-                incorrect_scene.save_image(background=[255, 255, 255, 0], flags={'cull': True})))
-            incorrect_images.append(np.array(incorrect_image))
+    def get_model_sources(self):
+        return [(f[:-len('.obj')], os.path.join(self._models_dir, f)) for f in sorted(os.listdir(self._models_dir))
+                if f.endswith('.obj')]
 
-        return correct_images, incorrect_images
+    def get_model_bounds(self, model_id):
+        return self.bounds_index.get(model_id)
+
+    def get_scene_cost(self, scene_id):
+        # Total face count of the scene models, 0 for models missing from the bounds index
+        return sum(self.bounds_index.get_face_count(o['modelID']) for o in self.get_scene_metadata(scene_id)['objects']
+                   if o['modelID'])
+
+    def load_model(self, model_id, copy=True):
+        model_path = self.get_model_path(model_id)
+        return Scenes3D.mesh_cache.get(model_path, lambda: self.mesh_store.load(model_id, model_path), copy=copy)
 
-    def compose_scene(self, scene_id, transform_categories, transform_matrix):
-        correct_scenes = []
-        incorrect_scenes = []
-        scene_json = self._scenes[scene_id]
-        metadata_jsons = scene_json['objects']
-        camera_transforms = self.get_camera_transforms()
+    def compose_layout(self, scene_id, transform_categories, transform_matrix):
+        scene, transformed_objects = self.compose_scene(scene_id, transform_categories)
+        correct_images = self.render_views(scene)
+
+        # The implausible variant only moves the scene graph nodes of the transformed objects
+        for nodes, model_transform in transformed_objects:
+            MeshUtils.set_model_transform(scene, nodes, np.dot(transform_matrix, model_transform))
 
-        correct_scene = Scene()
+        incorrect_images = self.render_views(scene)
+        return correct_images, incorrect_images
 
-        for metadata_json in metadata_jsons:
-            correct_scene = self.set_mesh(correct_scene, metadata_json)
+    def render_views(self, scene):
+        images = []
+        for camera_transform in self.get_camera_transforms():
+            scene.camera_transform = camera_transform
+            images.append(self.render_backend.render(scene, background=[255, 255, 255, 0], cull=True))
 
-        for camera_transform in camera_transforms:
-            tmp_scene = correct_scene.copy()
-            tmp_scene.camera_transform = camera_transform
-            correct_scenes.append(tmp_scene)
+        return images
 
-        incorrect_scene = Scene()
+    def compose_scene(self, scene_id, transform_categories):
+        scene = Scene()
+        transformed_objects = []
+        scene_json = self.get_scene_metadata(scene_id)
 
-        for metadata_json in metadata_jsons:
-            incorrect_scene = self.set_mesh(incorrect_scene, metadata_json, transform_categories, transform_matrix)
+        for index, metadata_json in enumerate(scene_json['objects']):
+            result = self.set_mesh(scene, metadata_json, index)
+            if result is None:
+                continue
 
-        for camera_transform in camera_transforms:
-            tmp_scene = incorrect_scene.copy()
-            tmp_scene.camera_transform = camera_transform
-            incorrect_scenes.append(tmp_scene)
+            nodes, model_transform = result
+            if self._categories[metadata_json['modelID']] in transform_categories:
+                transformed_objects.append((nodes, model_transform))
 
-        return correct_scenes, incorrect_scenes
+        return scene, transformed_objects
 
-    def set_mesh(self, scene, metadata_json, transform_categories=None, transform_matrix=None):
+    def set_mesh(self, scene, metadata_json, index):
         id = metadata_json['modelID']
         if id is None or id == '':
             return None
@@ -136,16 +238,11 @@ class Scenes3D:
         if not os.path.exists(obj_path):
             return None
 
-        obj_trimesh = trimesh.load(obj_path)
+        # The cached model is shared, its placement is kept on the scene graph nodes
+        obj_trimesh = self.load_model(id, copy=False)
         transformation_matrix = np.reshape(metadata_json['transform'], (4, 4)).T
-        obj_trimesh.apply_transform(transformation_matrix)
-        if transform_categories is not None \
-                and transform_matrix is not None \
-                and self._categories[id] in transform_categories:
-            obj_trimesh.apply_transform(transform_matrix)
-
-        scene.add_geometry(obj_trimesh)
-        return scene
+        nodes = MeshUtils.add_model(scene, obj_trimesh, '{}_{}'.format(id, index), transformation_matrix)
+        return nodes, transformation_matrix
 
     def get_camera_transforms(self):
         return [np.array([[1., 0., 0., 123.09577675],
@@ -1,5 +1,6 @@
 import argparse
 
+from data_generation.base_generator import BaseGenerator
 from data_generation.bounding_box_replace import BoundingBoxReplace
 from data_generation.front_future_3d_render import FrontFuture3DRender
 from data_generation.front_model_render import FrontModelRender
@@ -16,6 +17,7 @@ from datasets.object_net_3d import ObjectNet3D
 from datasets.scenes_3d import Scenes3D
 from datasets.test_dataset import TestDataset
 from input_handler import InputHandler
+from utils.render_backends import RenderBackend
 
 import numpy as np
 
@@ -32,25 +34,50 @@ parser.add_argument('-p', '--data_path', default='./data')
 parser.add_argument('-c', '--count', default=10000)
 parser.add_argument('-m', '--generate_compare', default='true')
 parser.add_argument('-b', '--back_object', choices=['none', 'black', 'inpaint'], default='black')
+parser.add_argument('-r', '--render_backend', choices=['trimesh', 'numpy'], default='trimesh')
+parser.add_argument('--disk_mesh_cache', default=False, type=InputHandler.str2bool,
+                    help='Keep parsed 3D-FUTURE meshes on disk, keyed by file content, for later runs')
+parser.add_argument('--coco_images', default=None,
+                    help='Local MSCOCO images, a train2017 folder or a tar shard (or a folder of shards)')
+parser.add_argument('--coco_images_layout', choices=['folder', 'tar'], default='folder')
+parser.add_argument('--coco_download', default=True, type=InputHandler.str2bool,
+                    help='Download MSCOCO images missing from the local store')
+parser.add_argument('-w', '--workers', default=1, type=InputHandler.validate_positive_integer,
+                    help='Worker processes for the bboxreplace and segreplace generators')
+parser.add_argument('-o', '--output_format', choices=['files', 'tar', 'tfrecord'], default='files',
+                    help='Write generated images as single files or pack them into tar / TFRecord shards')
+parser.add_argument('--shard_size', default=1000, type=InputHandler.validate_positive_integer,
+                    help='Samples per output shard')
+parser.add_argument('--image_format', choices=['png', 'webp', 'jpg'], default='png',
+                    help='Codec of the generated images, webp is lossless')
+parser.add_argument('--png_compress_level', default=6, type=int, choices=range(10), metavar='[0-9]')
+parser.add_argument('--jpeg_quality', default=95, type=int, choices=range(1, 101), metavar='[1-100]')
+parser.add_argument('--encode_workers', default=4, type=InputHandler.validate_non_negative_integer,
+                    help='Threads encoding and writing images while the next ones are generated, 0 writes inline')
+parser.add_argument('--mesh_cache_mb', default=2048, type=InputHandler.validate_positive_integer,
+                    help='Memory budget of the in process 3D-FUTURE mesh cache')
 
 args = parser.parse_args()
 user_count = InputHandler.validate_positive_integer(args.count)
 user_generate_comparison = InputHandler.str2bool(args.generate_compare)
 user_data_path = args.data_path
+render_backend = RenderBackend.create(args.render_backend)
 
 InputHandler.print_params(args)
 
 dataset = None
 if args.dataset == 'mscoco':
-    dataset = Mscoco(user_data_path, [1, 2, 3, 4, 5, 6, 7, 8, 9])
+    dataset = Mscoco(user_data_path, [1, 2, 3, 4, 5, 6, 7, 8, 9], images_root=args.coco_images,
+                     images_layout=args.coco_images_layout, allow_download=args.coco_download)
 elif args.dataset == 'object_net_3d':
-    dataset = ObjectNet3D(user_data_path)
+    dataset = ObjectNet3D(user_data_path, render_backend)
 elif args.dataset == 'test':
     dataset = TestDataset(user_data_path)
 elif args.dataset == 'front_future':
-    dataset = FrontFuture3D(user_data_path)
+    FrontFuture3D.mesh_cache.max_bytes = args.mesh_cache_mb * 1024 ** 2
+    dataset = FrontFuture3D(user_data_path, render_backend, disk_mesh_cache=args.disk_mesh_cache)
 elif args.dataset == 'scenes_3d':
-    dataset = Scenes3D(user_data_path)
+    dataset = Scenes3D(user_data_path, render_backend)
 
 dataset.initialize()
 
@@ -83,4 +110,16 @@ elif args.generation_type == 'front_model_render':
 elif args.generation_type == 'future_classification':
     generator = Future3DClassification(user_data_path)
 
-generator.generate(user_count)
+if isinstance(generator, BaseGenerator):
+    generator.set_image_encoder(args.image_format, args.png_compress_level, args.jpeg_quality, args.encode_workers)
+
+if args.output_format != 'files' and isinstance(generator, BaseGenerator):
+    generator.set_output_shards(args.output_format, args.shard_size)
+
+generate_params = {'workers': args.workers} if isinstance(generator, BoundingBoxReplace) else {}
+if isinstance(generator, BaseGenerator):
+    # Metadata rows are buffered by the generator, leaving the block writes the remaining rows
+    with generator:
+        generator.generate(user_count, **generate_params)
+else:
+    generator.generate(user_count)
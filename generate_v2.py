@@ -2,18 +2,52 @@ import argparse
 
 from data_generation.scenes_3d_bbox_render_random import Scenes3DBboxRenderRandom
 from data_generation.scenes_3d_bbox_render_transform import Scenes3DBboxRenderTransform
+from input_handler import InputHandler
+from utils.parallel_utils import ParallelUtils
 
 parser = argparse.ArgumentParser(description='Data Generation Tool V2')
 parser.add_argument('-d', '--data_dir', default='./data')
 parser.add_argument('-t', '--type', default='', choices=['scenes_3d_bbox_render_transform',
                                                          'scenes_3d_bbox_render_random'])
+parser.add_argument('-b', '--bbox_mode', default='projection', choices=['projection', 'render', 'validate', 'instance'])
+parser.add_argument('-w', '--workers', default=1, type=InputHandler.validate_positive_integer)
+parser.add_argument('-s', '--shard', default=None, type=InputHandler.parse_shard,
+                    help='Generate only the i-th of k deterministic scene shards, given as i/k')
+parser.add_argument('-r', '--render_backend', default='trimesh', choices=['trimesh', 'numpy'])
+parser.add_argument('-o', '--output_format', default='files', choices=['files', 'tar', 'tfrecord'],
+                    help='Write renders as single files or pack them into tar / TFRecord shards')
+parser.add_argument('--shard_size', default=1000, type=InputHandler.validate_positive_integer,
+                    help='Renders per output shard')
+parser.add_argument('--image_format', choices=['png', 'webp', 'jpg'], default='png',
+                    help='Codec of the generated images, webp is lossless')
+parser.add_argument('--png_compress_level', default=6, type=int, choices=range(10), metavar='[0-9]')
+parser.add_argument('--jpeg_quality', default=95, type=int, choices=range(1, 101), metavar='[1-100]')
+parser.add_argument('--encode_workers', default=4, type=InputHandler.validate_non_negative_integer,
+                    help='Threads encoding and writing images while the next ones are generated, 0 writes inline')
+parser.add_argument('--skip_hidden_scenes', default=False, type=InputHandler.str2bool,
+                    help='Skip scenes whose transformed objects are outside every camera view, before rendering')
 args = parser.parse_args()
 
 generator = None
 if args.type == 'scenes_3d_bbox_render_transform':
-    generator = Scenes3DBboxRenderTransform(args.data_dir)
+    generator = Scenes3DBboxRenderTransform(args.data_dir, bbox_mode=args.bbox_mode,
+                                            render_backend=args.render_backend, output_format=args.output_format,
+                                            shard_size=args.shard_size, image_format=args.image_format,
+                                            compress_level=args.png_compress_level, quality=args.jpeg_quality,
+                                            encode_workers=args.encode_workers,
+                                            skip_hidden_scenes=args.skip_hidden_scenes)
 elif args.type == 'scenes_3d_bbox_render_random':
-    generator = Scenes3DBboxRenderRandom(args.data_dir)
+    generator = Scenes3DBboxRenderRandom(args.data_dir, bbox_mode=args.bbox_mode,
+                                         render_backend=args.render_backend, output_format=args.output_format,
+                                         shard_size=args.shard_size, image_format=args.image_format,
+                                         compress_level=args.png_compress_level, quality=args.jpeg_quality,
+                                         encode_workers=args.encode_workers,
+                                         skip_hidden_scenes=args.skip_hidden_scenes)
 
 generator.initialize()
-generator.generate()
+
+scene_ids = generator.dataset.get_scene_ids()
+if args.shard is not None:
+    scene_ids = ParallelUtils.shard(scene_ids, args.shard[0], args.shard[1])
+
+generator.generate(scene_ids, workers=args.workers)
@@ -0,0 +1,24 @@
+import argparse
+
+from datasets.front_future_3d import FrontFuture3D
+from datasets.scenes_3d import Scenes3D
+from input_handler import InputHandler
+
+parser = argparse.ArgumentParser(description='Build the per model geometry bounds index')
+parser.add_argument('-d', '--dataset', choices=['scenes_3d', 'front_future'], default='scenes_3d')
+parser.add_argument('-p', '--data_path', default='./data')
+parser.add_argument('-w', '--workers', default=1, type=InputHandler.validate_positive_integer)
+parser.add_argument('-f', '--force', default=False, type=InputHandler.str2bool,
+                    help='Index every model again, even if its source did not change')
+args = parser.parse_args()
+
+InputHandler.print_params(args)
+
+dataset = None
+if args.dataset == 'scenes_3d':
+    dataset = Scenes3D(args.data_path)
+elif args.dataset == 'front_future':
+    dataset = FrontFuture3D(args.data_path)
+
+dataset.bounds_index.build(dataset.get_model_sources(), mesh_store=dataset.mesh_store, workers=args.workers,
+                           force=args.force)
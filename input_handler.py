@@ -30,6 +30,25 @@ class InputHandler:
             raise argparse.ArgumentTypeError("{} is an invalid positive int value".format(x))
         return xt
 
+    @staticmethod
+    def validate_non_negative_integer(x):
+        xt = int(x)
+        if xt < 0:
+            raise argparse.ArgumentTypeError("{} is an invalid non negative int value".format(x))
+        return xt
+
+    @staticmethod
+    def parse_shard(x):
+        try:
+            shard_index, shard_count = [int(i) for i in x.split('/')]
+        except ValueError:
+            raise argparse.ArgumentTypeError("{} is an invalid shard, expected i/k".format(x))
+
+        if shard_count <= 0 or shard_index < 0 or shard_index >= shard_count:
+            raise argparse.ArgumentTypeError("{} is an invalid shard, expected 0 <= i < k".format(x))
+
+        return shard_index, shard_count
+
     @staticmethod
     def to_array(x):
         if not isinstance(x, (list, tuple)):
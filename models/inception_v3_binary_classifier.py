@@ -5,6 +5,8 @@ from tensorflow.keras import layers
 from tensorflow.keras import Model
 import pandas as pd
 
+from utils.shard_loader import ShardLoader
+
 
 class InceptionV3BinaryClassifier:
     def __init__(self, train_metadata_path, eval_metadata_path, image_size, learning_rate=0.0001, dropout_rate=0.2, loss='binary_crossentropy', batch_size=20, train_all=False):
@@ -33,6 +35,14 @@ class InceptionV3BinaryClassifier:
                                            horizontal_flip=True)
         eval_datagen = ImageDataGenerator(rescale=1.0/255.)
 
+        if ShardLoader.has_shards(self.train_metadata_path):
+            # Generated images packed into shards are read shard by shard instead of file by file
+            train_loader = ShardLoader(self.train_metadata_path, 'is_correct', self.image_size, self.batch_size,
+                                       train_datagen, shuffle_buffer=1000)
+            validation_loader = ShardLoader(self.eval_metadata_path, 'is_correct', self.image_size, self.batch_size,
+                                            eval_datagen, class_indices=train_loader.class_indices)
+            return train_loader.get_dataset(), validation_loader.get_dataset()
+
         train_generator = train_datagen.flow_from_dataframe(df_train,
                                                             x_col='path',
                                                             y_col='is_correct',
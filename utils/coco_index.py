@@ -0,0 +1,186 @@
+import json
+import os
+
+import numpy as np
+from pycocotools import mask as mask_utils
+
+
+class CocoIndex:
+    # Bump whenever the layout of the index files changes
+    version = 1
+
+    _columns = ['image_ids', 'image_rows', 'widths', 'heights', 'file_names', 'coco_urls', 'image_ann_offsets',
+               'ann_ids', 'ann_image_ids', 'ann_category_ids', 'bboxes', 'areas', 'iscrowd', 'rle_offsets',
+               'rle_blob', 'category_ids', 'category_rows', 'category_image_offsets', 'category_image_ids']
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        self._meta_path = os.path.join(index_dir, 'meta.json')
+        self.categories = None
+        self._arrays = None
+
+    def load_or_build(self, annotation_file):
+        if not self.load(annotation_file):
+            self.build(annotation_file)
+            if not self.load(annotation_file):
+                raise Exception('Failed to load COCO index from {}'.format(self.index_dir))
+
+    def load(self, annotation_file):
+        if not os.path.exists(self._meta_path):
+            return False
+
+        with open(self._meta_path) as f:
+            meta = json.load(f)
+
+        if meta.get('version') != CocoIndex.version or meta.get('source') != CocoIndex._get_signature(annotation_file):
+            return False
+
+        self.categories = [tuple(c) for c in meta['categories']]
+        # Every column is memory mapped, only the pages a lookup touches are read from disk
+        self._arrays = {column: np.load(os.path.join(self.index_dir, column + '.npy'), mmap_mode='r')
+                        for column in CocoIndex._columns}
+        return True
+
+    def build(self, annotation_file):
+        print('Building COCO index for {} into {}'.format(annotation_file, self.index_dir))
+        with open(annotation_file) as f:
+            dataset = json.load(f)
+
+        images = sorted(dataset['images'], key=lambda image: image['id'])
+        image_ids = np.array([image['id'] for image in images], dtype=np.int64)
+        image_rows = np.full(int(image_ids.max()) + 1 if len(image_ids) else 0, -1, dtype=np.int32)
+        image_rows[image_ids] = np.arange(len(image_ids))
+        sizes = {image['id']: (image['height'], image['width']) for image in images}
+
+        # Stable sort keeps the annotation file order inside every image, the order pycocotools returns them in
+        annotations = dataset['annotations']
+        ann_image_ids = np.array([a['image_id'] for a in annotations], dtype=np.int64)
+        order = np.argsort(ann_image_ids, kind='stable')
+        annotations = [annotations[i] for i in order]
+        ann_image_ids = ann_image_ids[order]
+
+        rle_offsets = np.zeros(len(annotations) + 1, dtype=np.int64)
+        rles = []
+        for i, annotation in enumerate(annotations):
+            height, width = sizes[annotation['image_id']]
+            counts = CocoIndex._to_rle(annotation['segmentation'], height, width)['counts']
+            rles.append(counts)
+            rle_offsets[i + 1] = rle_offsets[i] + len(counts)
+
+        categories = sorted(dataset['categories'], key=lambda category: category['id'])
+        category_ids = np.array([c['id'] for c in categories], dtype=np.int64)
+        category_rows = np.full(int(category_ids.max()) + 1 if len(category_ids) else 0, -1, dtype=np.int32)
+        category_rows[category_ids] = np.arange(len(category_ids))
+        ann_category_ids = np.array([a['category_id'] for a in annotations], dtype=np.int64)
+
+        category_images = [np.unique(ann_image_ids[ann_category_ids == category_id]) for category_id in category_ids]
+        category_image_offsets = np.zeros(len(category_ids) + 1, dtype=np.int64)
+        category_image_offsets[1:] = np.cumsum([len(ids) for ids in category_images])
+
+        arrays = {
+            'image_ids': image_ids,
+            'image_rows': image_rows,
+            'widths': np.array([image['width'] for image in images], dtype=np.int64),
+            'heights': np.array([image['height'] for image in images], dtype=np.int64),
+            'file_names': np.array([image['file_name'].encode('utf-8') for image in images]),
+            'coco_urls': np.array([image.get('coco_url', '').encode('utf-8') for image in images]),
+            'image_ann_offsets': np.append(np.searchsorted(ann_image_ids, image_ids), len(annotations)),
+            'ann_ids': np.array([a['id'] for a in annotations], dtype=np.int64),
+            'ann_image_ids': ann_image_ids,
+            'ann_category_ids': ann_category_ids,
+            'bboxes': np.array([a['bbox'] for a in annotations], dtype=np.float64).reshape((-1, 4)),
+            'areas': np.array([a['area'] for a in annotations], dtype=np.float64),
+            'iscrowd': np.array([a.get('iscrowd', 0) for a in annotations], dtype=np.int8),
+            'rle_offsets': rle_offsets,
+            'rle_blob': np.frombuffer(b''.join(rles), dtype=np.uint8),
+            'category_ids': category_ids,
+            'category_rows': category_rows,
+            'category_image_offsets': category_image_offsets,
+            'category_image_ids': np.concatenate(category_images) if category_images else np.zeros(0, np.int64)
+        }
+
+        os.makedirs(self.index_dir, exist_ok=True)
+        for column, array in arrays.items():
+            temp_path = os.path.join(self.index_dir, '{}.{}.tmp'.format(column, os.getpid()))
+            with open(temp_path, 'wb') as f:
+                np.save(f, array)
+
+            os.replace(temp_path, os.path.join(self.index_dir, column + '.npy'))
+
+        # The meta file is written last, so a partially written index is never loaded
+        meta = {'version': CocoIndex.version, 'source': CocoIndex._get_signature(annotation_file),
+                'categories': [[c['id'], c['name'], c.get('supercategory', '')] for c in categories]}
+        temp_path = self._meta_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(meta, f)
+
+        os.replace(temp_path, self._meta_path)
+
+    @staticmethod
+    def _get_signature(annotation_file):
+        return [os.path.getmtime(annotation_file), os.path.getsize(annotation_file)]
+
+    @staticmethod
+    def _to_rle(segmentation, height, width):
+        # Same conversion as COCO.annToRLE, stored compressed
+        if isinstance(segmentation, list):
+            return mask_utils.merge(mask_utils.frPyObjects(segmentation, height, width))
+
+        if isinstance(segmentation['counts'], list):
+            return mask_utils.frPyObjects(segmentation, height, width)
+
+        return segmentation
+
+    def get_column(self, column):
+        return self._arrays[column]
+
+    def get_image_row(self, image_id):
+        image_rows = self._arrays['image_rows']
+        if image_id < 0 or image_id >= len(image_rows) or image_rows[image_id] < 0:
+            raise Exception('Image {} does not exists in COCO index'.format(image_id))
+
+        return int(image_rows[image_id])
+
+    def get_image_info(self, image_id):
+        row = self.get_image_row(image_id)
+        return {'id': image_id, 'width': int(self._arrays['widths'][row]),
+                'height': int(self._arrays['heights'][row]),
+                'file_name': self._arrays['file_names'][row].decode('utf-8'),
+                'coco_url': self._arrays['coco_urls'][row].decode('utf-8')}
+
+    def get_annotation_indices(self, image_id, category_ids=None):
+        # Row numbers into the annotation columns, in the order getAnnIds returns them
+        row = self.get_image_row(image_id)
+        offsets = self._arrays['image_ann_offsets']
+        indices = np.arange(offsets[row], offsets[row + 1])
+        if category_ids:
+            indices = indices[np.isin(self._arrays['ann_category_ids'][indices], category_ids)]
+
+        return indices
+
+    def get_image_ids(self, category_ids=None):
+        # Same semantics as COCO.getImgIds, images that hold every one of the given categories
+        if not category_ids:
+            return np.array(self._arrays['image_ids'])
+
+        category_rows = self._arrays['category_rows']
+        offsets = self._arrays['category_image_offsets']
+        result = None
+        for category_id in category_ids:
+            row = category_rows[category_id] if 0 <= category_id < len(category_rows) else -1
+            if row < 0:
+                return np.zeros(0, dtype=np.int64)
+
+            image_ids = self._arrays['category_image_ids'][offsets[row]:offsets[row + 1]]
+            result = np.array(image_ids) if result is None else np.intersect1d(result, image_ids, assume_unique=True)
+
+        return result
+
+    def get_rle(self, annotation_index):
+        row = self.get_image_row(int(self._arrays['ann_image_ids'][annotation_index]))
+        offsets = self._arrays['rle_offsets']
+        counts = self._arrays['rle_blob'][offsets[annotation_index]:offsets[annotation_index + 1]].tobytes()
+        return {'size': [int(self._arrays['heights'][row]), int(self._arrays['widths'][row])], 'counts': counts}
+
+    def ann_to_mask(self, annotation_index):
+        return mask_utils.decode(self.get_rle(annotation_index))
@@ -1,3 +1,5 @@
+import hashlib
+import json
 import os
 import sys
 import tarfile
@@ -81,3 +83,30 @@ class FilesUtils:
     def read_file(path):
         with open(path) as f:
             return f.read().splitlines()
+
+    @staticmethod
+    def get_file_hash(path, chunk_size=1024 * 1024):
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+
+        return digest.hexdigest()
+
+    @staticmethod
+    def merge_json_files(input_dir, output_path):
+        merged = []
+        for file_name in sorted(os.listdir(input_dir)):
+            if not file_name.endswith('.json'):
+                continue
+
+            with open(os.path.join(input_dir, file_name)) as f:
+                merged.append(json.load(f))
+
+        # Write next to the target and rename, so readers never see a partially written file
+        temp_path = output_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(merged, f)
+
+        os.replace(temp_path, output_path)
+        return len(merged)
@@ -0,0 +1,130 @@
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+from PIL import Image
+
+
+class ImageEncoder:
+    # Encodes and writes images on a bounded thread pool. Pillow releases the GIL while compressing, so the
+    # next render runs while the previous images are encoded. At most max_pending images wait in the pool,
+    # submit blocks once it is full so memory stays bounded
+    formats = {'png': 'PNG', 'webp': 'WEBP', 'jpg': 'JPEG'}
+
+    def __init__(self, image_format='png', compress_level=6, quality=95, workers=4, max_pending=None):
+        if image_format not in ImageEncoder.formats:
+            raise Exception('Unknown image format "{}"'.format(image_format))
+
+        self.image_format = image_format
+        self.extension = image_format
+        # compress_level is the zlib level of png images (0-9), quality is the jpg quality (1-100),
+        # webp images are always lossless
+        self.compress_level = compress_level
+        self.quality = quality
+        self.workers = workers
+        self.max_pending = max_pending if max_pending is not None else 2 * max(workers, 1)
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._futures = set()
+        self._lock = threading.Lock()
+        self._error = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_params(self):
+        return {'image_format': self.image_format, 'compress_level': self.compress_level, 'quality': self.quality,
+                'workers': self.workers, 'max_pending': self.max_pending}
+
+    def get_save_params(self):
+        if self.image_format == 'png':
+            return {'compress_level': self.compress_level}
+        if self.image_format == 'webp':
+            return {'lossless': True}
+
+        return {'quality': self.quality}
+
+    def encode(self, img):
+        buffer = io.BytesIO()
+        self._save(ImageEncoder._to_image(img), buffer)
+        return buffer.getvalue()
+
+    def save(self, img, path):
+        # Written under a temporary name and renamed, an interrupted run never leaves a partial image
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        self._save(ImageEncoder._to_image(img), temp_path)
+        os.replace(temp_path, path)
+        return path
+
+    def submit(self, img, path):
+        # The image is written in the background, wait (or close) returns once it is on disk
+        self._raise_error()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if self.workers == 0:
+            return self.save(img, path)
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+
+        # Arrays are copied, callers may reuse their buffers once submit returns
+        if isinstance(img, np.ndarray):
+            img = img.copy()
+
+        self._slots.acquire()
+        future = self._executor.submit(self.save, img, path)
+        with self._lock:
+            self._futures.add(future)
+
+        future.add_done_callback(self._on_done)
+        return path
+
+    def wait(self):
+        with self._lock:
+            futures = list(self._futures)
+
+        wait(futures)
+        self._raise_error()
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def _save(self, img, fp):
+        # jpg has no alpha channel, transparent renders are saved without it
+        if self.image_format == 'jpg' and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+
+        img.save(fp, format=ImageEncoder.formats[self.image_format], **self.get_save_params())
+
+    def _on_done(self, future):
+        with self._lock:
+            self._futures.discard(future)
+            if future.exception() is not None and self._error is None:
+                self._error = future.exception()
+
+        self._slots.release()
+
+    def _raise_error(self):
+        # Errors of background writes are raised on the next call of the generator thread
+        with self._lock:
+            error = self._error
+            self._error = None
+
+        if error is not None:
+            raise error
+
+    @staticmethod
+    def _to_image(img):
+        if isinstance(img, Image.Image):
+            return img
+
+        return Image.fromarray(img)
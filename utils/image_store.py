@@ -0,0 +1,169 @@
+import io
+import json
+import os
+import tarfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from PIL import Image
+
+
+class ImageStore:
+    # 'folder' reads <root>/<file_name> (an extracted train2017 folder), 'tar' reads members of a tar file or of
+    # every *.tar shard in the root directory
+    layouts = ['folder', 'tar']
+
+    def __init__(self, root, layout='folder', allow_download=False, cache_size=64, workers=4):
+        if layout not in ImageStore.layouts:
+            raise Exception('Unknown image store layout "{}"'.format(layout))
+
+        self.root = root
+        self.layout = layout
+        self.allow_download = allow_download
+        self.cache_size = cache_size
+        self.workers = workers
+        self.hits = 0
+        self.misses = 0
+        self._images = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._tar_members = None
+
+    def get(self, file_name, url=None):
+        with self._lock:
+            if file_name in self._images:
+                self._images.move_to_end(file_name)
+                self.hits += 1
+                return self._images[file_name]
+
+            future = self._pending.get(file_name)
+
+        # Another thread is already reading this image, wait for it instead of reading it twice
+        if future is not None:
+            return future.result()
+
+        img = self._read(file_name, url)
+        with self._lock:
+            self.misses += 1
+            self._images[file_name] = img
+            if len(self._images) > self.cache_size:
+                self._images.popitem(last=False)
+
+        return img
+
+    def prefetch(self, files):
+        # files is a list of (file_name, url), images are read in the background into the cache
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers)
+
+            for file_name, url in files:
+                if file_name in self._images or file_name in self._pending:
+                    continue
+
+                future = self._executor.submit(self._prefetch, file_name, url)
+                self._pending[file_name] = future
+
+    def _prefetch(self, file_name, url):
+        try:
+            img = self._read(file_name, url)
+            with self._lock:
+                self._images[file_name] = img
+                if len(self._images) > self.cache_size:
+                    self._images.popitem(last=False)
+
+            return img
+        finally:
+            with self._lock:
+                self._pending.pop(file_name, None)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def get_stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._images)}
+
+    def _read(self, file_name, url):
+        data = self._read_local(file_name)
+        if data is None:
+            if not self.allow_download or url is None:
+                raise Exception('Image {} does not exists in image store {}'.format(file_name, self.root))
+
+            response = requests.get(url)
+            response.raise_for_status()
+            data = response.content
+            # Read through, the downloaded image is kept for the next runs
+            if self.layout == 'folder':
+                self._write_local(file_name, data)
+
+        return np.array(Image.open(io.BytesIO(data)))
+
+    def _read_local(self, file_name):
+        if self.layout == 'folder':
+            path = os.path.join(self.root, file_name)
+            if not os.path.exists(path):
+                return None
+
+            with open(path, 'rb') as f:
+                return f.read()
+
+        member = self._get_tar_members().get(file_name)
+        if member is None:
+            return None
+
+        tar_path, offset, size = member
+        with open(tar_path, 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def _write_local(self, file_name, data):
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, file_name)
+        temp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+
+        os.replace(temp_path, path)
+
+    def _get_tar_members(self):
+        with self._lock:
+            if self._tar_members is None:
+                if os.path.isdir(self.root):
+                    tar_paths = [os.path.join(self.root, f) for f in sorted(os.listdir(self.root)) if f.endswith('.tar')]
+                else:
+                    tar_paths = [self.root]
+
+                members = {}
+                for tar_path in tar_paths:
+                    members.update(ImageStore._index_tar(tar_path))
+
+                self._tar_members = members
+
+        return self._tar_members
+
+    @staticmethod
+    def _index_tar(tar_path):
+        # Member offsets are saved next to the shard, so only the first run scans the tar headers
+        index_path = tar_path + '.index.json'
+        if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(tar_path):
+            with open(index_path) as f:
+                return {name: (tar_path, offset, size) for name, (offset, size) in json.load(f).items()}
+
+        index = {}
+        with tarfile.open(tar_path, 'r:') as tar:
+            for member in tar:
+                if member.isfile():
+                    index[os.path.basename(member.name)] = (member.offset_data, member.size)
+
+        temp_path = '{}.{}.tmp'.format(index_path, os.getpid())
+        with open(temp_path, 'w') as f:
+            json.dump(index, f)
+
+        os.replace(temp_path, index_path)
+        return {name: (tar_path, offset, size) for name, (offset, size) in index.items()}
@@ -0,0 +1,82 @@
+from collections import OrderedDict
+
+from utils.mesh_utils import MeshUtils
+
+
+class MeshCache:
+    def __init__(self, max_size=256, max_bytes=None):
+        # Either limit may be None, the least recently used meshes are evicted once any limit is exceeded
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._meshes = OrderedDict()
+        self._sizes = {}
+        self._total_bytes = 0
+
+    def get(self, key, loader, copy=True):
+        if key in self._meshes:
+            self._meshes.move_to_end(key)
+            self.hits += 1
+            mesh = self._meshes[key]
+        else:
+            self.misses += 1
+            mesh = loader()
+            self._meshes[key] = mesh
+            self._sizes[key] = MeshCache.get_size(mesh)
+            self._total_bytes += self._sizes[key]
+            self._evict()
+
+        # Callers that mutate the mesh (apply_transform, materials) must get their own copy
+        if copy:
+            return mesh.copy()
+
+        return mesh
+
+    def _evict(self):
+        # The newest mesh is always kept, even when it alone is over the memory budget
+        while len(self._meshes) > 1 and \
+                ((self.max_size is not None and len(self._meshes) > self.max_size) or
+                 (self.max_bytes is not None and self._total_bytes > self.max_bytes)):
+            key, _ = self._meshes.popitem(last=False)
+            self._total_bytes -= self._sizes.pop(key)
+            self.evictions += 1
+
+    @staticmethod
+    def get_size(model):
+        size = 0
+        textures = {}
+        for _, mesh in MeshUtils.get_meshes(model):
+            for name in ('vertices', 'faces'):
+                if hasattr(mesh, name):
+                    size += getattr(mesh, name).nbytes
+
+            visual = getattr(mesh, 'visual', None)
+            uv = getattr(visual, 'uv', None)
+            if uv is not None:
+                size += uv.nbytes
+
+            image = getattr(getattr(visual, 'material', None), 'image', None)
+            if image is not None:
+                textures[id(image)] = image.size[0] * image.size[1] * len(image.getbands())
+
+        return size + sum(textures.values())
+
+    def clear(self):
+        self._meshes.clear()
+        self._sizes.clear()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self._meshes),
+                'bytes': self._total_bytes}
+
+    def __len__(self):
+        return len(self._meshes)
+
+    def __contains__(self, key):
+        return key in self._meshes
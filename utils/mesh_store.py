@@ -0,0 +1,278 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import struct
+
+import numpy as np
+import trimesh
+from PIL import Image
+from tqdm import tqdm
+from trimesh import Scene
+from trimesh.visual.material import PBRMaterial, SimpleMaterial
+
+
+class MeshStore:
+    # Every model file starts with the magic, the header length and a json header describing the raw arrays
+    _magic = b'MESHSTR1'
+    _alignment = 16
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self._index_path = os.path.join(store_dir, 'index.json')
+        self._textures_dir = os.path.join(store_dir, 'textures')
+        self._index = None
+
+    def get_index(self):
+        if self._index is None:
+            if os.path.exists(self._index_path):
+                with open(self._index_path) as f:
+                    self._index = json.load(f)
+            else:
+                self._index = {}
+
+        return self._index
+
+    def __contains__(self, model_id):
+        return model_id in self.get_index()
+
+    def __len__(self):
+        return len(self.get_index())
+
+    def load(self, model_id, fallback_path=None):
+        if model_id not in self.get_index():
+            if fallback_path is None:
+                raise Exception('Model {} does not exists in mesh store {}'.format(model_id, self.store_dir))
+
+            return trimesh.load(fallback_path)
+
+        entry = self.get_index()[model_id]
+        return self.load_file(os.path.join(self.store_dir, entry['file']), entry['source'])
+
+    def load_file(self, path, source_path):
+        header, geometries = self.load_file_arrays(path)
+        meshes = []
+        for geometry_header, arrays in zip(header['geometries'], geometries):
+            mesh = self._create_mesh(arrays, geometry_header['material'])
+            # Callers match geometries by the source file name, the same way they do for trimesh.load results
+            mesh.metadata['file_name'] = os.path.basename(source_path)
+            mesh.metadata['file_path'] = source_path
+            meshes.append((geometry_header, mesh))
+
+        if not header['scene']:
+            return meshes[0][1]
+
+        scene = Scene()
+        for geometry_header, mesh in meshes:
+            scene.add_geometry(mesh, node_name=geometry_header['node'], geom_name=geometry_header['name'],
+                               transform=np.reshape(geometry_header['transform'], (4, 4)))
+
+        return scene
+
+    def load_arrays(self, model_id):
+        return self.load_file_arrays(os.path.join(self.store_dir, self.get_index()[model_id]['file']))
+
+    def load_file_arrays(self, path):
+        # Array views over the memory mapped file, nothing is parsed or copied until it is used
+        data = np.memmap(path, dtype=np.uint8, mode='r')
+        header_length = struct.unpack('<Q', data[len(MeshStore._magic):len(MeshStore._magic) + 8].tobytes())[0]
+        header_start = len(MeshStore._magic) + 8
+        header = json.loads(data[header_start:header_start + header_length].tobytes().decode('utf-8'))
+
+        geometries = []
+        for geometry_header in header['geometries']:
+            arrays = {}
+            for name, array_header in geometry_header['arrays'].items():
+                dtype = np.dtype(array_header['dtype'])
+                count = int(np.prod(array_header['shape']))
+                start = array_header['offset']
+                arrays[name] = data[start:start + count * dtype.itemsize].view(dtype).reshape(array_header['shape'])
+
+            geometries.append(arrays)
+
+        return header, geometries
+
+    def _create_mesh(self, arrays, material_header):
+        visual = None
+        if 'uv' in arrays:
+            visual = trimesh.visual.TextureVisuals(uv=arrays['uv'], material=self._create_material(material_header))
+        elif 'vertex_colors' in arrays:
+            visual = trimesh.visual.ColorVisuals(vertex_colors=arrays['vertex_colors'])
+        elif 'face_colors' in arrays:
+            visual = trimesh.visual.ColorVisuals(face_colors=arrays['face_colors'])
+        elif material_header is not None:
+            visual = trimesh.visual.TextureVisuals(material=self._create_material(material_header))
+
+        return trimesh.Trimesh(vertices=arrays['vertices'], faces=arrays['faces'],
+                               vertex_normals=arrays.get('vertex_normals'), visual=visual, process=False)
+
+    def _create_material(self, material_header):
+        if material_header is None:
+            return None
+
+        image = None
+        if material_header['image'] is not None:
+            image = Image.open(os.path.join(self._textures_dir, material_header['image']))
+
+        if material_header['type'] == 'pbr':
+            return PBRMaterial(baseColorFactor=material_header['base_color'], baseColorTexture=image)
+
+        return SimpleMaterial(image=image, ambient=material_header['ambient'], diffuse=material_header['diffuse'],
+                              specular=material_header['specular'], glossiness=material_header['glossiness'])
+
+    def convert(self, model_sources, workers=1, force=False):
+        # model_sources is a list of (model_id, obj path), models whose source did not change are skipped
+        os.makedirs(self._textures_dir, exist_ok=True)
+        index = self.get_index()
+        pending = []
+        for model_id, source_path in model_sources:
+            entry = index.get(model_id)
+            if force or entry is None or entry['source_mtime'] != os.path.getmtime(source_path):
+                pending.append((model_id, source_path))
+
+        print('Converting {} of {} models into {}'.format(len(pending), len(model_sources), self.store_dir))
+        if workers > 1:
+            with multiprocessing.Pool(workers) as pool:
+                results = list(tqdm(pool.imap_unordered(self._convert_model, pending), total=len(pending)))
+        else:
+            results = [self._convert_model(source) for source in tqdm(pending)]
+
+        failed = 0
+        for model_id, entry in results:
+            if entry is None:
+                failed += 1
+            else:
+                index[model_id] = entry
+
+        self._save_index()
+        print('Mesh store holds {} models, failed to convert {}'.format(len(index), failed))
+
+    def _convert_model(self, model_source):
+        model_id, source_path = model_source
+        try:
+            model = trimesh.load(source_path)
+            file_name = hashlib.sha1(model_id.encode('utf-8')).hexdigest() + '.mesh'
+            self.write(os.path.join(self.store_dir, file_name), model)
+        except Exception as e:
+            print('Failed to convert model {}: {}'.format(model_id, e))
+            return model_id, None
+
+        return model_id, {'file': file_name, 'source': source_path, 'source_mtime': os.path.getmtime(source_path)}
+
+    def write(self, path, model):
+        geometries = []
+        blobs = []
+        for node_name, geometry_name, transform, mesh in MeshStore._get_geometries(model):
+            if not hasattr(mesh, 'faces'):
+                continue
+
+            arrays = {'vertices': np.asarray(mesh.vertices, dtype=np.float32),
+                      'faces': np.asarray(mesh.faces, dtype=np.int32),
+                      'vertex_normals': np.asarray(mesh.vertex_normals, dtype=np.float32)}
+
+            material = None
+            visual = mesh.visual
+            if visual.kind == 'texture' or hasattr(visual, 'material'):
+                material = self._write_material(visual.material)
+                if getattr(visual, 'uv', None) is not None:
+                    arrays['uv'] = np.asarray(visual.uv, dtype=np.float32)
+            elif visual.kind == 'vertex':
+                arrays['vertex_colors'] = np.asarray(visual.vertex_colors, dtype=np.uint8)
+            elif visual.kind == 'face':
+                arrays['face_colors'] = np.asarray(visual.face_colors, dtype=np.uint8)
+
+            geometries.append({'node': node_name, 'name': geometry_name, 'material': material, 'arrays': arrays,
+                               'transform': np.asarray(transform).flatten().tolist()})
+
+        header = {'scene': isinstance(model, Scene), 'geometries': geometries}
+
+        # Offsets are relative to the file start, so the header length has to be known before placing the arrays
+        offset = 0
+        for geometry in geometries:
+            for name, array in geometry['arrays'].items():
+                offset = MeshStore._align(offset)
+                blobs.append((offset, array))
+                geometry['arrays'][name] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+                offset += array.nbytes
+
+        data_start = 0
+        while True:
+            header_bytes = json.dumps(MeshStore._shift(header, data_start)).encode('utf-8')
+            header_end = len(MeshStore._magic) + 8 + len(header_bytes)
+            if header_end <= data_start:
+                break
+
+            data_start = MeshStore._align(header_end)
+
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'wb') as f:
+            f.write(MeshStore._magic)
+            f.write(struct.pack('<Q', len(header_bytes)))
+            f.write(header_bytes)
+            for blob_offset, array in blobs:
+                f.seek(data_start + blob_offset)
+                f.write(np.ascontiguousarray(array).tobytes())
+
+        os.replace(temp_path, path)
+
+    def _write_material(self, material):
+        if isinstance(material, PBRMaterial):
+            base_color = material.baseColorFactor
+            return {'type': 'pbr', 'image': self._write_texture(material.baseColorTexture),
+                    'base_color': None if base_color is None else np.asarray(base_color).tolist()}
+
+        return {'type': 'simple', 'image': self._write_texture(getattr(material, 'image', None)),
+                'ambient': np.asarray(material.ambient).tolist(), 'diffuse': np.asarray(material.diffuse).tolist(),
+                'specular': np.asarray(material.specular).tolist(), 'glossiness': float(material.glossiness)}
+
+    def _write_texture(self, image):
+        if image is None:
+            return None
+
+        # Textures are shared between many models, so they are stored once under their content hash
+        digest = hashlib.sha1(image.tobytes())
+        digest.update('{}{}'.format(image.mode, image.size).encode('utf-8'))
+        file_name = digest.hexdigest() + '.png'
+        path = os.path.join(self._textures_dir, file_name)
+        if not os.path.exists(path):
+            os.makedirs(self._textures_dir, exist_ok=True)
+            temp_path = path + '.{}.tmp'.format(os.getpid())
+            image.save(temp_path, format='PNG')
+            os.replace(temp_path, path)
+
+        return file_name
+
+    def _save_index(self):
+        temp_path = self._index_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.get_index(), f)
+
+        os.replace(temp_path, self._index_path)
+
+    @staticmethod
+    def _get_geometries(model):
+        if not isinstance(model, Scene):
+            return [('geometry_0', 'geometry_0', np.eye(4), model)]
+
+        geometries = []
+        for node_name in model.graph.nodes_geometry:
+            transform, geometry_name = model.graph[node_name]
+            geometries.append((node_name, geometry_name, transform, model.geometry[geometry_name]))
+
+        return geometries
+
+    @staticmethod
+    def _shift(header, data_start):
+        shifted = dict(header)
+        shifted['geometries'] = []
+        for geometry in header['geometries']:
+            geometry = dict(geometry)
+            geometry['arrays'] = {name: dict(array, offset=array['offset'] + data_start)
+                                  for name, array in geometry['arrays'].items()}
+            shifted['geometries'].append(geometry)
+
+        return shifted
+
+    @staticmethod
+    def _align(offset):
+        return (offset + MeshStore._alignment - 1) // MeshStore._alignment * MeshStore._alignment
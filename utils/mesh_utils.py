@@ -0,0 +1,55 @@
+import numpy as np
+from trimesh import Scene
+from trimesh.transformations import transform_points
+
+
+class MeshUtils:
+    @staticmethod
+    def get_meshes(model):
+        if not isinstance(model, Scene):
+            return [(np.eye(4), model)]
+
+        meshes = []
+        for node_name in model.graph.nodes_geometry:
+            transform, geometry_name = model.graph[node_name]
+            meshes.append((transform, model.geometry[geometry_name]))
+
+        return meshes
+
+    @staticmethod
+    def get_vertices_and_faces(model, transform=None):
+        vertices = []
+        faces = []
+        offset = 0
+        for mesh_transform, mesh in MeshUtils.get_meshes(model):
+            # Skip paths and point clouds, only triangle meshes are rendered
+            if not hasattr(mesh, 'faces'):
+                continue
+
+            if transform is not None:
+                mesh_transform = np.dot(transform, mesh_transform)
+
+            vertices.append(transform_points(mesh.vertices, mesh_transform))
+            faces.append(mesh.faces + offset)
+            offset += len(mesh.vertices)
+
+        if not vertices:
+            return np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64)
+
+        return np.vstack(vertices), np.vstack(faces)
+
+    @staticmethod
+    def add_model(scene, model, node_name, transform):
+        # The transform is kept on the scene graph nodes, the model vertices are never rewritten
+        nodes = []
+        for i, (mesh_transform, mesh) in enumerate(MeshUtils.get_meshes(model)):
+            mesh_node_name = '{}_{}'.format(node_name, i)
+            scene.add_geometry(mesh, node_name=mesh_node_name, transform=np.dot(transform, mesh_transform))
+            nodes.append((mesh_node_name, mesh_transform))
+
+        return nodes
+
+    @staticmethod
+    def set_model_transform(scene, nodes, transform):
+        for node_name, mesh_transform in nodes:
+            scene.graph.update(frame_to=node_name, matrix=np.dot(transform, mesh_transform))
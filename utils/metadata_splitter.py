@@ -0,0 +1,127 @@
+import csv
+import hashlib
+import json
+import os
+
+
+class MetadataSplitter:
+    # Splits a metadata csv into train / eval / test files by a stable hash of a grouping column, every row of a
+    # group (for example the edited and random images of one image id) lands in the same split on every run.
+    # Rows are streamed line by line, and the rows appended since the previous run are the only ones read again
+    # Bumped whenever get_split changes, split files made by another version are written again
+    version = 1
+
+    def __init__(self, metadata_path, output_dir, group_key='image_id', splits=None, salt=''):
+        self.metadata_path = metadata_path
+        self.output_dir = output_dir
+        self.group_key = group_key
+        self.splits = splits if splits is not None else [('train', 0.7), ('eval', 0.25), ('test', 0.05)]
+        # Prefixed to every group before hashing, a different salt gives a different assignment of the groups
+        self.salt = salt
+        self.state_path = os.path.join(output_dir, 'metadata_split.json')
+
+    def get_split_path(self, name):
+        return os.path.join(self.output_dir, 'metadata_{}.csv'.format(name))
+
+    def get_split(self, group):
+        # First 8 bytes of the md5 digest as a fraction in [0, 1), unlike hash() it is the same in every process
+        key = '{}{}'.format(self.salt, group)
+        value = int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big') / 2 ** 64
+        threshold = 0
+        for name, fraction in self.splits:
+            threshold += fraction
+            if value < threshold:
+                return name
+
+        return self.splits[-1][0]
+
+    def split(self):
+        if not os.path.exists(self.metadata_path):
+            return
+
+        state = self._load_state()
+        split_files = {}
+        try:
+            with open(self.metadata_path, 'rb') as metadata_file:
+                header = metadata_file.readline()
+                if not header.endswith(b'\n'):
+                    return
+
+                columns = next(csv.reader([header.decode('utf-8')]))
+                if self.group_key not in columns:
+                    raise Exception('Metadata {} has no "{}" column'.format(self.metadata_path, self.group_key))
+
+                group_index = columns.index(self.group_key)
+                for name, _ in self.splits:
+                    split_files[name] = self._open_split(name, header, state)
+
+                offset = state['offset'] if state is not None else metadata_file.tell()
+                metadata_file.seek(offset)
+                for line in metadata_file:
+                    # A partial last row is still being written, it is split on the next run
+                    if not line.endswith(b'\n'):
+                        break
+
+                    offset += len(line)
+                    row = next(csv.reader([line.decode('utf-8')]), None)
+                    if not row:
+                        continue
+
+                    split_files[self.get_split(row[group_index])].write(line)
+
+            sizes = {}
+            for name, split_file in split_files.items():
+                split_file.flush()
+                os.fsync(split_file.fileno())
+                sizes[name] = split_file.tell()
+        finally:
+            for split_file in split_files.values():
+                split_file.close()
+
+        self._save_state({'version': MetadataSplitter.version, 'offset': offset, 'sizes': sizes,
+                          'group_key': self.group_key, 'splits': [list(split) for split in self.splits],
+                          'salt': self.salt})
+
+    def _open_split(self, name, header, state):
+        path = self.get_split_path(name)
+        if state is None:
+            split_file = open(path, 'wb')
+            split_file.write(header)
+            return split_file
+
+        # Rows written after the last saved state are cut, they are split again from the saved offset
+        split_file = open(path, 'rb+')
+        split_file.truncate(state['sizes'][name])
+        split_file.seek(0, os.SEEK_END)
+        return split_file
+
+    def _load_state(self):
+        # The saved state is used only if it was made with the same settings and the metadata was only appended to
+        if not os.path.exists(self.state_path):
+            return None
+
+        with open(self.state_path) as f:
+            state = json.load(f)
+
+        if state.get('version') != MetadataSplitter.version or state.get('salt') != self.salt:
+            return None
+
+        if state['group_key'] != self.group_key or state['splits'] != [list(split) for split in self.splits]:
+            return None
+
+        if os.path.getsize(self.metadata_path) < state['offset']:
+            return None
+
+        for name, size in state['sizes'].items():
+            path = self.get_split_path(name)
+            if not os.path.exists(path) or os.path.getsize(path) < size:
+                return None
+
+        return state
+
+    def _save_state(self, state):
+        temp_path = '{}.{}.tmp'.format(self.state_path, os.getpid())
+        with open(temp_path, 'w') as f:
+            json.dump(state, f)
+
+        os.replace(temp_path, self.state_path)
@@ -0,0 +1,146 @@
+import csv
+import io
+import os
+import time
+
+
+class MetadataWriter:
+    # Appends csv rows in batches through a single open file. Rows are identified by their key column, rows
+    # already in the file are not written again, so an interrupted run can be resumed without duplicates
+    def __init__(self, path, header, key='path', flush_rows=1000, flush_seconds=30, before_flush=None):
+        self.path = path
+        self.header = header
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        # Called before rows are written, callers finish the outputs the rows point to there
+        self.before_flush = before_flush
+        self._key_index = header.index(key)
+        self._rows = []
+        self._keys = set()
+        self._file = None
+        self._last_flush = time.time()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        if self._file is not None:
+            return
+
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        MetadataWriter._repair(self.path)
+        self._keys.update(MetadataWriter.read_keys(self.path, self.header[self._key_index]))
+        self._file = open(self.path, 'a', newline='')
+        if self._file.tell() == 0:
+            self._rows.insert(0, self.header)
+            self.flush()
+
+        self._last_flush = time.time()
+
+    def write_row(self, row):
+        self.open()
+        key = str(row[self._key_index])
+        if key in self._keys:
+            return False
+
+        self._keys.add(key)
+        self._rows.append(row)
+        # Without flush_rows and flush_seconds rows are written only by explicit flush and close calls
+        if self.flush_rows is not None and len(self._rows) >= self.flush_rows:
+            self.flush()
+        elif self.flush_seconds is not None and time.time() - self._last_flush >= self.flush_seconds:
+            self.flush()
+
+        return True
+
+    def contains(self, key):
+        self.open()
+        return str(key) in self._keys
+
+    def add_keys(self, keys):
+        # Keys written by other writers, for example the merged metadata of previous runs
+        self._keys.update(str(key) for key in keys)
+
+    def flush(self):
+        # Buffered rows are written with a single write and synced, so a checkpoint holds only whole rows
+        if self._file is None:
+            return
+
+        if self._rows:
+            if self.before_flush is not None:
+                self.before_flush()
+
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(self._rows)
+            self._file.write(buffer.getvalue())
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._rows = []
+
+        self._last_flush = time.time()
+
+    def close(self):
+        if self._file is None:
+            return
+
+        self.flush()
+        self._file.close()
+        self._file = None
+
+    @staticmethod
+    def read_rows(path):
+        # Header and complete rows of a metadata file, a partial last row of an interrupted write is skipped
+        if not os.path.exists(path):
+            return None, []
+
+        with open(path, newline='') as f:
+            content = f.read()
+
+        if not content.endswith('\n'):
+            content = content[:content.rfind('\n') + 1]
+
+        rows = list(csv.reader(io.StringIO(content)))
+        if not rows:
+            return None, []
+
+        return rows[0], rows[1:]
+
+    @staticmethod
+    def read_keys(path, key='path'):
+        header, rows = MetadataWriter.read_rows(path)
+        if header is None or key not in header:
+            return set()
+
+        key_index = header.index(key)
+        return set(row[key_index] for row in rows if len(row) > key_index)
+
+    @staticmethod
+    def _repair(path):
+        # A run killed in the middle of a write leaves a partial last row, it is cut before appending again
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return
+
+        with open(path, 'rb+') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) == b'\n':
+                return
+
+            size = f.seek(0, os.SEEK_END)
+            position = size
+            while position > 0:
+                step = min(65536, position)
+                f.seek(position - step)
+                newline = f.read(step).rfind(b'\n')
+                if newline >= 0:
+                    position = position - step + newline + 1
+                    break
+
+                position -= step
+
+            f.truncate(position)
@@ -0,0 +1,149 @@
+import functools
+import multiprocessing
+import os
+
+import numpy as np
+import trimesh
+from tqdm import tqdm
+from trimesh.transformations import transform_points
+
+from utils.mesh_utils import MeshUtils
+
+
+class ModelBoundsIndex:
+    _columns = ['bounds', 'centroids', 'vertex_counts', 'face_counts', 'file_sizes', 'source_mtimes']
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self._rows = None
+        self._arrays = None
+
+    def _load(self):
+        if self._rows is not None:
+            return
+
+        self._rows = {}
+        self._arrays = ModelBoundsIndex._empty_arrays()
+
+        if os.path.exists(self.index_path):
+            with np.load(self.index_path) as data:
+                self._rows = {model_id: i for i, model_id in enumerate(data['model_ids'].tolist())}
+                self._arrays = {column: data[column] for column in ModelBoundsIndex._columns}
+
+    @staticmethod
+    def _empty_arrays():
+        return {'bounds': np.zeros((0, 2, 3)), 'centroids': np.zeros((0, 3)),
+                'vertex_counts': np.zeros(0, dtype=np.int64), 'face_counts': np.zeros(0, dtype=np.int64),
+                'file_sizes': np.zeros(0, dtype=np.int64), 'source_mtimes': np.zeros(0)}
+
+    def __contains__(self, model_id):
+        self._load()
+        return model_id in self._rows
+
+    def __len__(self):
+        self._load()
+        return len(self._rows)
+
+    def get(self, model_id):
+        self._load()
+        row = self._rows.get(model_id)
+        if row is None:
+            return None
+
+        return {column: self._arrays[column][row] for column in ModelBoundsIndex._columns}
+
+    def get_bounds(self, model_id):
+        self._load()
+        row = self._rows.get(model_id)
+        if row is None:
+            return None
+
+        return self._arrays['bounds'][row]
+
+    def get_face_count(self, model_id, default=0):
+        self._load()
+        row = self._rows.get(model_id)
+        if row is None:
+            return default
+
+        return int(self._arrays['face_counts'][row])
+
+    def get_transformed_corners(self, model_id, transform):
+        bounds = self.get_bounds(model_id)
+        if bounds is None:
+            return None
+
+        return transform_points(trimesh.bounds.corners(bounds), transform)
+
+    def build(self, model_sources, mesh_store=None, workers=1, force=False):
+        # model_sources is a list of (model_id, model path), models whose source did not change are kept
+        self._load()
+        pending = [(model_id, model_path) for model_id, model_path in model_sources
+                   if force or model_id not in self._rows or
+                   self._arrays['source_mtimes'][self._rows[model_id]] != os.path.getmtime(model_path)]
+
+        print('Indexing {} of {} models into {}'.format(len(pending), len(model_sources), self.index_path))
+        compute = functools.partial(ModelBoundsIndex._compute_entry, mesh_store)
+        if workers > 1:
+            with multiprocessing.Pool(workers) as pool:
+                results = list(tqdm(pool.imap_unordered(compute, pending), total=len(pending)))
+        else:
+            results = [compute(source) for source in tqdm(pending)]
+
+        entries = {model_id: self.get(model_id) for model_id in self._rows}
+        failed = 0
+        for model_id, entry in results:
+            if entry is None:
+                failed += 1
+            else:
+                entries[model_id] = entry
+
+        self._save(entries)
+        print('Bounds index holds {} models, failed to index {}'.format(len(entries), failed))
+
+    @staticmethod
+    def _compute_entry(mesh_store, model_source):
+        model_id, model_path = model_source
+        try:
+            if mesh_store is not None:
+                model = mesh_store.load(model_id, model_path)
+            else:
+                model = trimesh.load(model_path)
+
+            vertices, faces = MeshUtils.get_vertices_and_faces(model)
+        except Exception as e:
+            print('Failed to index model {}: {}'.format(model_id, e))
+            return model_id, None
+
+        if len(vertices) == 0:
+            bounds = np.zeros((2, 3))
+            centroid = np.zeros(3)
+        else:
+            bounds = np.array([np.min(vertices, axis=0), np.max(vertices, axis=0)])
+            # Area weighted like trimesh centroid, so dense tessellation does not pull the center
+            triangles = vertices[faces]
+            areas = np.linalg.norm(np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]),
+                                   axis=1)
+            if np.sum(areas) > 0:
+                centroid = np.sum(np.mean(triangles, axis=1) * areas[:, None], axis=0) / np.sum(areas)
+            else:
+                centroid = np.mean(vertices, axis=0)
+
+        return model_id, {'bounds': bounds, 'centroids': centroid, 'vertex_counts': len(vertices),
+                          'face_counts': len(faces), 'file_sizes': os.path.getsize(model_path),
+                          'source_mtimes': os.path.getmtime(model_path)}
+
+    def _save(self, entries):
+        model_ids = sorted(entries.keys())
+        arrays = {column: np.array([entries[model_id][column] for model_id in model_ids])
+                  for column in ModelBoundsIndex._columns}
+        if not model_ids:
+            arrays = ModelBoundsIndex._empty_arrays()
+
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez(f, model_ids=np.array(model_ids, dtype=str), **arrays)
+
+        os.replace(temp_path, self.index_path)
+        self._rows = {model_id: i for i, model_id in enumerate(model_ids)}
+        self._arrays = arrays
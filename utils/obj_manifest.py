@@ -0,0 +1,133 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ObjManifest:
+    # Maps scene -> room -> obj file -> category for a <root>/<scene>/<room>/*.obj tree
+    version = 1
+    room_mesh_name = 'mesh.obj'
+
+    def __init__(self, root_dir, manifest_path, workers=16):
+        self.root_dir = root_dir
+        self.manifest_path = manifest_path
+        self.workers = workers
+        self._scenes = None
+
+    def get_scenes(self):
+        if self._scenes is None:
+            self.refresh()
+
+        return self._scenes
+
+    def refresh(self):
+        # Directory mtimes change when entries are added or removed, so only changed rooms are listed again
+        # and only new obj files are opened for their category header
+        cached_scenes = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+
+            if manifest.get('version') == ObjManifest.version and manifest.get('root_dir') == self.root_dir:
+                cached_scenes = manifest['scenes']
+
+        scene_ids = sorted(entry.name for entry in os.scandir(self.root_dir) if entry.is_dir())
+        with ThreadPoolExecutor(self.workers) as executor:
+            scenes = list(executor.map(lambda scene_id: self._scan_scene(scene_id, cached_scenes.get(scene_id)),
+                                       scene_ids))
+
+        self._scenes = dict(zip(scene_ids, scenes))
+        if self._scenes != cached_scenes:
+            self._save()
+
+    def _scan_scene(self, scene_id, cached_scene):
+        scene_dir = os.path.join(self.root_dir, scene_id)
+        scene_mtime = os.stat(scene_dir).st_mtime
+        cached_rooms = {} if cached_scene is None else cached_scene['rooms']
+        if cached_scene is not None and cached_scene['mtime'] == scene_mtime:
+            room_ids = list(cached_rooms.keys())
+        else:
+            room_ids = sorted(entry.name for entry in os.scandir(scene_dir) if entry.is_dir())
+
+        rooms = {}
+        for room_id in room_ids:
+            room_dir = os.path.join(scene_dir, room_id)
+            room_mtime = os.stat(room_dir).st_mtime
+            cached_room = cached_rooms.get(room_id)
+            if cached_room is not None and cached_room['mtime'] == room_mtime:
+                rooms[room_id] = cached_room
+                continue
+
+            cached_models = {} if cached_room is None else cached_room['models']
+            models = {}
+            for entry in sorted(os.scandir(room_dir), key=lambda e: e.name):
+                if not entry.name.endswith('.obj') or not entry.is_file():
+                    continue
+
+                if entry.name in cached_models:
+                    models[entry.name] = cached_models[entry.name]
+                else:
+                    models[entry.name] = ObjManifest.read_category(entry.path)
+
+            rooms[room_id] = {'mtime': room_mtime, 'models': models}
+
+        return {'mtime': scene_mtime, 'rooms': rooms}
+
+    def _save(self):
+        temp_path = '{}.{}.tmp'.format(self.manifest_path, os.getpid())
+        with open(temp_path, 'w') as f:
+            json.dump({'version': ObjManifest.version, 'root_dir': self.root_dir, 'scenes': self._scenes}, f)
+
+        os.replace(temp_path, self.manifest_path)
+
+    @staticmethod
+    def read_category(model_path):
+        with open(model_path) as f:
+            first_line = f.readline()
+
+        if first_line.startswith('# category='):
+            return first_line.replace('# category=', '').strip()
+
+        return None
+
+    def get_scene_ids(self):
+        return list(self.get_scenes().keys())
+
+    def get_room_ids(self, scene_id):
+        return list(self.get_scenes()[scene_id]['rooms'].keys())
+
+    def get_room_models(self, scene_id, room_id):
+        # obj file path -> category, the room mesh included
+        room_dir = os.path.join(self.root_dir, scene_id, room_id)
+        models = self.get_scenes()[scene_id]['rooms'][room_id]['models']
+        return {os.path.join(room_dir, name): category for name, category in models.items()}
+
+    def get_model_paths(self, include_room_meshes=False):
+        model_paths = []
+        for scene_id, scene in self.get_scenes().items():
+            for room_id, room in scene['rooms'].items():
+                for name in room['models']:
+                    if include_room_meshes or name != ObjManifest.room_mesh_name:
+                        model_paths.append(os.path.join(self.root_dir, scene_id, room_id, name))
+
+        return model_paths
+
+    def get_category(self, model_path):
+        relative_path = os.path.relpath(model_path, self.root_dir).split(os.sep)
+        if len(relative_path) == 3:
+            room = self.get_scenes().get(relative_path[0], {'rooms': {}})['rooms'].get(relative_path[1])
+            if room is not None and relative_path[2] in room['models']:
+                return room['models'][relative_path[2]]
+
+        return ObjManifest.read_category(model_path)
+
+    def get_categories(self):
+        categories = set()
+        for scene in self.get_scenes().values():
+            for room in scene['rooms'].values():
+                for name, category in room['models'].items():
+                    # Models without a category header are stored with None, they have no category to count
+                    if name != ObjManifest.room_mesh_name and category is not None:
+                        categories.add(category)
+
+        return categories
@@ -4,6 +4,8 @@ import numpy as np
 import trimesh
 from PIL import Image
 
+from utils.render_backends import TrimeshRenderBackend
+
 # Override trimesh internal implementation of euler_matrix to change euler angles structure
 old_euler_matrix = trimesh.transformations.euler_matrix
 
@@ -16,17 +18,18 @@ trimesh.transformations.euler_matrix = new_euler_matrix
 
 
 class ObjRender:
-    def __init__(self, obj_path, record):
-        if not os.path.exists(obj_path):
+    def __init__(self, obj_path, record, render_backend=None, meshes=None):
+        if meshes is None and not os.path.exists(obj_path):
             raise Exception('Path {} does not exists'.format(obj_path))
 
         self.record = record
-        self.meshes = trimesh.load(obj_path)
+        self.render_backend = render_backend if render_backend is not None else TrimeshRenderBackend()
+        self.meshes = meshes if meshes is not None else trimesh.load(obj_path)
         self.load_scene_params()
 
     def render(self):
-        img = Image.open(trimesh.util.wrap_as_stream(
-            self.meshes.save_image(resolution=(1000, 1000), background=[255, 255, 255, 0], flags={'cull': True})))
+        img = Image.fromarray(self.render_backend.render(self.meshes, resolution=(1000, 1000),
+                                                         background=[255, 255, 255, 0], cull=True))
         return self.crop_background(img)
 
     def show(self):
@@ -0,0 +1,76 @@
+import multiprocessing
+import multiprocessing.util
+import random
+import traceback
+import zlib
+
+import numpy as np
+from tqdm import tqdm
+
+
+class ParallelUtils:
+    # Generator owned by the current worker process, created once by the pool initializer
+    _generator = None
+    _method = None
+
+    @staticmethod
+    def shard(ids, shard_index, shard_count):
+        # crc32 is stable across processes and machines, unlike the builtin string hash
+        return [i for i in ids if zlib.crc32(str(i).encode('utf-8')) % shard_count == shard_index]
+
+    @staticmethod
+    def run(generator_class, generator_params, ids, workers, method='generate_scene', seed=None):
+        # generator_class is any callable building the generator from generator_params, every id is passed to
+        # the generator method of that name and the results of the succeeded tasks are returned in completion order.
+        # Without a seed the base seed is drawn from numpy, a seeded parent gives the same worker seeds on every run
+        if seed is None:
+            seed = int(np.random.randint(2 ** 32, dtype=np.uint64))
+
+        worker_index = multiprocessing.Value('i', 0)
+        with multiprocessing.Pool(workers, initializer=ParallelUtils._init_worker,
+                                  initargs=(generator_class, generator_params, method, seed, worker_index)) as pool:
+            outcomes = list(tqdm(pool.imap_unordered(ParallelUtils._run_task, ids), total=len(ids)))
+            # Workers exit normally instead of being terminated, so their generators get closed
+            pool.close()
+            pool.join()
+
+        failed_ids = [result for succeeded, result in outcomes if not succeeded]
+        if failed_ids:
+            print('{} of {} tasks failed: {}'.format(len(failed_ids), len(ids), failed_ids))
+
+        return [result for succeeded, result in outcomes if succeeded]
+
+    @staticmethod
+    def _init_worker(generator_class, generator_params, method, seed, worker_index):
+        # Forked workers would share the numpy state of the parent and python reseeds random from the os, every
+        # worker seeds both from the base seed and its start index so the seeds are distinct and reproducible
+        with worker_index.get_lock():
+            index = worker_index.value
+            worker_index.value += 1
+
+        worker_seed = int(np.random.SeedSequence([seed, index]).generate_state(1)[0])
+        np.random.seed(worker_seed)
+        random.seed(worker_seed)
+
+        # Every worker keeps its own dataset, mesh cache and offscreen rendering context for the whole run
+        ParallelUtils._generator = generator_class(**generator_params)
+        if hasattr(ParallelUtils._generator, 'initialize'):
+            ParallelUtils._generator.initialize()
+
+        # Generators that buffer output, like open shards, write it when the worker exits
+        if hasattr(ParallelUtils._generator, 'close'):
+            multiprocessing.util.Finalize(ParallelUtils._generator, ParallelUtils._generator.close, exitpriority=10)
+
+        ParallelUtils._method = method
+
+    @staticmethod
+    def _run_task(task_id):
+        # A raised error would terminate the pool before the worker generators are closed, failed tasks are
+        # reported by their id instead
+        try:
+            result = getattr(ParallelUtils._generator, ParallelUtils._method)(task_id)
+        except Exception:
+            traceback.print_exc()
+            return False, task_id
+
+        return True, task_id if result is None else result
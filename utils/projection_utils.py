@@ -0,0 +1,87 @@
+import numpy as np
+from trimesh.transformations import transform_points
+
+
+class ProjectionUtils:
+    @staticmethod
+    def get_render_intrinsics(camera):
+        # The offscreen viewer sets up the projection from the vertical fov and the window aspect ratio,
+        # so the horizontal focal length of camera.K is ignored by the renderer and pixels are square
+        intrinsics = np.array(camera.K, dtype=np.float64)
+        intrinsics[0, 0] = intrinsics[1, 1]
+        return intrinsics
+
+    @staticmethod
+    def to_camera_frame(points, camera_transform):
+        return transform_points(points, np.linalg.inv(camera_transform))
+
+    @staticmethod
+    def project(points, intrinsics):
+        # Camera looks down -z with +y up, image rows grow downwards
+        depth = -points[:, 2]
+        u = intrinsics[0, 2] + intrinsics[0, 0] * points[:, 0] / depth
+        v = intrinsics[1, 2] - intrinsics[1, 1] * points[:, 1] / depth
+        return u, v
+
+    @staticmethod
+    def clip_depth(points, edges, z_near, z_far):
+        depth = -points[:, 2]
+        inside = (depth >= z_near) & (depth <= z_far)
+        clipped = [points[inside]]
+
+        start = points[edges[:, 0]]
+        end = points[edges[:, 1]]
+        start_depth = depth[edges[:, 0]]
+        end_depth = depth[edges[:, 1]]
+        for plane in (z_near, z_far):
+            crossing = (start_depth - plane) * (end_depth - plane) < 0
+            if not np.any(crossing):
+                continue
+
+            t = (plane - start_depth[crossing]) / (end_depth[crossing] - start_depth[crossing])
+            clipped.append(start[crossing] + t[:, None] * (end[crossing] - start[crossing]))
+
+        return np.vstack(clipped)
+
+    @staticmethod
+    def project_bounding_box(vertices, faces, camera, camera_transform):
+        if len(vertices) == 0:
+            return None
+
+        edges = faces[:, [0, 1, 1, 2, 2, 0]].reshape((-1, 2))
+        return ProjectionUtils.project_edges(vertices, edges, camera, camera_transform)
+
+    @staticmethod
+    def project_corners(corners, camera, camera_transform):
+        # Corners in the order of trimesh.bounds.corners, bottom face, top face and then the vertical edges
+        edges = np.array([[0, 1], [1, 2], [2, 3], [3, 0], [4, 5], [5, 6], [6, 7], [7, 4],
+                          [0, 4], [1, 5], [2, 6], [3, 7]])
+        return ProjectionUtils.project_edges(corners, edges, camera, camera_transform)
+
+    @staticmethod
+    def project_edges(vertices, edges, camera, camera_transform):
+        points = ProjectionUtils.to_camera_frame(vertices, camera_transform)
+        points = ProjectionUtils.clip_depth(points, edges, camera.z_near, camera.z_far)
+        if len(points) == 0:
+            return None
+
+        u, v = ProjectionUtils.project(points, ProjectionUtils.get_render_intrinsics(camera))
+        width, height = int(camera.resolution[0]), int(camera.resolution[1])
+
+        # A pixel is covered when its center falls inside the projected geometry
+        x1 = max(int(np.ceil(np.min(u) - 0.5)), 0)
+        x2 = min(int(np.floor(np.max(u) - 0.5)), width - 1)
+        y1 = max(int(np.ceil(np.min(v) - 0.5)), 0)
+        y2 = min(int(np.floor(np.max(v) - 0.5)), height - 1)
+        if x1 > x2 or y1 > y2:
+            return None
+
+        return (x1, y1), (x2, y2)
+
+    @staticmethod
+    def compare_bounding_boxes(bbox_1, bbox_2, tolerance=2):
+        if bbox_1 is None or bbox_2 is None:
+            return bbox_1 is None and bbox_2 is None
+
+        difference = np.abs(np.array(bbox_1) - np.array(bbox_2))
+        return bool(np.all(difference <= tolerance))
@@ -0,0 +1,173 @@
+import numpy as np
+
+from utils.projection_utils import ProjectionUtils
+
+
+class Rasterizer:
+    @staticmethod
+    def clip_near(triangles, z_near):
+        # Triangles are in camera frame, a vertex is in front of the camera when -z >= z_near
+        inside = -triangles[:, :, 2] >= z_near
+        inside_count = np.sum(inside, axis=1)
+        indices = np.arange(len(triangles))
+
+        result = [triangles[inside_count == 3]]
+        sources = [indices[inside_count == 3]]
+
+        for count in (1, 2):
+            selected = inside_count == count
+            if not np.any(selected):
+                continue
+
+            # Rotate every triangle so its odd vertex (the only inside or the only outside one) comes first
+            odd_vertex = np.argmax(inside[selected], axis=1) if count == 1 else np.argmin(inside[selected], axis=1)
+            order = (odd_vertex[:, None] + np.arange(3)) % 3
+            rotated = triangles[selected][np.arange(len(order))[:, None], order]
+            a, b, c = rotated[:, 0], rotated[:, 1], rotated[:, 2]
+            ab = Rasterizer._intersect_near(a, b, z_near)
+            ac = Rasterizer._intersect_near(a, c, z_near)
+
+            if count == 1:
+                result.append(np.stack([a, ab, ac], axis=1))
+                sources.append(indices[selected])
+            else:
+                result.append(np.stack([ab, b, c], axis=1))
+                result.append(np.stack([ab, c, ac], axis=1))
+                sources.extend([indices[selected], indices[selected]])
+
+        return np.concatenate(result), np.concatenate(sources)
+
+    @staticmethod
+    def _intersect_near(start, end, z_near):
+        t = (-z_near - start[:, 2]) / (end[:, 2] - start[:, 2])
+        return start + t[:, None] * (end - start)
+
+    @staticmethod
+    def rasterize(triangles, intrinsics, resolution, z_near, z_far, cull=False, max_samples=2 ** 20):
+        width, height = int(resolution[0]), int(resolution[1])
+        depth_buffer = np.full(width * height, np.inf)
+        index_buffer = np.full(width * height, -1, dtype=np.int64)
+
+        triangles, sources = Rasterizer.clip_near(triangles, z_near)
+        if len(triangles) == 0:
+            return depth_buffer.reshape((height, width)), index_buffer.reshape((height, width))
+
+        u, v = ProjectionUtils.project(triangles.reshape((-1, 3)), intrinsics)
+        u = u.reshape((-1, 3))
+        v = v.reshape((-1, 3))
+        inverse_depth = 1.0 / -triangles[:, :, 2]
+        area = (u[:, 1] - u[:, 0]) * (v[:, 2] - v[:, 0]) - (v[:, 1] - v[:, 0]) * (u[:, 2] - u[:, 0])
+
+        # Pixels whose centers fall inside the triangle bounds
+        x_min = np.maximum(np.ceil(np.min(u, axis=1) - 0.5), 0).astype(np.int64)
+        x_max = np.minimum(np.floor(np.max(u, axis=1) - 0.5), width - 1).astype(np.int64)
+        y_min = np.maximum(np.ceil(np.min(v, axis=1) - 0.5), 0).astype(np.int64)
+        y_max = np.minimum(np.floor(np.max(v, axis=1) - 0.5), height - 1).astype(np.int64)
+
+        visible = (x_min <= x_max) & (y_min <= y_max) & (area != 0)
+        if cull:
+            # Image rows grow downwards, so counter clockwise (front facing) triangles have a negative area
+            visible &= area < 0
+
+        visible = np.where(visible)[0]
+        box_widths = x_max[visible] - x_min[visible] + 1
+        samples_count = box_widths * (y_max[visible] - y_min[visible] + 1)
+
+        start = 0
+        while start < len(visible):
+            # Take triangles until the chunk holds max_samples candidate pixels, at least one triangle
+            end = start + max(int(np.searchsorted(np.cumsum(samples_count[start:]), max_samples, side='right')), 1)
+            chunk = visible[start:end]
+            counts = samples_count[start:end]
+            widths = box_widths[start:end]
+            start = end
+
+            triangle_index = np.repeat(chunk, counts)
+            offsets = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts)
+            px = x_min[triangle_index] + offsets % np.repeat(widths, counts)
+            py = y_min[triangle_index] + offsets // np.repeat(widths, counts)
+
+            tu = u[triangle_index]
+            tv = v[triangle_index]
+            cx = px + 0.5
+            cy = py + 0.5
+            w0 = ((tu[:, 2] - tu[:, 1]) * (cy - tv[:, 1]) - (tv[:, 2] - tv[:, 1]) * (cx - tu[:, 1]))
+            w1 = ((tu[:, 0] - tu[:, 2]) * (cy - tv[:, 2]) - (tv[:, 0] - tv[:, 2]) * (cx - tu[:, 2]))
+            w2 = ((tu[:, 1] - tu[:, 0]) * (cy - tv[:, 0]) - (tv[:, 1] - tv[:, 0]) * (cx - tu[:, 0]))
+            triangle_area = area[triangle_index]
+            w0 /= triangle_area
+            w1 /= triangle_area
+            w2 /= triangle_area
+
+            # Depth is interpolated through 1/z to stay perspective correct
+            depth = 1.0 / np.sum(np.stack([w0, w1, w2], axis=1) * inverse_depth[triangle_index], axis=1)
+            inside = (w0 >= 0) & (w1 >= 0) & (w2 >= 0) & (depth <= z_far)
+            if not np.any(inside):
+                continue
+
+            pixels = (py * width + px)[inside]
+            depth = depth[inside]
+            triangle_index = triangle_index[inside]
+
+            # Keep the closest sample of every pixel in the chunk and compare it with the buffer
+            order = np.lexsort((depth, pixels))
+            pixels = pixels[order]
+            first = np.ones(len(pixels), dtype=bool)
+            first[1:] = pixels[1:] != pixels[:-1]
+            pixels = pixels[first]
+            depth = depth[order][first]
+            triangle_index = triangle_index[order][first]
+
+            closer = depth < depth_buffer[pixels]
+            depth_buffer[pixels[closer]] = depth[closer]
+            index_buffer[pixels[closer]] = sources[triangle_index[closer]]
+
+        return depth_buffer.reshape((height, width)), index_buffer.reshape((height, width))
+
+    @staticmethod
+    def render_instance_ids(instances, camera, camera_transform):
+        # instances is a list of (vertices, faces) in world coordinates, one entry per object
+        if not instances:
+            width, height = int(camera.resolution[0]), int(camera.resolution[1])
+            return np.full((height, width), -1, dtype=np.int64), np.full((height, width), np.inf)
+
+        triangles = []
+        face_instances = []
+        for instance_index, (vertices, faces) in enumerate(instances):
+            triangles.append(ProjectionUtils.to_camera_frame(vertices, camera_transform)[faces])
+            face_instances.append(np.full(len(faces), instance_index, dtype=np.int64))
+
+        face_instances = np.concatenate(face_instances)
+        depth, face_ids = Rasterizer.rasterize(np.concatenate(triangles),
+                                               ProjectionUtils.get_render_intrinsics(camera), camera.resolution,
+                                               camera.z_near, camera.z_far)
+        instance_ids = np.where(face_ids >= 0, face_instances[np.maximum(face_ids, 0)], -1)
+        return instance_ids, depth
+
+    @staticmethod
+    def decode_instance_ids(instance_ids, count, with_masks=False):
+        rows, cols = np.nonzero(instance_ids >= 0)
+        ids = instance_ids[rows, cols]
+        pixel_counts = np.bincount(ids, minlength=count)
+
+        x_min = np.full(count, np.iinfo(np.int64).max)
+        y_min = np.full(count, np.iinfo(np.int64).max)
+        x_max = np.full(count, -1)
+        y_max = np.full(count, -1)
+        np.minimum.at(x_min, ids, cols)
+        np.minimum.at(y_min, ids, rows)
+        np.maximum.at(x_max, ids, cols)
+        np.maximum.at(y_max, ids, rows)
+
+        bboxes = []
+        for i in range(count):
+            if pixel_counts[i] == 0:
+                bboxes.append(None)
+            else:
+                bboxes.append(((int(x_min[i]), int(y_min[i])), (int(x_max[i]), int(y_max[i]))))
+
+        masks = None
+        if with_masks:
+            masks = [instance_ids == i for i in range(count)]
+
+        return bboxes, pixel_counts, masks
@@ -0,0 +1,183 @@
+from abc import ABC, abstractmethod
+
+import numpy as np
+import trimesh
+from PIL import Image
+from trimesh.transformations import transform_points
+
+from utils.projection_utils import ProjectionUtils
+from utils.rasterizer import Rasterizer
+
+
+class RenderBackend(ABC):
+    @abstractmethod
+    def render(self, scene, resolution=None, background=(255, 255, 255, 0), cull=True):
+        pass
+
+    @staticmethod
+    def create(name, resolution=None):
+        if name == 'trimesh':
+            return TrimeshRenderBackend()
+        elif name == 'numpy':
+            return NumpyRenderBackend(resolution=resolution)
+
+        raise Exception('Unknown render backend "{}"'.format(name))
+
+
+class TrimeshRenderBackend(RenderBackend):
+    def render(self, scene, resolution=None, background=(255, 255, 255, 0), cull=True):
+        img = Image.open(trimesh.util.wrap_as_stream(
+            scene.save_image(resolution=resolution, background=list(background), flags={'cull': cull})))
+        return np.array(img)
+
+
+class NumpyRenderBackend(RenderBackend):
+    """Software z-buffer renderer, needs no display server or OpenGL context."""
+
+    def __init__(self, resolution=None, ambient=0.3):
+        self.resolution = resolution
+        self.ambient = ambient
+        self._textures = {}
+
+    def render(self, scene, resolution=None, background=(255, 255, 255, 0), cull=True):
+        return self.render_buffers(scene, resolution, background, cull)[0]
+
+    def render_buffers(self, scene, resolution=None, background=(255, 255, 255, 0), cull=True):
+        if resolution is None:
+            resolution = self.resolution
+
+        camera = scene.camera
+        if resolution is not None:
+            camera.resolution = resolution
+
+        width, height = int(camera.resolution[0]), int(camera.resolution[1])
+        rgba = np.empty((height, width, 4), dtype=np.uint8)
+        rgba[:] = background
+
+        meshes = []
+        node_names = []
+        for node_name in scene.graph.nodes_geometry:
+            transform, geometry_name = scene.graph[node_name]
+            mesh = scene.geometry[geometry_name]
+            if not hasattr(mesh, 'faces') or len(mesh.faces) == 0:
+                continue
+
+            meshes.append((mesh, transform))
+            node_names.append(node_name)
+
+        if not meshes:
+            return rgba, np.full((height, width), np.inf), np.full((height, width), -1, dtype=np.int64), node_names
+
+        world_to_camera = np.linalg.inv(scene.camera_transform)
+        triangles = []
+        face_meshes = []
+        for mesh_index, (mesh, transform) in enumerate(meshes):
+            vertices = transform_points(mesh.vertices, np.dot(world_to_camera, transform))
+            triangles.append(vertices[mesh.faces])
+            face_meshes.append(np.full(len(mesh.faces), mesh_index, dtype=np.int64))
+
+        triangles = np.concatenate(triangles)
+        face_meshes = np.concatenate(face_meshes)
+        face_offsets = np.cumsum([0] + [len(mesh.faces) for mesh, _ in meshes])
+
+        intrinsics = ProjectionUtils.get_render_intrinsics(camera)
+        depth, face_ids = Rasterizer.rasterize(triangles, intrinsics, camera.resolution,
+                                               camera.z_near, camera.z_far, cull=cull)
+
+        covered = face_ids >= 0
+        instance_ids = np.full(face_ids.shape, -1, dtype=np.int64)
+        if not np.any(covered):
+            return rgba, depth, instance_ids, node_names
+
+        faces = face_ids[covered]
+        pixel_meshes = face_meshes[faces]
+        instance_ids[covered] = pixel_meshes
+
+        # Rays through the pixel centers, used for shading and for barycentric coordinates on the original faces
+        rows, cols = np.nonzero(covered)
+        directions = np.stack([(cols + 0.5 - intrinsics[0, 2]) / intrinsics[0, 0],
+                               -(rows + 0.5 - intrinsics[1, 2]) / intrinsics[1, 1],
+                               -np.ones(len(rows))], axis=1)
+        directions /= np.linalg.norm(directions, axis=1)[:, None]
+        a, b, c = triangles[faces, 0], triangles[faces, 1], triangles[faces, 2]
+        barycentric = NumpyRenderBackend._ray_barycentric(directions, a, b, c)
+
+        normals = np.cross(b - a, c - a)
+        normals /= np.maximum(np.linalg.norm(normals, axis=1), 1e-12)[:, None]
+        intensity = self.ambient + (1 - self.ambient) * np.abs(np.sum(normals * directions, axis=1))
+
+        colors = np.zeros((len(faces), 4))
+        order = np.argsort(pixel_meshes, kind='stable')
+        bounds = np.searchsorted(pixel_meshes[order], np.arange(len(meshes) + 1))
+        for mesh_index, (mesh, _) in enumerate(meshes):
+            selected = order[bounds[mesh_index]:bounds[mesh_index + 1]]
+            if len(selected) == 0:
+                continue
+
+            colors[selected] = self._get_colors(mesh, faces[selected] - face_offsets[mesh_index],
+                                                barycentric[selected])
+
+        colors[:, :3] *= intensity[:, None]
+        rgba[covered] = np.clip(np.round(colors), 0, 255).astype(np.uint8)
+        return rgba, depth, instance_ids, node_names
+
+    @staticmethod
+    def _ray_barycentric(directions, a, b, c):
+        # Moller-Trumbore with the ray origin at the camera center
+        edge_1 = b - a
+        edge_2 = c - a
+        p = np.cross(directions, edge_2)
+        determinant = np.sum(edge_1 * p, axis=1)
+        determinant[determinant == 0] = 1e-12
+        t = -a
+        u = np.sum(t * p, axis=1) / determinant
+        q = np.cross(t, edge_1)
+        v = np.sum(directions * q, axis=1) / determinant
+        barycentric = np.clip(np.stack([1 - u - v, u, v], axis=1), 0, 1)
+        return barycentric / np.maximum(np.sum(barycentric, axis=1), 1e-12)[:, None]
+
+    def _get_colors(self, mesh, faces, barycentric):
+        visual = mesh.visual
+        kind = visual.kind
+        material = getattr(visual, 'material', None)
+        if kind == 'texture':
+            texture = self._get_texture(material)
+            uv = visual.uv
+            if texture is not None and uv is not None and len(uv) == len(mesh.vertices):
+                uv = np.sum(uv[mesh.faces[faces]] * barycentric[:, :, None], axis=1)
+                uv -= np.floor(uv)
+                x = np.round(uv[:, 0] * (texture.shape[1] - 1)).astype(np.int64)
+                y = np.round((1 - uv[:, 1]) * (texture.shape[0] - 1)).astype(np.int64)
+                return texture[y, x].astype(np.float64)
+        elif kind == 'vertex':
+            vertex_colors = visual.vertex_colors[mesh.faces[faces]].astype(np.float64)
+            return np.sum(vertex_colors * barycentric[:, :, None], axis=1)
+        elif kind == 'face':
+            return visual.face_colors[faces].astype(np.float64)
+
+        # Untextured materials, including the flat materials assigned by the bounding box renders
+        if material is not None:
+            color = getattr(material, 'main_color', None)
+            if color is None:
+                color = getattr(material, 'diffuse', None)
+            if color is not None:
+                return np.tile(np.array(color, dtype=np.float64), (len(faces), 1))
+
+        return np.tile(np.array(trimesh.visual.DEFAULT_COLOR, dtype=np.float64), (len(faces), 1))
+
+    def _get_texture(self, material):
+        image = getattr(material, 'image', None)
+        if image is None:
+            image = getattr(material, 'baseColorTexture', None)
+        if image is None:
+            return None
+
+        # Keep a reference to the image so its id is not reused while the converted texture is cached
+        cached = self._textures.get(id(image))
+        if cached is None or cached[0] is not image:
+            if len(self._textures) > 256:
+                self._textures.clear()
+            cached = (image, np.asarray(image.convert('RGBA')))
+            self._textures[id(image)] = cached
+
+        return cached[1]
@@ -0,0 +1,93 @@
+import numpy as np
+from pycocotools import mask as mask_utils
+
+
+class RleMask:
+    # Segmentation mask kept as COCO compressed RLE, pixels are decoded only when they are used
+    def __init__(self, rle):
+        self.rle = rle
+        self.shape = (rle['size'][0], rle['size'][1])
+
+    def decode(self):
+        return mask_utils.decode(self.rle)
+
+    def decode_crop(self, bbox):
+        # bbox is (x_min, y_min, x_max, y_max) with exclusive max, only the runs of these columns are expanded
+        height = self.shape[0]
+        x_min, y_min, x_max, y_max = [int(v) for v in bbox]
+        x_min, x_max = max(x_min, 0), min(x_max, self.shape[1])
+        y_min, y_max = max(y_min, 0), min(y_max, height)
+        if x_max <= x_min or y_max <= y_min:
+            return np.zeros((max(y_max - y_min, 0), max(x_max - x_min, 0)), dtype=np.uint8)
+
+        # Runs alternate background / foreground over the column major pixel order
+        counts = RleMask.get_counts(self.rle['counts'])
+        ends = np.cumsum(counts)
+        starts = ends - counts
+        starts, ends = starts[1::2], ends[1::2]
+
+        low, high = x_min * height, x_max * height
+        selected = (ends > low) & (starts < high)
+        diff = np.zeros(high - low + 1, dtype=np.int32)
+        np.add.at(diff, np.clip(starts[selected], low, high) - low, 1)
+        np.add.at(diff, np.clip(ends[selected], low, high) - low, -1)
+        columns = np.cumsum(diff[:-1]).astype(np.uint8).reshape((x_max - x_min, height))
+        return np.ascontiguousarray(columns.T[y_min:y_max])
+
+    def get_bbox(self):
+        # Inclusive pixel bounds (x_min, y_min, x_max, y_max), the same as SegmentationUtils.get_bbox
+        x, y, w, h = [int(v) for v in mask_utils.toBbox(self.rle)]
+        return x, y, x + w - 1, y + h - 1
+
+    def get_area(self):
+        return int(mask_utils.area(self.rle))
+
+    @staticmethod
+    def get_bboxes(masks):
+        # (N, 4) COCO [x, y, w, h] boxes of many masks in a single call
+        if len(masks) == 0:
+            return np.zeros((0, 4))
+
+        return mask_utils.toBbox([mask.rle for mask in masks])
+
+    @staticmethod
+    def get_areas(masks):
+        if len(masks) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        return mask_utils.area([mask.rle for mask in masks]).astype(np.int64)
+
+    @staticmethod
+    def stack(masks):
+        return np.dstack([mask.decode() for mask in masks])
+
+    @staticmethod
+    def get_counts(counts):
+        # Uncompress the LEB128 like counts string of COCO RLE, the same as rleFrString in the COCO mask api
+        if isinstance(counts, list):
+            return np.array(counts, dtype=np.int64)
+
+        if isinstance(counts, str):
+            counts = counts.encode('ascii')
+
+        result = []
+        position = 0
+        while position < len(counts):
+            value = 0
+            shift = 0
+            more = True
+            while more:
+                c = counts[position] - 48
+                value |= (c & 0x1f) << shift
+                more = c & 0x20
+                position += 1
+                shift += 5
+                if not more and c & 0x10:
+                    value |= -1 << shift
+
+            if len(result) > 2:
+                value += result[-2]
+
+            result.append(value)
+
+        return np.array(result, dtype=np.int64)
@@ -17,6 +17,18 @@ class SegmentationUtils:
 
         return seg_map
 
+    @staticmethod
+    def segmentation_masks_to_map(masks):
+        # Same map as segmentation_mask_to_map for a list of RleMask, decoded one at a time instead of stacked
+        seg_map = None
+        for i, mask in enumerate(masks):
+            if seg_map is None:
+                seg_map = np.zeros(mask.shape, dtype=np.uint8)
+
+            seg_map[mask.decode() == 1] = i
+
+        return seg_map
+
     @staticmethod
     def segmentation_map_to_color_map(seg_map):
         color_map = cm.get_cmap('jet', 3)
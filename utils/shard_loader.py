@@ -0,0 +1,144 @@
+import io
+import os
+import tarfile
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+
+class ShardLoader:
+    # Reads the samples of a shards directory written by ShardWriter, shard after shard and member after member,
+    # so every epoch is a sequential read of a few large files instead of a read per image
+    shard_extensions = ('.tar', '.tfrecord')
+    image_extensions = ('png', 'webp', 'jpg')
+
+    def __init__(self, metadata_path, y_col, image_size, batch_size=20, image_data_generator=None,
+                 shuffle_buffer=0, image_extension=None, class_indices=None):
+        # Samples are the rows of metadata_path (for example metadata_train.csv), matched to shard samples by
+        # their path column, so the train, eval and test splits share the same shards
+        self.shards_dir = ShardLoader.get_shards_dir(metadata_path)
+        self.image_size = image_size
+        self.batch_size = batch_size
+        self.image_data_generator = image_data_generator
+        self.shuffle_buffer = shuffle_buffer
+        # By default the image of a sample is its png, webp or jpg file, whichever the generator wrote
+        self.image_extension = image_extension
+
+        metadata = pd.read_csv(metadata_path)
+        labels = metadata[y_col].astype(str)
+        # Shared by all splits, a split missing a class would otherwise shift the indices of the following ones
+        if class_indices is None:
+            class_indices = ShardLoader.get_class_indices(metadata_path, y_col)
+
+        self.class_indices = class_indices
+        self.labels = dict(zip(metadata['path'].astype(str), labels.map(self.class_indices)))
+        self.samples = len(self.labels)
+
+    def __len__(self):
+        return int(np.ceil(self.samples / self.batch_size))
+
+    @staticmethod
+    def get_class_indices(metadata_path, y_col):
+        # Built from the full metadata.csv the split files were made from, same class order as flow_from_dataframe
+        full_metadata_path = os.path.join(os.path.dirname(os.path.abspath(metadata_path)), 'metadata.csv')
+        if not os.path.exists(full_metadata_path):
+            full_metadata_path = metadata_path
+
+        labels = pd.read_csv(full_metadata_path, usecols=[y_col])[y_col].astype(str)
+        return {c: i for i, c in enumerate(sorted(labels.unique()))}
+
+    @staticmethod
+    def get_shards_dir(metadata_path):
+        return os.path.join(os.path.dirname(os.path.abspath(metadata_path)), 'shards')
+
+    @staticmethod
+    def has_shards(metadata_path):
+        shards_dir = ShardLoader.get_shards_dir(metadata_path)
+        return os.path.isdir(shards_dir) and len(ShardLoader.get_shard_paths(shards_dir)) > 0
+
+    @staticmethod
+    def get_shard_paths(shards_dir):
+        return [os.path.join(shards_dir, f) for f in sorted(os.listdir(shards_dir))
+                if f.endswith(ShardLoader.shard_extensions)]
+
+    @staticmethod
+    def iter_samples(shards_dir):
+        # Yields (key, {extension: bytes}) for every complete sample in the shards
+        for shard_path in ShardLoader.get_shard_paths(shards_dir):
+            if shard_path.endswith('.tar'):
+                yield from ShardLoader._iter_tar(shard_path)
+            else:
+                yield from ShardLoader._iter_tfrecord(shard_path)
+
+    @staticmethod
+    def _iter_tar(shard_path):
+        key = None
+        files = {}
+        # Streaming mode, members are read in order without seeking back
+        with tarfile.open(shard_path, 'r|') as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+
+                directory, name = os.path.split(member.name)
+                member_key, extension = name.split('.', 1)
+                member_key = os.path.join(directory, member_key) if directory else member_key
+                if member_key != key and files:
+                    yield key, files
+                    files = {}
+
+                key = member_key
+                files[extension] = tar.extractfile(member).read()
+
+        if files:
+            yield key, files
+
+    @staticmethod
+    def _iter_tfrecord(shard_path):
+        import tensorflow as tf
+        for record in tf.data.TFRecordDataset(shard_path).as_numpy_iterator():
+            example = tf.train.Example.FromString(record)
+            features = example.features.feature
+            files = {name: feature.bytes_list.value[0] for name, feature in features.items() if name != '__key__'}
+            yield features['__key__'].bytes_list.value[0].decode('utf-8'), files
+
+    def iter_images(self):
+        # (image, label) of every sample in the metadata, resized like load_img and transformed like the
+        # ImageDataGenerator of the matching flow_from_dataframe call
+        for key, files in ShardLoader.iter_samples(self.shards_dir):
+            label = self.labels.get(key)
+            image_extension = self.get_image_extension(files)
+            if label is None or image_extension is None:
+                continue
+
+            image = Image.open(io.BytesIO(files[image_extension])).convert('RGB')
+            image = image.resize((self.image_size, self.image_size), Image.NEAREST)
+            x = np.asarray(image, dtype=np.float32)
+            if self.image_data_generator is not None:
+                x = self.image_data_generator.random_transform(x)
+                x = self.image_data_generator.standardize(x)
+
+            yield x, np.float32(label)
+
+    def get_image_extension(self, files):
+        if self.image_extension is not None:
+            return self.image_extension if self.image_extension in files else None
+
+        for image_extension in ShardLoader.image_extensions:
+            if image_extension in files:
+                return image_extension
+
+        return None
+
+    def get_dataset(self):
+        import tensorflow as tf
+        dataset = tf.data.Dataset.from_generator(
+            self.iter_images, output_types=(tf.float32, tf.float32),
+            output_shapes=((self.image_size, self.image_size, 3), ()))
+        if self.shuffle_buffer > 0:
+            dataset = dataset.shuffle(self.shuffle_buffer)
+
+        dataset = dataset.batch(self.batch_size)
+        dataset = dataset.apply(tf.data.experimental.assert_cardinality(len(self)))
+        return dataset.prefetch(tf.data.experimental.AUTOTUNE)
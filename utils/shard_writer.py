@@ -0,0 +1,104 @@
+import io
+import os
+import re
+import tarfile
+import time
+
+
+class ShardWriter:
+    # 'tar' writes WebDataset style shards, the files of a sample are adjacent members named <key>.<extension>.
+    # 'tfrecord' writes one tf.train.Example per sample with a bytes feature per extension and the key
+    formats = ['tar', 'tfrecord']
+    extensions = {'tar': 'tar', 'tfrecord': 'tfrecord'}
+
+    def __init__(self, shards_dir, shard_format='tar', max_samples=1000, max_bytes=1024 ** 3, prefix='shard',
+                 on_shard_closed=None):
+        if shard_format not in ShardWriter.formats:
+            raise Exception('Unknown shard format "{}"'.format(shard_format))
+
+        self.shards_dir = shards_dir
+        self.shard_format = shard_format
+        self.max_samples = max_samples
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        # Called with the shard path once a shard is complete, callers commit their metadata of its samples there
+        self.on_shard_closed = on_shard_closed
+        self._shard = None
+        self._shard_path = None
+        self._temp_path = None
+        self._samples = 0
+        self._bytes = 0
+        self._next_index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, key, files):
+        # files maps an extension to the encoded bytes, for example {'png': ..., 'json': ...}
+        if '.' in os.path.basename(key):
+            raise Exception('Shard sample key "{}" can not contain a dot'.format(key))
+
+        if self._shard is None:
+            self._open_shard()
+
+        if self.shard_format == 'tar':
+            for extension, data in files.items():
+                info = tarfile.TarInfo('{}.{}'.format(key, extension))
+                info.size = len(data)
+                info.mtime = time.time()
+                self._shard.addfile(info, io.BytesIO(data))
+        else:
+            self._shard.write(ShardWriter._to_example(key, files))
+
+        self._samples += 1
+        self._bytes += sum(len(data) for data in files.values())
+        if self._samples >= self.max_samples or (self.max_bytes is not None and self._bytes >= self.max_bytes):
+            self.close()
+
+    def close(self):
+        if self._shard is None:
+            return
+
+        self._shard.close()
+        self._shard = None
+        # Only complete shards get their final name, a shard of an interrupted run stays a .tmp file
+        os.replace(self._temp_path, self._shard_path)
+        if self.on_shard_closed is not None:
+            self.on_shard_closed(self._shard_path)
+
+    def _open_shard(self):
+        os.makedirs(self.shards_dir, exist_ok=True)
+        if self._next_index is None:
+            self._next_index = self._get_next_index()
+
+        extension = ShardWriter.extensions[self.shard_format]
+        self._shard_path = os.path.join(self.shards_dir,
+                                        '{}-{}.{}'.format(self.prefix, str(self._next_index).zfill(6), extension))
+        self._temp_path = '{}.{}.tmp'.format(self._shard_path, os.getpid())
+        self._next_index += 1
+        self._samples = 0
+        self._bytes = 0
+        if self.shard_format == 'tar':
+            self._shard = tarfile.open(self._temp_path, 'w')
+        else:
+            import tensorflow as tf
+            self._shard = tf.io.TFRecordWriter(self._temp_path)
+
+    def _get_next_index(self):
+        # Shards of earlier runs are kept, numbering continues after the last one with the same prefix
+        pattern = re.compile(r'^{}-(\d+)\.'.format(re.escape(self.prefix)))
+        indices = [int(match.group(1)) for match in map(pattern.match, os.listdir(self.shards_dir))
+                   if match is not None and not match.string.endswith('.tmp')]
+        return max(indices) + 1 if indices else 0
+
+    @staticmethod
+    def _to_example(key, files):
+        import tensorflow as tf
+        features = {'__key__': tf.train.Feature(bytes_list=tf.train.BytesList(value=[key.encode('utf-8')]))}
+        for extension, data in files.items():
+            features[extension] = tf.train.Feature(bytes_list=tf.train.BytesList(value=[data]))
+
+        return tf.train.Example(features=tf.train.Features(feature=features)).SerializeToString()
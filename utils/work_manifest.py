@@ -0,0 +1,50 @@
+import os
+
+from utils.metadata_writer import MetadataWriter
+
+
+class WorkManifest:
+    # Ids of completed work units (scenes, models, images) in append-only logs under manifest_dir. All logs of the
+    # directory are loaded into memory on open, every process appends to a log of its own, so parallel workers
+    # never write to the same file. A unit is marked done only after all of its outputs were written
+    def __init__(self, manifest_dir, name='manifest', flush_units=1000, flush_seconds=30, before_flush=None):
+        self.manifest_dir = manifest_dir
+        self.path = os.path.join(manifest_dir, name + '.csv')
+        # before_flush is called before units are written, callers write the outputs of the units there
+        self._writer = MetadataWriter(self.path, ['unit_id'], key='unit_id', flush_rows=flush_units,
+                                      flush_seconds=flush_seconds, before_flush=before_flush)
+        self._opened = False
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        if self._opened:
+            return
+
+        self._writer.open()
+        for log_name in sorted(os.listdir(self.manifest_dir)):
+            log_path = os.path.join(self.manifest_dir, log_name)
+            if log_name.endswith('.csv') and log_path != self.path:
+                self._writer.add_keys(MetadataWriter.read_keys(log_path, 'unit_id'))
+
+        self._opened = True
+
+    def is_done(self, unit_id):
+        self.open()
+        return self._writer.contains(unit_id)
+
+    def mark_done(self, unit_id):
+        self.open()
+        self._writer.write_row([unit_id])
+
+    def flush(self):
+        self._writer.flush()
+
+    def close(self):
+        self._writer.close()
+        self._opened = False